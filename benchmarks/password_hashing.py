@@ -0,0 +1,65 @@
+"""
+Measure bcrypt throughput at each work factor, inline and on the password hashing pools.
+
+For every cost this reports how long one hash takes, then how many hashes per second a pool
+of --workers threads and a pool of --workers processes sustain, and that throughput divided
+by the number of workers (hashes/sec per core). Use it to pick BCRYPT_LOG_ROUNDS: each step
+doubles the cost, and a login costs one hash.
+
+Usage:
+    python benchmarks/password_hashing.py --costs 10 11 12 13 --seconds 3
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flaskblog.passwords import hash_password  # noqa: E402
+
+
+def throughput(executor, cost, workers, seconds):
+    """
+    Keep a pool busy hashing for a while and count the hashes.
+
+    :param executor: The pool to hash on.
+    :param cost: The bcrypt work factor.
+    :param workers: The pool's size; twice as many hashes are kept in flight.
+    :param seconds: How long to keep hashing.
+    :return: The number of hashes per second.
+    """
+    # Warm the pool up, so starting workers isn't measured
+    list(executor.map(hash_password, ['warm-up'] * workers, [4] * workers))
+    done, start = 0, time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        batch = workers * 2
+        list(executor.map(hash_password, ['correct horse battery staple'] * batch, [cost] * batch))
+        done += batch
+    return done / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--costs', type=int, nargs='+', default=[10, 11, 12, 13], help='work factors to measure')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='size of the pools (default: one per CPU)')
+    parser.add_argument('--seconds', type=float, default=3, help='how long to measure each pool')
+    args = parser.parse_args()
+
+    print(f"{args.workers} workers on {os.cpu_count()} CPUs")
+    print(f"{'cost':>4} {'ms/hash':>9} {'threads/s':>10} {'per core':>9} {'processes/s':>12} {'per core':>9}")
+    with ThreadPoolExecutor(max_workers=args.workers) as threads, \
+            ProcessPoolExecutor(max_workers=args.workers) as processes:
+        for cost in args.costs:
+            start = time.perf_counter()
+            hash_password('correct horse battery staple', cost)
+            single = (time.perf_counter() - start) * 1000
+            on_threads = throughput(threads, cost, args.workers, args.seconds)
+            on_processes = throughput(processes, cost, args.workers, args.seconds)
+            print(f"{cost:>4} {single:>9.1f} {on_threads:>10.1f} {on_threads / args.workers:>9.2f} "
+                  f"{on_processes:>12.1f} {on_processes / args.workers:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
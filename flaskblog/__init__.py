@@ -6,18 +6,31 @@ from flask_login import LoginManager
 from flask_wtf import CSRFProtect
 from dotenv import load_dotenv
 import os
-from flask_bcrypt import Bcrypt
+from werkzeug.middleware.proxy_fix import ProxyFix
+from flaskblog.cache import ResponseCache, FragmentCache, IdentityCache
+from flaskblog.viewcounts import ViewCounter
+from flaskblog.drafts import DraftBuffer
+from flaskblog.passwords import PasswordHasher
+from flaskblog.ratelimit import RateLimiter
+from flaskblog.availability import AvailabilityFilter
 
 # Load environment variables
 load_dotenv()
 
 # Initialize extensions
-bcrypt = Bcrypt()
 db = SQLAlchemy()
 migrate = Migrate()
 mail = Mail()
 login_manager = LoginManager()
 csrf = CSRFProtect()
+response_cache = ResponseCache()
+fragment_cache = FragmentCache()
+identity_cache = IdentityCache()
+view_counter = ViewCounter()
+draft_buffer = DraftBuffer()
+password_hasher = PasswordHasher()
+rate_limiter = RateLimiter()
+availability = AvailabilityFilter()
 
 def create_app():
     app = Flask(__name__)
@@ -25,25 +38,45 @@ def create_app():
     # Load configuration
     app.config.from_object('flaskblog.config.Config')  # This line should work if config.py is in the correct location
     
+    # Take the client address from X-Forwarded-For as set by our own proxies, for the per-IP rate limits
+    if app.config['TRUSTED_PROXY_COUNT']:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXY_COUNT'])
 
     # Initialize extensions with app
     db.init_app(app)
-    bcrypt.init_app(app)
+    password_hasher.init_app(app)
+    rate_limiter.init_app(app)
     migrate.init_app(app, db)
     mail.init_app(app)
     login_manager.init_app(app)
     csrf.init_app(app)
+    response_cache.init_app(app)
+    fragment_cache.init_app(app)
+    identity_cache.init_app(app)
+    view_counter.init_app(app)
+    draft_buffer.init_app(app)
+    availability.init_app(app)
 
     # Register blueprints
     from flaskblog.users.routes import users
     from flaskblog.posts.routes import posts
     from flaskblog.main.routes import main
     from flaskblog.errors.handlers import errors
+    from flaskblog.search.routes import search
+    from flaskblog.tags.routes import tags
+    from flaskblog.archive.routes import archive
+    from flaskblog.search.utils import init_search
     
     
     app.register_blueprint(users)
     app.register_blueprint(posts)
     app.register_blueprint(main)
+    app.register_blueprint(search)
+    app.register_blueprint(tags)
+    app.register_blueprint(archive)
     app.register_blueprint(errors, url_prefix='/errors')
+
+    # Set up the full-text search backend
+    init_search(app)
     
     return app
@@ -0,0 +1,55 @@
+import calendar
+from datetime import MAXYEAR, MINYEAR
+from flask import Blueprint, render_template, request, abort
+from flaskblog import response_cache
+from flaskblog.conditional import conditional
+from flaskblog.models import ArchiveMonth, Counter, Post
+from flaskblog.pagination import keyset_paginate
+from flaskblog.posts.utils import listing_options
+from flaskblog.querycount import query_budget
+from flaskblog.archive.utils import archive_years, month_range
+
+# Create a Blueprint instance for the 'archive' blueprint
+# This groups the list of months and the per-month post listings
+archive = Blueprint('archive', __name__)
+
+# Cheap validator for the archive pages: every post write and account change bumps feed_version
+def archive_state(**kwargs):
+    return (Counter.get('feed_version'),), None
+
+# Define the route for the list of months with posts, e.g. /archive
+@archive.route("/archive")
+@conditional(archive_state)
+@response_cache.cached('feed')  # Any new or deleted post changes a month's count
+@query_budget(2)  # The months, and the logged-in user
+def archive_index():
+    # Read the maintained monthly counts, newest first, straight off the primary key
+    months = (ArchiveMonth.query.filter(ArchiveMonth.post_count > 0)
+              .order_by(ArchiveMonth.year.desc(), ArchiveMonth.month.desc())
+              .all())
+    # Render the archive.html template with the months grouped by year
+    return render_template('archive.html', title='Archive', years=archive_years(months),
+                           month_names=calendar.month_name)
+
+# Define the route for the posts published in a month, e.g. /archive/2024/9?cursor=...
+@archive.route("/archive/<int:year>/<int:month>")
+@conditional(archive_state)
+@response_cache.cached('feed')  # Any post write may change this month's listing
+@query_budget(3)  # The month's count, the page of posts with their authors, and the logged-in user
+def archive_month(year, month):
+    # Months without posts (or that don't exist) have no page; checking the year also keeps
+    # it within the smallint column, which the database would refuse to compare with
+    if not 1 <= month <= 12 or not MINYEAR <= year <= MAXYEAR:
+        abort(404)
+    entry = ArchiveMonth.query.get_or_404((year, month))
+    if not entry.post_count:
+        abort(404)
+    # A range on date_posted walks the (date_posted, id) index from the month's last post backwards
+    start, end = month_range(year, month)
+    query = (Post.query.options(*listing_options())
+             .filter(Post.date_posted >= start, Post.date_posted < end))
+    # Same keyset pagination as the home feed, with the maintained count as the total
+    posts = keyset_paginate(query, (Post.date_posted, Post.id),
+                            cursor=request.args.get('cursor'), per_page=5, total=entry.post_count)
+    # Render the archive_month.html template with the month and its page of posts
+    return render_template('archive_month.html', title=start.strftime('%B %Y'), entry=entry, posts=posts)
@@ -0,0 +1,69 @@
+from datetime import MAXYEAR, datetime
+from sqlalchemy.dialects import postgresql, sqlite
+from flaskblog import db
+from flaskblog.models import ArchiveMonth
+
+
+def month_range(year, month):
+    """
+    Return the bounds of a month as datetimes, for range scans on post.date_posted.
+
+    Filtering on date_posted >= start AND date_posted < end can use the (date_posted, id)
+    index, where extract(year/month from date_posted) would scan every post.
+
+    :param year: The year.
+    :param month: The month, 1 to 12.
+    :return: A (start, end) tuple; start is inclusive and end exclusive.
+    """
+    start = datetime(year, month, 1)
+    if month < 12:
+        end = datetime(year, month + 1, 1)
+    else:
+        # There is no January after the last representable year
+        end = datetime(year + 1, 1, 1) if year < MAXYEAR else datetime.max
+    return start, end
+
+
+def count_archive_post(date_posted, delta=1):
+    """
+    Add delta to the post count of a post's month as part of the current transaction.
+
+    New months are created with a single INSERT ... ON CONFLICT, so two posts published at the
+    same time in a month without posts can't both try to create it.
+
+    :param date_posted: The date the post was published.
+    :param delta: 1 for a new post, -1 for a deleted one.
+    """
+    table = ArchiveMonth.__table__
+    key = {'year': date_posted.year, 'month': date_posted.month}
+    if delta < 0:
+        # The month exists, as it counts the post being deleted
+        db.session.execute(db.update(table).filter_by(**key).values(post_count=table.c.post_count + delta))
+        return
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        insert = postgresql.insert
+    elif dialect == 'sqlite':
+        insert = sqlite.insert
+    else:
+        raise RuntimeError(f"Archive upserts are not supported on {dialect}")
+    statement = insert(table).values(post_count=delta, **key)
+    db.session.execute(statement.on_conflict_do_update(index_elements=[table.c.year, table.c.month],
+                                                       set_={'post_count': table.c.post_count + delta}))
+
+
+def archive_years(months):
+    """
+    Group the archive months by year for display.
+
+    :param months: ArchiveMonth rows, newest first.
+    :return: A list of (year, months, post count) tuples, newest year first.
+    """
+    years = []
+    for month in months:
+        if not years or years[-1][0] != month.year:
+            years.append((month.year, [], 0))
+        year, year_months, count = years[-1]
+        year_months.append(month)
+        years[-1] = (year, year_months, count + month.post_count)
+    return years
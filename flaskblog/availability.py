@@ -0,0 +1,260 @@
+import hashlib
+import math
+import os
+import threading
+import time
+from flaskblog import signals
+
+
+class BloomFilter:
+    """
+    A fixed-size Bloom filter of strings.
+
+    Membership tests never miss a key that was added, but may answer yes for a key that wasn't
+    (a false positive), with a probability that grows as keys are added. The filter is sized
+    for a capacity and a target false-positive rate, and keys can't be removed.
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = max(1, capacity)
+        self.error_rate = error_rate
+        # Optimal number of bits and of hash functions for the capacity and the error rate
+        self.size = max(8, math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        # Derive every bit position from two halves of one digest (double hashing)
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        """
+        Add a key to the filter.
+
+        :param key: The key.
+        """
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def false_positive_rate(self):
+        """
+        Estimate the current false-positive rate from the number of keys added.
+
+        :return: The probability that a key never added is reported as present.
+        """
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** self.hashes
+
+
+class AvailabilityFilter:
+    """
+    Answers "is this username or email free?" without a database round trip in the common case.
+
+    Taken usernames and emails are kept in an in-process Bloom filter. A key the filter has
+    never seen is certainly free; a possible hit is confirmed against the database, which
+    also covers usernames and emails that were changed since.
+
+    The filter is built by a background thread in each worker process, started with the
+    worker's first registration page, so no request ever scans the user table; until it is
+    ready, lookups go to the database. The same thread picks up users registered through
+    other workers every AVAILABILITY_SYNC_INTERVAL seconds, and rebuilds the filter every
+    AVAILABILITY_REBUILD_INTERVAL seconds, or as soon as it is full, to drop stale keys.
+    The registration and account signals make this worker's own writes visible at once.
+
+    The answer is advisory: the registration form still checks uniqueness when submitted.
+    Lookups are counted per worker, and the counts, the filter's memory use and its
+    estimated and observed false-positive rates are logged every AVAILABILITY_STATS_INTERVAL
+    lookups.
+    """
+
+    def __init__(self, app=None):
+        self.filter = None
+        self.max_id = 0
+        self._stats = {'negatives': 0, 'true_positives': 0, 'false_positives': 0, 'unfiltered': 0}
+        self._lock = threading.Lock()
+        # Keys written by this worker while a rebuild scans the table, replayed into the new filter
+        self._pending = None
+        self._worker_pid = None
+        self._app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Read the filter settings from the app config and subscribe to account changes.
+
+        :param app: The Flask application.
+        """
+        self._app = app
+        self.capacity = app.config.get('AVAILABILITY_CAPACITY', 100000)
+        self.error_rate = app.config.get('AVAILABILITY_ERROR_RATE', 0.01)
+        self.sync_interval = app.config.get('AVAILABILITY_SYNC_INTERVAL', 10)
+        self.rebuild_interval = app.config.get('AVAILABILITY_REBUILD_INTERVAL', 3600)
+        self.stats_interval = app.config.get('AVAILABILITY_STATS_INTERVAL', 10000)
+        app.extensions['availability'] = self
+
+        # New accounts and changed usernames or emails become taken at once in this worker
+        signals.user_registered.connect(self._on_user_written, sender=app)
+        signals.account_updated.connect(self._on_user_written, sender=app)
+
+    @staticmethod
+    def _key(field, value):
+        # Usernames are unique as typed, emails regardless of case
+        return f'{field}:{value.lower() if field == "email" else value}'
+
+    def start(self):
+        """
+        Start building and syncing the filter in the background, once per worker process.
+        """
+        # Threads don't survive a fork, so a pre-forking server's workers each start their own
+        with self._lock:
+            if self._worker_pid == os.getpid():
+                return
+            self._worker_pid = os.getpid()
+            self.filter = None
+        threading.Thread(target=self._run, name='availability-filter', daemon=True).start()
+
+    def _run(self):
+        next_rebuild = 0
+        with self._app.app_context():
+            while True:
+                try:
+                    if self.filter is None or time.monotonic() >= next_rebuild or self.filter.count > self.filter.capacity:
+                        self.build()
+                        next_rebuild = time.monotonic() + self.rebuild_interval
+                    else:
+                        self.sync()
+                except Exception:
+                    self._app.logger.exception('Could not update the availability filter')
+                finally:
+                    # Don't hold a connection while sleeping
+                    self._session().remove()
+                time.sleep(self.sync_interval)
+
+    @staticmethod
+    def _session():
+        # Imported here because the flaskblog package imports this module while it is set up
+        from flaskblog import db
+        return db.session
+
+    def _rows(self, after_id):
+        from flaskblog.models import User
+        # Stream the rows in primary key order, so that new users are a cheap range scan
+        return (self._session().query(User.id, User.username, User.email)
+                .filter(User.id > after_id).order_by(User.id).yield_per(1000))
+
+    def build(self):
+        """
+        Build a new filter from the user table and swap it in; lookups keep using the old one meanwhile.
+        """
+        from flaskblog import db
+        from flaskblog.models import User
+        with self._lock:
+            self._pending = []
+        try:
+            users = db.session.query(db.func.count(User.id)).scalar()
+            # Two keys per user, with room for the table to double before the filter is full
+            bloom = BloomFilter(2 * max(self.capacity, 2 * users), self.error_rate)
+            max_id = 0
+            for user_id, username, email in self._rows(0):
+                bloom.add(self._key('username', username))
+                bloom.add(self._key('email', email))
+                max_id = max(max_id, user_id)
+        except Exception:
+            with self._lock:
+                self._pending = None
+            raise
+        with self._lock:
+            for key in self._pending:
+                bloom.add(key)
+            self._pending = None
+            self.filter, self.max_id = bloom, max_id
+        self._app.logger.info('Availability filter built from %d users (%d KiB)', users, len(bloom.bits) // 1024)
+
+    def sync(self):
+        """
+        Add the users registered since the last build or sync, e.g. through other workers.
+        """
+        rows = self._rows(self.max_id).all()
+        with self._lock:
+            for user_id, username, email in rows:
+                self.filter.add(self._key('username', username))
+                self.filter.add(self._key('email', email))
+                self.max_id = max(self.max_id, user_id)
+
+    def is_available(self, field, value, confirm):
+        """
+        Tell whether a username or an email is free.
+
+        :param field: 'username' or 'email'.
+        :param value: The username or email to check.
+        :param confirm: A function taking the field and the value and returning True if the
+                        database has it, called only when the filter can't rule it out.
+        :return: True if no user has it.
+        """
+        self.start()
+        with self._lock:
+            bloom = self.filter
+            possible = bloom is None or self._key(field, value) in bloom
+        if not possible:
+            self._count('negatives')
+            return True
+        taken = confirm(field, value)
+        if bloom is None:
+            self._count('unfiltered')
+        else:
+            self._count('true_positives' if taken else 'false_positives')
+        return not taken
+
+    def stats(self):
+        """
+        Return this worker's lookup counts and the state of its filter.
+
+        :return: A dict with the lookup counts (unfiltered ones came before the filter was ready)
+                 and their total, lookups; database_ratio, the share of lookups that needed a
+                 database round trip; observed_fp_rate, the share of free keys the filter couldn't
+                 rule out; and the filter's keys, bits, hashes, memory_bytes and estimated_fp_rate.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            bloom = self.filter
+        lookups = sum(stats.values())
+        free = stats['negatives'] + stats['false_positives']
+        stats['lookups'] = lookups
+        stats['database_ratio'] = (lookups - stats['negatives']) / lookups if lookups else 0.0
+        stats['observed_fp_rate'] = stats['false_positives'] / free if free else 0.0
+        if bloom is not None:
+            stats.update(keys=bloom.count, bits=bloom.size, hashes=bloom.hashes,
+                         memory_bytes=len(bloom.bits), estimated_fp_rate=bloom.false_positive_rate())
+        return stats
+
+    def _count(self, outcome):
+        with self._lock:
+            self._stats[outcome] += 1
+            report = self.stats_interval and sum(self._stats.values()) % self.stats_interval == 0
+        if report:
+            stats = self.stats()
+            if 'keys' not in stats:
+                return
+            self._app.logger.info('Availability filter: %d lookups, %.1f%% went to the database, false positives '
+                                  '%.2f%% observed and %.2f%% estimated, %d keys in %d KiB',
+                                  stats['lookups'], stats['database_ratio'] * 100,
+                                  stats['observed_fp_rate'] * 100, stats['estimated_fp_rate'] * 100,
+                                  stats['keys'], stats['memory_bytes'] // 1024)
+
+    def _on_user_written(self, sender, user, **extra):
+        keys = [self._key('username', user.username), self._key('email', user.email)]
+        with self._lock:
+            if self.filter is not None:
+                for key in keys:
+                    self.filter.add(key)
+            # A rebuild in progress may have scanned past this user already
+            if self._pending is not None:
+                self._pending.extend(keys)
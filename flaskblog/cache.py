@@ -0,0 +1,500 @@
+import os
+import pickle
+import sys
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import g, make_response, request, session
+from flask_login import current_user
+from flaskblog import signals
+
+
+class BaseCache:
+    """
+    Interface shared by all cache backends.
+
+    Values can be any picklable object. A ttl of None means the backend's default ttl,
+    and a ttl of 0 means the value never expires.
+    """
+
+    def get(self, key):
+        return self.get_many([key])[0]
+
+    def get_many(self, keys):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        self.set_many({key: value}, ttl)
+
+    def set_many(self, mapping, ttl=None):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class NullCache(BaseCache):
+    """
+    A cache that never stores anything, used to switch caching off.
+    """
+
+    def get_many(self, keys):
+        return [None] * len(keys)
+
+    def set_many(self, mapping, ttl=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+
+def _sizeof(value):
+    """
+    Roughly estimate how many bytes a cached value occupies.
+
+    :param value: The value to measure.
+    :return: The estimated size in bytes.
+    """
+    # Bodies and fragments dominate the size, so measure them exactly and containers roughly
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(_sizeof(k) + _sizeof(v) for k, v in value.items()) + sys.getsizeof({})
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sum(_sizeof(v) for v in value) + sys.getsizeof(())
+    return sys.getsizeof(value)
+
+
+class LRUCache(BaseCache):
+    """
+    An in-process, thread-safe least recently used cache with TTLs.
+
+    Entries are evicted oldest-use first once either max_entries or max_bytes is exceeded.
+    Each worker process has its own copy, so this backend suits single-process deployments
+    or data where a TTL's worth of staleness across workers is acceptable.
+    """
+
+    def __init__(self, max_entries=1000, max_bytes=None, default_ttl=300):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self._data = OrderedDict()  # key -> (expires_at, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        now = time.monotonic()
+        values = []
+        with self._lock:
+            for key in keys:
+                entry = self._data.get(key)
+                if entry is None:
+                    values.append(None)
+                elif entry[0] and entry[0] <= now:
+                    # Expired: drop it lazily on read
+                    self._remove(key)
+                    values.append(None)
+                else:
+                    # Mark as most recently used
+                    self._data.move_to_end(key)
+                    values.append(entry[2])
+        return values
+
+    def set_many(self, mapping, ttl=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else 0
+        with self._lock:
+            for key, value in mapping.items():
+                size = _sizeof(value)
+                if self.max_bytes and size > self.max_bytes:
+                    # Never let a single huge value flush the whole cache
+                    continue
+                if key in self._data:
+                    self._remove(key)
+                self._data[key] = (expires_at, size, value)
+                self._bytes += size
+            self._evict()
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def size_bytes(self):
+        """
+        The estimated number of bytes held by the cache.
+        """
+        return self._bytes
+
+    def _remove(self, key):
+        # Caller must hold the lock
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+    def _evict(self):
+        # Caller must hold the lock; pop least recently used entries until we fit again
+        while self._data and (len(self._data) > self.max_entries or
+                              (self.max_bytes and self._bytes > self.max_bytes)):
+            key = next(iter(self._data))
+            self._remove(key)
+
+
+class RedisCache(BaseCache):
+    """
+    A cache shared by all workers and hosts, backed by Redis.
+
+    Requires the optional 'redis' package. Values are pickled, so only point this at a
+    Redis instance that is not writable by untrusted parties.
+    """
+
+    def __init__(self, url, prefix='flaskblog:', default_ttl=300):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("The 'redis' cache backend requires the 'redis' package "
+                               "(pip install redis)")
+        self._client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.default_ttl = default_ttl
+
+    def get_many(self, keys):
+        if not keys:
+            return []
+        raw = self._client.mget([self.prefix + key for key in keys])
+        return [None if value is None else pickle.loads(value) for value in raw]
+
+    def set_many(self, mapping, ttl=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        # Pipeline the writes so a page of fragments costs a single round trip
+        pipe = self._client.pipeline(transaction=False)
+        for key, value in mapping.items():
+            pipe.set(self.prefix + key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), ex=ttl or None)
+        pipe.execute()
+
+    def delete(self, key):
+        self._client.delete(self.prefix + key)
+
+    def clear(self):
+        # Only remove our own keys, the Redis database may be shared
+        for key in self._client.scan_iter(match=self.prefix + '*'):
+            self._client.delete(key)
+
+
+def make_cache(backend, url=None, default_ttl=300, max_entries=1000, max_bytes=None, prefix='flaskblog:'):
+    """
+    Create a cache backend by name.
+
+    :param backend: 'lru' for an in-process cache, 'redis' for a shared one, or 'null' to disable caching.
+    :param url: The Redis URL, required for the 'redis' backend.
+    :param default_ttl: The default time to live of an entry, in seconds.
+    :param max_entries: The maximum number of entries held by the 'lru' backend.
+    :param max_bytes: The maximum total size held by the 'lru' backend, or None for no limit.
+    :param prefix: The key prefix used by the 'redis' backend.
+    :return: A BaseCache instance.
+    """
+    if backend == 'lru':
+        return LRUCache(max_entries=max_entries, max_bytes=max_bytes, default_ttl=default_ttl)
+    if backend == 'redis':
+        if not url:
+            raise RuntimeError("The 'redis' cache backend needs a URL")
+        return RedisCache(url, prefix=prefix, default_ttl=default_ttl)
+    if backend == 'null':
+        return NullCache()
+    raise ValueError(f"Unknown cache backend: {backend!r}")
+
+
+class ResponseCache:
+    """
+    Full-page cache for anonymous GET requests with tag-based invalidation.
+
+    Every cached page is stamped with the versions of the tags it depends on, e.g. 'feed' or
+    'post:42'. Invalidating a tag stores a fresh version for it, which makes every page stamped
+    with the old version a miss, without having to know which pages those were. The versions
+    are read before the view runs, so a write that lands while the page renders is never
+    hidden behind a version stamped afterwards.
+
+    Tag versions live in the cache backend, so with a per-process backend such as 'lru' an
+    invalidation only reaches the worker that handled the write. Such pages are therefore also
+    stamped with the feed_version counter, which every post write and account change bumps in
+    the database, at the cost of one primary key lookup per cached request.
+    """
+
+    def __init__(self, app=None):
+        self.cache = NullCache()
+        self.stamp_database = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Create the cache backend from the app config and hook up invalidation.
+
+        :param app: The Flask application.
+        """
+        self.cache = make_cache(
+            app.config.get('RESPONSE_CACHE_BACKEND', 'lru'),
+            url=app.config.get('RESPONSE_CACHE_URL'),
+            default_ttl=app.config.get('RESPONSE_CACHE_TTL', 60),
+            max_entries=app.config.get('RESPONSE_CACHE_MAX_ENTRIES', 1000),
+            max_bytes=app.config.get('RESPONSE_CACHE_MAX_BYTES'),
+            prefix='flaskblog:page:',
+        )
+        # Only a shared backend's tag versions are seen by every worker
+        self.stamp_database = isinstance(self.cache, LRUCache)
+        app.extensions['response_cache'] = self
+
+        # Drop cached pages as soon as the data behind them changes
+        signals.post_created.connect(self._on_post_written, sender=app)
+        signals.post_updated.connect(self._on_post_written, sender=app)
+        signals.post_deleted.connect(self._on_post_written, sender=app)
+        signals.account_updated.connect(self._on_account_updated, sender=app)
+
+    def tag(self, *tags):
+        """
+        Add tags to the page being rendered, e.g. once the view knows the post's author.
+
+        :param tags: The tags the current response depends on.
+        """
+        # Outside of a cacheable render there is nothing to stamp
+        versions = g.get('_response_cache_versions')
+        if versions is not None:
+            versions.update(self.tag_versions(set(tags) - versions.keys()))
+
+    def invalidate(self, *tags):
+        """
+        Invalidate every cached page carrying any of the given tags.
+
+        :param tags: The tags to invalidate.
+        """
+        # A random version can't collide with one that was stamped before an eviction
+        self.cache.set_many({'tag:' + tag: os.urandom(8).hex() for tag in tags}, ttl=0)
+
+    def tag_versions(self, tags):
+        """
+        Look up the current versions of some tags, creating versions for unknown tags.
+
+        :param tags: The tags to look up.
+        :return: A dict mapping each tag to its current version.
+        """
+        tags = sorted(tags)
+        versions = dict(zip(tags, self.cache.get_many(['tag:' + tag for tag in tags])))
+        missing = [tag for tag, version in versions.items() if version is None]
+        if missing:
+            # Never seen (or evicted): start a new version rather than assuming an old one
+            fresh = {tag: os.urandom(8).hex() for tag in missing}
+            self.cache.set_many({'tag:' + tag: version for tag, version in fresh.items()}, ttl=0)
+            versions.update(fresh)
+        return versions
+
+    def cached(self, *tags):
+        """
+        Decorate a view so that anonymous GET requests are served from the cache.
+
+        Tags may contain format fields filled from the view arguments, e.g. 'post:{post_id}'.
+
+        :param tags: The tags the view's response depends on.
+        :return: The decorator.
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                # Only cache what every anonymous visitor would see identically
+                if (request.method != 'GET' or current_user.is_authenticated
+                        or session.get('_flashes')):
+                    return view(*args, **kwargs)
+
+                key = 'page:' + request.full_path
+                # The ETag @conditional computed from the current data, if the view has one:
+                # an entry rendered from other data must not be served under it
+                validity = (self._database_version(), g.get('conditional_etag'))
+                entry = self.cache.get(key)
+                if entry is not None:
+                    body, status, headers, stamped, stamped_validity = entry
+                    # Serve the entry only if none of its tags were invalidated since it was stored
+                    if stamped_validity == validity and self.tag_versions(stamped) == stamped:
+                        response = make_response(body, status, headers)
+                        response.headers['X-Cache'] = 'HIT'
+                        return response
+
+                # Read the versions before rendering: a write made meanwhile must make the entry stale
+                versions = self.tag_versions({tag.format(**kwargs) for tag in tags})
+                g._response_cache_versions = versions
+                try:
+                    response = make_response(view(*args, **kwargs))
+                finally:
+                    g.pop('_response_cache_versions', None)
+                response.headers['X-Cache'] = 'MISS'
+                # Don't cache errors, redirects, streams or responses that set up a session
+                if (response.status_code == 200 and not response.is_streamed
+                        and not session.modified):
+                    headers = [(name, value) for name, value in response.headers
+                               if name.lower() not in ('set-cookie', 'x-cache')]
+                    self.cache.set(key, (response.get_data(), response.status_code, headers,
+                                         versions, validity))
+                return response
+            return wrapper
+        return decorator
+
+    def _database_version(self):
+        if not self.stamp_database:
+            return None
+        # Imported here because the flaskblog package imports this module while it is set up
+        from flaskblog.models import Counter
+        return Counter.get('feed_version')
+
+    def _on_post_written(self, sender, post, author, **extra):
+        # The feed and the author's pages list the post; its own page shows it
+        self.invalidate('feed', f'post:{post.id}', f'user:{author.username}')
+
+    def _on_account_updated(self, sender, user, old_username, **extra):
+        # Usernames and avatars appear on every card the user authored
+        self.invalidate('feed', f'user:{old_username}', f'user:{user.username}')
+
+
+class FragmentCache:
+    """
+    Cache for rendered template fragments such as post cards.
+
+    Fragment keys include the versions of everything the fragment displays, so entries never
+    need to be invalidated explicitly: stale ones are simply no longer requested and age out.
+    """
+
+    def __init__(self, app=None):
+        self.cache = NullCache()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Create the cache backend from the app config.
+
+        :param app: The Flask application.
+        """
+        self.cache = make_cache(
+            app.config.get('FRAGMENT_CACHE_BACKEND', 'lru'),
+            url=app.config.get('FRAGMENT_CACHE_URL'),
+            default_ttl=app.config.get('FRAGMENT_CACHE_TTL', 3600),
+            max_entries=app.config.get('FRAGMENT_CACHE_MAX_ENTRIES', 10000),
+            max_bytes=app.config.get('FRAGMENT_CACHE_MAX_BYTES'),
+            prefix='flaskblog:fragment:',
+        )
+        app.extensions['fragment_cache'] = self
+
+
+class IdentityCache:
+    """
+    Read-through cache of the logged-in user, so authenticated requests skip the user table.
+
+    Lookups go to an in-process LRU first, then to an optional shared backend (e.g. Redis),
+    and only then to the database. Entries are invalidated when an account changes, in this
+    worker and in the shared backend; other workers' local copies expire after
+    IDENTITY_CACHE_LOCAL_TTL seconds. Hits and misses are counted per worker and logged
+    every IDENTITY_CACHE_STATS_INTERVAL lookups.
+    """
+
+    def __init__(self, app=None):
+        self.local = NullCache()
+        self.shared = NullCache()
+        self._stats = {'hits': 0, 'shared_hits': 0, 'misses': 0}
+        self._lock = threading.Lock()
+        self._app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Create the cache backends from the app config and subscribe to account changes.
+
+        :param app: The Flask application.
+        """
+        self._app = app
+        self.local = LRUCache(max_entries=app.config.get('IDENTITY_CACHE_MAX_ENTRIES', 10000),
+                              default_ttl=app.config.get('IDENTITY_CACHE_LOCAL_TTL', 30))
+        self.shared = make_cache(
+            app.config.get('IDENTITY_CACHE_BACKEND', 'null'),
+            url=app.config.get('IDENTITY_CACHE_URL'),
+            default_ttl=app.config.get('IDENTITY_CACHE_TTL', 300),
+            prefix='flaskblog:identity:',
+        )
+        self.stats_interval = app.config.get('IDENTITY_CACHE_STATS_INTERVAL', 10000)
+        app.extensions['identity_cache'] = self
+
+        # Usernames, emails and avatars are part of the cached identity
+        signals.account_updated.connect(self._on_account_updated, sender=app)
+
+    def get(self, user_id, load):
+        """
+        Return a user's identity, loading and caching it on a miss.
+
+        :param user_id: The id of the user.
+        :param load: A function taking the id and returning the identity from the database, or None.
+        :return: The identity, or None if there is no such user.
+        """
+        key = str(user_id)
+        identity = self.local.get(key)
+        if identity is not None:
+            self._count('hits')
+            return identity
+        identity = self.shared.get(key)
+        if identity is not None:
+            self._count('shared_hits')
+        else:
+            self._count('misses')
+            identity = load(user_id)
+            if identity is None:
+                # Unknown users aren't cached: the id comes from a signed session, so this is rare
+                return None
+            self.shared.set(key, identity)
+        self.local.set(key, identity)
+        return identity
+
+    def invalidate(self, user_id):
+        """
+        Drop a user's cached identity, e.g. after an account update or a password reset.
+
+        :param user_id: The id of the user.
+        """
+        self.local.delete(str(user_id))
+        self.shared.delete(str(user_id))
+
+    def stats(self):
+        """
+        Return this worker's hit and miss counts.
+
+        :return: A dict with hits, shared_hits, misses, and hit_ratio, the share of lookups
+                 that didn't need a database round trip.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = sum(stats.values())
+        stats['hit_ratio'] = (stats['hits'] + stats['shared_hits']) / lookups if lookups else 0.0
+        return stats
+
+    def _count(self, outcome):
+        with self._lock:
+            self._stats[outcome] += 1
+            report = self.stats_interval and sum(self._stats.values()) % self.stats_interval == 0
+        if report:
+            stats = self.stats()
+            self._app.logger.info('Identity cache: %d hits, %d shared hits, %d misses (%.1f%% of user lookups '
+                                  'saved a database round trip)', stats['hits'], stats['shared_hits'],
+                                  stats['misses'], stats['hit_ratio'] * 100)
+
+    def _on_account_updated(self, sender, user, **extra):
+        self.invalidate(user.id)
@@ -0,0 +1,80 @@
+import hashlib
+import os
+from functools import wraps
+from flask import current_app, g, make_response, request, session
+from flask_login import current_user
+
+
+def _templates_version(app):
+    # Any deploy that changes a template changes the pages without touching the data,
+    # so fold the newest template modification time into every ETag
+    newest = 0
+    for root, _, files in os.walk(os.path.join(app.root_path, app.template_folder)):
+        for name in files:
+            newest = max(newest, os.stat(os.path.join(root, name)).st_mtime_ns)
+    return str(newest)
+
+
+def conditional(validator):
+    """
+    Decorate a view with conditional GET support driven by a cheap validator.
+
+    The validator receives the view arguments and returns a (state, last_modified) tuple,
+    where state is any value that changes whenever the page would change (e.g. a post's id
+    and version) and last_modified is a datetime or None. It should cost at most one cheap
+    query. If the client's ETag still matches, a 304 is returned without running the view,
+    so neither the main query nor the template render happen. Return None from the
+    validator to skip conditional handling, e.g. when the object doesn't exist.
+
+    The ETag is left in g.conditional_etag for the view, so that the response cache below it
+    only serves a copy rendered from the same state.
+
+    :param validator: The function computing the page's current state.
+    :return: The decorator.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # Flashed messages are shown once, so such a page must always be rendered
+            if request.method not in ('GET', 'HEAD') or session.get('_flashes'):
+                return view(*args, **kwargs)
+
+            validated = validator(**kwargs)
+            if validated is None:
+                return view(*args, **kwargs)
+            state, last_modified = validated
+
+            app = current_app._get_current_object()
+            if 'conditional_templates_version' not in app.extensions:
+                app.extensions['conditional_templates_version'] = _templates_version(app)
+
+            # The navbar and the owner controls differ per viewer, so the viewer is part of the ETag
+            viewer = current_user.get_id() if current_user.is_authenticated else 'anonymous'
+            source = repr((request.full_path, state, viewer, app.extensions['conditional_templates_version']))
+            etag = hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains_weak(etag)
+            else:
+                not_modified = (last_modified is not None and request.if_modified_since is not None
+                                and last_modified.replace(microsecond=0, tzinfo=None)
+                                <= request.if_modified_since.replace(tzinfo=None))
+
+            if not_modified:
+                response = make_response('', 304)
+            else:
+                g.conditional_etag = etag
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                if last_modified is not None:
+                    response.last_modified = last_modified
+
+            response.set_etag(etag, weak=True)
+            # Make browsers revalidate every time, and keep per-viewer pages out of shared caches
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            response.vary.add('Cookie')
+            return response
+        return wrapper
+    return decorator
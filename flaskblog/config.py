@@ -26,3 +26,105 @@ class Config:
     
     # Controls whether exceptions should be propagated or handled by Flask
     PROPAGATE_EXCEPTIONS = False
+    
+    # Raise instead of just logging when a view runs more SQL queries than its @query_budget
+    # Enforcement is always on while the app is in testing mode
+    QUERY_BUDGET_ENFORCE = os.environ.get('QUERY_BUDGET_ENFORCE', '0') == '1'
+    
+    # Full-page cache for anonymous visitors: 'lru' (in-process), 'redis' (shared) or 'null' (off)
+    RESPONSE_CACHE_BACKEND = os.environ.get('RESPONSE_CACHE_BACKEND', 'lru')
+    # Redis connection URL, only used by the 'redis' backend (e.g. redis://localhost:6379/0)
+    RESPONSE_CACHE_URL = os.environ.get('RESPONSE_CACHE_URL')
+    # How long a cached page may be served, in seconds, even if nothing invalidates it
+    RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 60))
+    # Size bounds of the 'lru' backend; least recently used pages are evicted first
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 1000))
+    RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    
+    # Cache for rendered post cards, keyed by post and author versions: 'lru', 'redis' or 'null'
+    FRAGMENT_CACHE_BACKEND = os.environ.get('FRAGMENT_CACHE_BACKEND', 'lru')
+    FRAGMENT_CACHE_URL = os.environ.get('FRAGMENT_CACHE_URL', os.environ.get('RESPONSE_CACHE_URL'))
+    FRAGMENT_CACHE_TTL = int(os.environ.get('FRAGMENT_CACHE_TTL', 3600))
+    FRAGMENT_CACHE_MAX_ENTRIES = int(os.environ.get('FRAGMENT_CACHE_MAX_ENTRIES', 10000))
+    FRAGMENT_CACHE_MAX_BYTES = int(os.environ.get('FRAGMENT_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+    
+    # bcrypt work factor of new password hashes; older, weaker hashes are upgraded on login
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    # Password hashing runs on a 'thread' or 'process' pool of this many workers (default: one per CPU);
+    # once the queue of waiting hashes is full, sign-ins are answered with 503 until it drains
+    PASSWORD_HASH_EXECUTOR = os.environ.get('PASSWORD_HASH_EXECUTOR', 'thread')
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 0)) or None
+    PASSWORD_HASH_QUEUE = int(os.environ.get('PASSWORD_HASH_QUEUE', 16))
+    
+    # Sliding-window rate limits on logins and password reset emails, per client IP and per account,
+    # as '<requests>/<seconds>'; counters are kept per worker ('memory'), in Redis ('redis'), or not at all ('null')
+    RATELIMIT_BACKEND = os.environ.get('RATELIMIT_BACKEND', 'memory')
+    RATELIMIT_URL = os.environ.get('RATELIMIT_URL', os.environ.get('RESPONSE_CACHE_URL'))
+    RATELIMIT_EVICT_INTERVAL = int(os.environ.get('RATELIMIT_EVICT_INTERVAL', 60))
+    RATELIMIT_LOGIN_PER_IP = os.environ.get('RATELIMIT_LOGIN_PER_IP', '20/300')
+    RATELIMIT_LOGIN_PER_ACCOUNT = os.environ.get('RATELIMIT_LOGIN_PER_ACCOUNT', '10/300')
+    RATELIMIT_RESET_PER_IP = os.environ.get('RATELIMIT_RESET_PER_IP', '5/3600')
+    RATELIMIT_RESET_PER_ACCOUNT = os.environ.get('RATELIMIT_RESET_PER_ACCOUNT', '3/3600')
+    # The per-IP limits key on the client address. Behind reverse proxies, set this to the number of
+    # proxies in front of the app so the address is read from X-Forwarded-For; otherwise every client
+    # shares the proxy's address. Leave it at 0 when clients connect directly, as the header can be forged
+    TRUSTED_PROXY_COUNT = int(os.environ.get('TRUSTED_PROXY_COUNT', 0))
+    
+    # Cache of the logged-in user, read on every authenticated request: an in-process LRU whose entries
+    # live for the local TTL (the staleness other workers may see after an account update), in front
+    # of an optional shared backend, 'redis' or 'null' (off)
+    IDENTITY_CACHE_MAX_ENTRIES = int(os.environ.get('IDENTITY_CACHE_MAX_ENTRIES', 10000))
+    IDENTITY_CACHE_LOCAL_TTL = int(os.environ.get('IDENTITY_CACHE_LOCAL_TTL', 30))
+    IDENTITY_CACHE_BACKEND = os.environ.get('IDENTITY_CACHE_BACKEND', 'null')
+    IDENTITY_CACHE_URL = os.environ.get('IDENTITY_CACHE_URL', os.environ.get('RESPONSE_CACHE_URL'))
+    IDENTITY_CACHE_TTL = int(os.environ.get('IDENTITY_CACHE_TTL', 300))
+    # Log the hit and miss counts every this many lookups (0 to never log them)
+    IDENTITY_CACHE_STATS_INTERVAL = int(os.environ.get('IDENTITY_CACHE_STATS_INTERVAL', 10000))
+    
+    # In-process Bloom filter of taken usernames and emails behind the availability check on the
+    # registration page: sized for this many users (it grows with the table) at this false-positive rate,
+    # synced with other workers' registrations every SYNC_INTERVAL seconds and rebuilt every REBUILD_INTERVAL
+    AVAILABILITY_CAPACITY = int(os.environ.get('AVAILABILITY_CAPACITY', 100000))
+    AVAILABILITY_ERROR_RATE = float(os.environ.get('AVAILABILITY_ERROR_RATE', 0.01))
+    AVAILABILITY_SYNC_INTERVAL = int(os.environ.get('AVAILABILITY_SYNC_INTERVAL', 10))
+    AVAILABILITY_REBUILD_INTERVAL = int(os.environ.get('AVAILABILITY_REBUILD_INTERVAL', 3600))
+    # Log the lookup counts, false-positive rates and memory use every this many lookups (0 to never log them)
+    AVAILABILITY_STATS_INTERVAL = int(os.environ.get('AVAILABILITY_STATS_INTERVAL', 10000))
+    # Availability checks are cheap but would let anyone enumerate accounts, so they are limited per client IP
+    RATELIMIT_AVAILABILITY_PER_IP = os.environ.get('RATELIMIT_AVAILABILITY_PER_IP', '120/60')
+    
+    # Largest page the JSON API will serve, and the page size above which it streams the response
+    API_MAX_LIMIT = int(os.environ.get('API_MAX_LIMIT', 1000))
+    API_STREAM_THRESHOLD = int(os.environ.get('API_STREAM_THRESHOLD', 100))
+    
+    # Number of posts in the Atom feeds, and how long a built feed may stay cached (it is rebuilt after any post write)
+    FEED_LENGTH = int(os.environ.get('FEED_LENGTH', 20))
+    FEED_CACHE_TTL = int(os.environ.get('FEED_CACHE_TTL', 3600))
+    
+    # Number of most used tags shown in the tag cloud
+    TAG_CLOUD_SIZE = int(os.environ.get('TAG_CLOUD_SIZE', 100))
+    
+    # The editor autosaves drafts every autosave interval (seconds); each worker buffers the saves
+    # and writes the latest state of every draft once per flush interval, or early past the threshold
+    DRAFT_AUTOSAVE_INTERVAL = float(os.environ.get('DRAFT_AUTOSAVE_INTERVAL', 5))
+    DRAFT_FLUSH_INTERVAL = float(os.environ.get('DRAFT_FLUSH_INTERVAL', 30))
+    DRAFT_FLUSH_THRESHOLD = int(os.environ.get('DRAFT_FLUSH_THRESHOLD', 500))
+    
+    # A post's revision history stores a full snapshot every this many versions, and deltas in between
+    REVISION_SNAPSHOT_INTERVAL = int(os.environ.get('REVISION_SNAPSHOT_INTERVAL', 20))
+    
+    # Number of related posts kept per post, and where the batch jobs keep their TF-IDF model
+    RELATED_POSTS_COUNT = int(os.environ.get('RELATED_POSTS_COUNT', 5))
+    RELATED_POSTS_MODEL_PATH = os.environ.get('RELATED_POSTS_MODEL_PATH', 'related_posts.npz')
+    
+    # Full-text search backend: 'sql' uses Postgres tsvector/GIN (or SQLite FTS5 in development),
+    # 'memory' an in-process inverted index for databases without full-text search
+    SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'sql')
+    # Snapshot file of the 'memory' index, loaded at startup instead of rebuilding the index
+    SEARCH_INDEX_PATH = os.environ.get('SEARCH_INDEX_PATH')
+    
+    # Post views are buffered per worker and written in batches: at least every interval (seconds),
+    # or as soon as the threshold of pending views is reached, at most batch size posts per UPDATE
+    VIEW_COUNT_FLUSH_INTERVAL = float(os.environ.get('VIEW_COUNT_FLUSH_INTERVAL', 5))
+    VIEW_COUNT_FLUSH_THRESHOLD = int(os.environ.get('VIEW_COUNT_FLUSH_THRESHOLD', 1000))
+    VIEW_COUNT_BATCH_SIZE = int(os.environ.get('VIEW_COUNT_BATCH_SIZE', 500))
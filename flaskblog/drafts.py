@@ -0,0 +1,133 @@
+import atexit
+import os
+import threading
+from datetime import datetime
+from sqlalchemy import bindparam
+
+
+class DraftBuffer:
+    """
+    Per-worker buffer of draft autosaves, written to the database in batches.
+
+    The editor autosaves every few seconds, but only the latest state of a draft matters, so
+    saving one only replaces its entry in an in-memory dict. A background thread writes every
+    buffered draft once per DRAFT_FLUSH_INTERVAL seconds, or as soon as DRAFT_FLUSH_THRESHOLD
+    drafts are pending, as one batched UPDATE; a draft thus costs at most one write per interval
+    however often it is saved. Each row only takes a state newer than the one it has, so a
+    slower worker can't overwrite a later save handled by another one. Whatever is still
+    buffered when the worker exits is flushed by an atexit hook.
+    """
+
+    def __init__(self, app=None):
+        self._pending = {}  # (user id, draft id) -> latest state not yet written
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Read the flush settings from the app config and register the exit hook.
+
+        :param app: The Flask application.
+        """
+        self._app = app
+        self.interval = app.config.get('DRAFT_FLUSH_INTERVAL', 30)
+        self.threshold = app.config.get('DRAFT_FLUSH_THRESHOLD', 500)
+        app.extensions['draft_buffer'] = self
+        atexit.register(self.flush)
+
+    def save(self, user_id, draft_id, title, content, tags):
+        """
+        Buffer the latest state of a draft, replacing any state buffered before.
+
+        :param user_id: The id of the user saving the draft; drafts of other users are never written.
+        :param draft_id: The id of the draft.
+        :param title: The title typed so far.
+        :param content: The content typed so far.
+        :param tags: The tag input typed so far.
+        """
+        state = {'title': title, 'content': content, 'tags': tags, 'date_saved': datetime.utcnow()}
+        with self._lock:
+            self._pending[(user_id, draft_id)] = state
+            full = len(self._pending) >= self.threshold
+        self._ensure_thread()
+        if full:
+            # Don't wait for the interval once a batch is full
+            self._wake.set()
+
+    def pending(self, user_id, draft_id):
+        """
+        Return the state of a draft saved through this worker but not yet written.
+
+        :param user_id: The id of the draft's author.
+        :param draft_id: The id of the draft.
+        :return: A dict with title, content, tags and date_saved, or None.
+        """
+        with self._lock:
+            return self._pending.get((user_id, draft_id))
+
+    def discard(self, user_id, draft_id):
+        """
+        Forget the buffered state of a draft, e.g. once it has been published or deleted.
+
+        :param user_id: The id of the draft's author.
+        :param draft_id: The id of the draft.
+        """
+        with self._lock:
+            self._pending.pop((user_id, draft_id), None)
+
+    def flush(self):
+        """
+        Write the buffered drafts to the database.
+
+        All drafts go out in one executemany UPDATE, matching on the author as well as the id,
+        and only where the stored state is older. If the write fails, the states are put back
+        into the buffer for the next flush, unless a newer one was saved in the meantime.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending or self._app is None:
+            return
+
+        # Imported here because the flaskblog package imports this module while it is set up
+        from flaskblog import db
+        from flaskblog.models import Draft
+        draft = Draft.__table__
+        statement = (db.update(draft)
+                     .where(draft.c.id == bindparam('b_id'), draft.c.user_id == bindparam('b_user_id'),
+                            draft.c.date_saved < bindparam('b_date_saved'))
+                     .values(title=bindparam('b_title'), content=bindparam('b_content'),
+                             tags=bindparam('b_tags'), date_saved=bindparam('b_date_saved')))
+        # Sorted so concurrent workers lock the rows in the same order
+        rows = [{'b_id': draft_id, 'b_user_id': user_id, **{'b_' + key: value for key, value in state.items()}}
+                for (user_id, draft_id), state in sorted(pending.items(), key=lambda item: item[0][1])]
+        try:
+            with self._app.app_context(), db.engine.begin() as conn:
+                conn.execute(statement, rows)
+        except Exception:
+            # E.g. a deadlock or a lost connection: keep the drafts and retry on the next flush
+            with self._lock:
+                for key, state in pending.items():
+                    self._pending.setdefault(key, state)
+            self._app.logger.exception('Flushing %d drafts failed', len(pending))
+
+    def _ensure_thread(self):
+        # Threads don't survive a fork, so every worker process starts its own flusher
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='draft-flush', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            # Wake up after the interval, or early when save() found a full batch
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
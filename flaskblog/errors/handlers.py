@@ -19,6 +19,22 @@ def error_403(error):
     # Return a 403 status code to indicate that the request is forbidden
     return render_template('errors/403.html'), 403
 
+# Handle 429 (Too Many Requests) errors, e.g. too many login attempts, with a custom error page
+@errors.app_errorhandler(429)
+def error_429(error):
+    # Render the '429.html' template located in the 'errors' directory
+    # Keep the Retry-After header, which tells clients when to try again
+    headers = {'Retry-After': str(error.retry_after)} if getattr(error, 'retry_after', None) else {}
+    return render_template('errors/429.html', retry_after=getattr(error, 'retry_after', None)), 429, headers
+
+# Handle 503 (Service Unavailable) errors, e.g. a full password hashing queue, with a custom error page
+@errors.app_errorhandler(503)
+def error_503(error):
+    # Render the '503.html' template located in the 'errors' directory
+    # Keep the Retry-After header, which tells clients when to try again
+    headers = {'Retry-After': str(error.retry_after)} if getattr(error, 'retry_after', None) else {}
+    return render_template('errors/503.html', error=error), 503, headers
+
 # Handle 500 (Internal Server Error) with a custom error page
 @errors.app_errorhandler(500)
 def error_500(error):
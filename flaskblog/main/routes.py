@@ -1,30 +1,74 @@
-from flask import Blueprint, render_template, request
-from flaskblog.models import Post  # Import the 'Post' model from your application (adjust 'flaskblog' to your app's name)
+from flask import Blueprint, render_template, request, url_for
+from flaskblog import db, response_cache
+from flaskblog.models import Post, post_total, feed_version  # Import the 'Post' model from your application (adjust 'flaskblog' to your app's name)
+from flaskblog.pagination import keyset_paginate, offset_paginate
+from flaskblog.querycount import query_budget
+from flaskblog.conditional import conditional
+from flaskblog.posts.utils import posts_api_response, listing_options
+from flaskblog.posts.feeds import atom_feed_response, build_atom_feed, latest_posts
 
 # Create a Blueprint instance for the 'main' blueprint
 # This will group the routes related to the main part of the website
 main = Blueprint('main', __name__)
 
+# Cheap validator for the home feed: the newest post date (straight off the feed index)
+# and the feed version counter that every post write bumps, fetched in a single query
+def feed_state():
+    newest, version = db.session.query(db.func.max(Post.date_posted), feed_version()).one()
+    return (newest, version), None
+
 # Define the route for the home page
 # The home page can be accessed using the root URL ("/") or "/home"
 @main.route("/")
 @main.route("/home")
+@conditional(feed_state)  # Answer repeat visits with a 304 before running the feed query
+@response_cache.cached('feed')  # Anonymous visitors get a cached copy until a post changes
+@query_budget(3)  # Post total, page query, and the logged-in user
 def home():
     # Get the current page number from the URL query parameters (e.g., ?page=2)
-    # If no page number is provided, default to page 1
-    page = request.args.get('page', 1, type=int)
-    
-    # Query the 'Post' model to get all posts, ordered by the date they were posted in descending order (newest first)
-    # Paginate the results, displaying 2 posts per page
-    posts = Post.query.order_by(Post.date_posted.desc()).paginate(page=page, per_page=2)
-    
+    # Only old-style links carry a page number, so it defaults to None
+    page = request.args.get('page', type=int)
+
+    # Load every author in the same query as the posts, so each card doesn't run its own SELECT
+    # Only the columns a card shows are selected, not the full post bodies
+    query = Post.query.options(*listing_options())
+    # Read the maintained post total instead of running COUNT(*) over the whole table
+    total = post_total()
+
+    if page is not None:
+        # Fall back to classic LIMIT/OFFSET pagination so existing ?page=N links keep working
+        # The post id breaks ties between posts published at the same moment
+        posts = offset_paginate(query.order_by(Post.date_posted.desc(), Post.id.desc()),
+                                page=page, per_page=2, total=total)
+    else:
+        # Seek past the (date_posted, id) key carried by the opaque cursor (e.g., ?cursor=...)
+        # This avoids the OFFSET scan on deep pages
+        posts = keyset_paginate(query, (Post.date_posted, Post.id),
+                                cursor=request.args.get('cursor'), per_page=2, total=total)
+
     # Render the 'home.html' template and pass the 'posts' object to it
     # This allows the template to display the posts on the home page
     return render_template('home.html', posts=posts)
 
+# JSON version of the home feed for API clients, so they don't have to scrape the HTML
+# Supports ?cursor=..., ?limit=N and ?fields=id,title,... (see posts_api_response)
+@main.route("/api/posts")
+@query_budget(1)  # The page of posts, with authors joined in
+def api_posts():
+    return posts_api_response(Post.query)
+
+# Atom feed of the newest posts, rebuilt only when a post is created, updated or deleted
+@main.route("/feed.atom")
+def feed():
+    def build():
+        return build_atom_feed('Flask Blog', url_for('main.feed', _external=True),
+                               url_for('main.home', _external=True), latest_posts(Post.query))
+    return atom_feed_response('atom:home', build)
+
 # Define the route for the about page
 # This page can be accessed using the URL "/about"
 @main.route("/about")
+@conditional(lambda: ('about', None))  # Static page: only a template change alters it
 def about():
     # Render the 'about.html' template
     # Pass a title variable to the template, which will be used as the page title
@@ -1,7 +1,9 @@
-from flaskblog import db, login_manager
+from flaskblog import db, login_manager, identity_cache
 from flask import current_app
 from datetime import datetime
 from flask_login import UserMixin
+from flaskblog.rendering import CURRENT_RENDERER, render_markdown
+from sqlalchemy.orm import validates
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
 from itsdangerous import BadSignature, SignatureExpired
 
@@ -9,12 +11,50 @@ from itsdangerous import BadSignature, SignatureExpired
 @login_manager.user_loader
 def load_user(user_id):
     """
-    Load a user by their user_id.
+    Load a user by their user_id, through the identity cache.
     
     :param user_id: The ID of the user to be loaded.
-    :return: The User object corresponding to the user_id.
+    :return: A UserSnapshot of the user, or None if there is no such user.
     """
-    return User.query.get(int(user_id))
+    return identity_cache.get(int(user_id), UserSnapshot.load)
+
+# Define the UserSnapshot class
+class UserSnapshot(UserMixin):
+    """
+    Lightweight, read-only copy of a user, which is what current_user holds.
+    
+    It is cached across requests, so it is not attached to a database session: views that
+    change a user must load the User itself, e.g. with db.session.get(User, current_user.id).
+    
+    Attributes:
+    - id, username, email, image_file: As on the User model.
+    """
+    
+    def __init__(self, id, username, email, image_file):
+        self.id = id
+        self.username = username
+        self.email = email
+        self.image_file = image_file
+    
+    @staticmethod
+    def load(user_id):
+        """
+        Load a snapshot from the database, reading only the columns it holds.
+        
+        :param user_id: The ID of the user.
+        :return: The UserSnapshot, or None if there is no such user.
+        """
+        row = (db.session.query(User.id, User.username, User.email, User.image_file)
+               .filter_by(id=user_id).first())
+        return None if row is None else UserSnapshot(*row)
+    
+    def __repr__(self):
+        """
+        Return a string representation of the UserSnapshot object.
+        
+        :return: A string showing the username and email.
+        """
+        return f"UserSnapshot('{self.username}', '{self.email}')"
 
 # Define the User model
 class User(db.Model, UserMixin):
@@ -27,6 +67,7 @@ class User(db.Model, UserMixin):
     - email: The user's email, must be unique and non-nullable.
     - image_file: Path to the user's profile picture.
     - password: The hashed password for the user.
+    - post_count: The number of posts authored by the user, maintained on every post write.
     - posts: Relationship to the Post model, representing posts authored by the user.
     """
     
@@ -35,8 +76,25 @@ class User(db.Model, UserMixin):
     email = db.Column(db.String(120), unique=True, nullable=False)
     image_file = db.Column(db.String(100), nullable=False, default='default.jpg')
     password = db.Column(db.String(60), nullable=False)
+    post_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     posts = db.relationship('Post', backref='author', lazy=True)
     
+    # Emails are matched case-insensitively, so logins and uniqueness checks look them up by lower(email),
+    # and two concurrent sign-ups with case variants of one address can't both commit
+    __table_args__ = (
+        db.Index('ix_user_email_lower', db.func.lower(email), unique=True),
+    )
+    
+    @staticmethod
+    def find_by_email(email):
+        """
+        Look up a user by email, ignoring case, through the unique lower(email) index.
+        
+        :param email: The email address as typed by the user.
+        :return: The User object, or None if no account has that email.
+        """
+        return User.query.filter(db.func.lower(User.email) == email.lower()).first()
+    
     def get_reset_token(self, expires_sec=1800):
         """
         Generate a reset token for the user, expiring after a specified number of seconds.
@@ -76,6 +134,37 @@ class User(db.Model, UserMixin):
         """
         return f"User('{self.username}', '{self.email}', '{self.image_file}')"
 
+# Maximum number of characters of a post's content shown on listing pages
+EXCERPT_LENGTH = 280
+
+def make_excerpt(content, length=EXCERPT_LENGTH):
+    """
+    Cut a post's content down to an excerpt for listing pages.
+    
+    :param content: The full content of the post.
+    :param length: The maximum length of the excerpt, not counting the trailing ellipsis.
+    :return: The content itself if it is short enough, otherwise its start up to a word boundary.
+    """
+    content = (content or '').strip()
+    if len(content) <= length:
+        return content
+    # Drop the last, possibly cut off, word (rsplit keeps a single long word whole)
+    cut = content[:length].rsplit(None, 1)[0]
+    return cut.rstrip() + '\u2026'
+
+# Limits on the tags of a post; the tag names are also stored on the post, joined by commas
+MAX_TAGS = 10
+MAX_TAG_LENGTH = 30
+
+# Association table between posts and tags
+# The (tag_id, post_id) index serves the tag listing pages; the primary key serves lookups by post
+post_tag = db.Table(
+    'post_tag',
+    db.Column('post_id', db.Integer, db.ForeignKey('post.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('tag_id', db.Integer, db.ForeignKey('tag.id', ondelete='CASCADE'), primary_key=True),
+    db.Index('ix_post_tag_tag_id_post_id', 'tag_id', 'post_id'),
+)
+
 # Define the Post model
 class Post(db.Model):
     """
@@ -85,15 +174,82 @@ class Post(db.Model):
     - id: Unique identifier for the post.
     - title: The title of the post, must be non-nullable.
     - date_posted: The date and time when the post was created.
-    - content: The content of the post, must be non-nullable.
+    - content: The Markdown source of the post, must be non-nullable.
+    - excerpt: The start of the content, kept in sync with it and shown on listing pages.
+    - content_html: The content rendered to sanitized HTML, shown on the post's page.
+    - renderer_version: The renderer that produced content_html, see flaskblog.rendering.
     - user_id: Foreign key to the User model, representing the post's author.
+    - version: Incremented on every edit, so caches keyed on it never serve an outdated post.
+    - views: The number of times the post's page was viewed, written in batches by the view counter.
+    - related_version: Incremented whenever the batch jobs rewrite the post's related posts.
+    - tag_names: The post's tag names joined by commas, so cards can show them without a join.
+    - tags: Relationship to the Tag model; read-only, tags are written by flaskblog.tags.utils.set_post_tags.
     """
     
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)
     date_posted = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     content = db.Column(db.Text, nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    excerpt = db.Column(db.String(EXCERPT_LENGTH + 1), nullable=False, default='', server_default='')
+    content_html = db.Column(db.Text, nullable=True)
+    renderer_version = db.Column(db.String(32), nullable=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # Indexed by ix_post_user_id_date_posted
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    views = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
+    related_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    tag_names = db.Column(db.String(MAX_TAGS * (MAX_TAG_LENGTH + 1)), nullable=False, default='', server_default='')
+    tags = db.relationship('Tag', secondary=post_tag, lazy='select', viewonly=True)
+    
+    # Composite indexes backing the home feed (newest first) and per-author listings
+    __table_args__ = (
+        db.Index('ix_post_date_posted_id', 'date_posted', 'id'),
+        db.Index('ix_post_user_id_date_posted', 'user_id', 'date_posted', 'id'),
+    )
+    
+    @validates('content')
+    def _update_derived_content(self, key, content):
+        """
+        Keep the excerpt and the rendered HTML in sync whenever the content is set, on create
+        as well as on update, so that views never have to render Markdown.
+        """
+        for column, value in Post.derived_columns(content).items():
+            setattr(self, column, value)
+        return content
+    
+    @staticmethod
+    def derived_columns(content):
+        """
+        Compute the columns derived from a post's content.
+        
+        Bulk UPDATE statements bypass the validator above, so they must set these themselves.
+        
+        :param content: The Markdown source of the post.
+        :return: A dict mapping column names to values.
+        """
+        return {
+            'excerpt': make_excerpt(content),
+            'content_html': render_markdown(content),
+            'renderer_version': CURRENT_RENDERER,
+        }
+    
+    def refresh_html(self):
+        """
+        Re-render content_html if it was produced by another renderer version (or never).
+        
+        :return: True if the HTML was re-rendered and the post needs to be committed.
+        """
+        if self.renderer_version == CURRENT_RENDERER and self.content_html is not None:
+            return False
+        self.content_html = render_markdown(self.content)
+        self.renderer_version = CURRENT_RENDERER
+        return True
+    
+    @property
+    def tag_list(self):
+        """
+        The post's tag names as a list, read from the denormalized tag_names column.
+        """
+        return self.tag_names.split(',') if self.tag_names else []
     
     def __repr__(self):
         """
@@ -102,3 +258,241 @@ class Post(db.Model):
         :return: A string showing the title and date_posted.
         """
         return f"Post('{self.title}', '{self.date_posted}')"
+
+# Define the Tag model
+class Tag(db.Model):
+    """
+    Tag model representing a topic posts can be filed under.
+    
+    Attributes:
+    - id: Unique identifier for the tag.
+    - name: The tag's name, lowercase and unique.
+    - post_count: The number of posts carrying the tag, maintained on every post write,
+      so tag clouds and tag pages never need a GROUP BY over post_tag.
+    """
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(MAX_TAG_LENGTH), unique=True, nullable=False)
+    post_count = db.Column(db.Integer, nullable=False, default=0, server_default='0', index=True)
+    
+    def __repr__(self):
+        """
+        Return a string representation of the Tag object.
+        
+        :return: A string showing the name and post_count.
+        """
+        return f"Tag('{self.name}', '{self.post_count}')"
+
+# Define the ArchiveMonth model
+class ArchiveMonth(db.Model):
+    """
+    ArchiveMonth model holding the number of posts published in every month (UTC).
+    
+    A rollup of post.date_posted kept current by every post insert and delete, so the archive
+    page reads a dozen rows per year instead of grouping the whole post table.
+    
+    Attributes:
+    - year: The year, e.g. 2024.
+    - month: The month, 1 to 12.
+    - post_count: The number of posts published in that month; months drop to 0 rather than
+      being deleted when their last post goes.
+    """
+    
+    __tablename__ = 'archive_month'
+    
+    year = db.Column(db.SmallInteger, primary_key=True, autoincrement=False)
+    month = db.Column(db.SmallInteger, primary_key=True, autoincrement=False)
+    post_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
+    def __repr__(self):
+        """
+        Return a string representation of the ArchiveMonth object.
+        
+        :return: A string showing the year, month and post_count.
+        """
+        return f"ArchiveMonth('{self.year}-{self.month:02d}', '{self.post_count}')"
+
+# Define the Draft model
+class Draft(db.Model):
+    """
+    Draft model holding a post that is still being written, saved by the editor's autosave.
+    
+    Autosaves are buffered per worker and written in batches by flaskblog.drafts.DraftBuffer,
+    so a draft may trail the editor by up to DRAFT_FLUSH_INTERVAL seconds.
+    
+    Attributes:
+    - id: Unique identifier for the draft.
+    - user_id: Foreign key to the User model, representing the draft's author.
+    - title: The title typed so far.
+    - content: The content typed so far.
+    - tags: The tag input typed so far, unparsed.
+    - date_saved: When the editor sent this state; older states never overwrite newer ones.
+    """
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    title = db.Column(db.String(100), nullable=False, default='', server_default='')
+    content = db.Column(db.Text, nullable=False, default='', server_default='')
+    tags = db.Column(db.String(MAX_TAGS * (MAX_TAG_LENGTH + 1)), nullable=False, default='', server_default='')
+    date_saved = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    def __repr__(self):
+        """
+        Return a string representation of the Draft object.
+        
+        :return: A string showing the title and date_saved.
+        """
+        return f"Draft('{self.title}', '{self.date_saved}')"
+
+# Define the PostRevision model
+class PostRevision(db.Model):
+    """
+    PostRevision model recording every version of a post, see flaskblog.posts.revisions.
+    
+    Most revisions store a zlib-compressed delta against the previous version; every few
+    versions a compressed snapshot of the whole content starts a new chain, so rebuilding any
+    version reads at most one snapshot and a handful of deltas.
+    
+    Attributes:
+    - post_id: The post the revision belongs to.
+    - version: The post's version this revision records.
+    - title: The post's title at that version.
+    - date_edited: The date and time the version was saved.
+    - snapshot: Whether data holds the whole content rather than a delta.
+    - data: The compressed content or delta.
+    """
+    
+    __tablename__ = 'post_revision'
+    
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id', ondelete='CASCADE'), primary_key=True)
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    title = db.Column(db.String(100), nullable=False)
+    date_edited = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    snapshot = db.Column(db.Boolean, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+    
+    def __repr__(self):
+        """
+        Return a string representation of the PostRevision object.
+        
+        :return: A string showing the post, version and date_edited.
+        """
+        return f"PostRevision('{self.post_id}', '{self.version}', '{self.date_edited}')"
+
+# Define the RelatedPost model
+class RelatedPost(db.Model):
+    """
+    RelatedPost model holding the precomputed most similar posts of every post.
+    
+    Rows are written by the batch jobs in flaskblog.posts.related, never by requests, so the
+    post page reads its related posts with a single primary key range scan.
+    
+    Attributes:
+    - post_id: The post the list belongs to.
+    - rank: The position in the list, 0 being the most similar post.
+    - related_id: The related post.
+    - score: The cosine similarity of the two posts' TF-IDF vectors.
+    """
+    
+    __tablename__ = 'related_post'
+    
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id', ondelete='CASCADE'), primary_key=True)
+    rank = db.Column(db.SmallInteger, primary_key=True, autoincrement=False)
+    related_id = db.Column(db.Integer, db.ForeignKey('post.id', ondelete='CASCADE'), nullable=False, index=True)
+    score = db.Column(db.Float, nullable=False)
+
+# Define the Counter model
+class Counter(db.Model):
+    """
+    Counter model holding named, incrementally maintained totals such as the number of posts.
+    
+    Reading a counter is a primary key lookup, which replaces a full SELECT count(*) on large tables.
+    Counters must be updated in the same transaction as the rows they count.
+    
+    Attributes:
+    - name: The name of the counter, e.g. 'post_total'.
+    - value: The current value of the counter.
+    """
+    
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+    
+    @staticmethod
+    def increment(name, delta=1):
+        """
+        Add delta to a counter as part of the current transaction, creating it if needed.
+        
+        :param name: The name of the counter.
+        :param delta: The amount to add, negative to decrement.
+        """
+        # Let the database do the arithmetic so that concurrent writers don't lose updates
+        updated = Counter.query.filter_by(name=name).update(
+            {Counter.value: Counter.value + delta}, synchronize_session=False)
+        if not updated:
+            # First write to this counter: start it off at delta
+            db.session.add(Counter(name=name, value=delta))
+    
+    @staticmethod
+    def get(name):
+        """
+        Read the current value of a counter.
+        
+        :param name: The name of the counter.
+        :return: The value, or None if the counter has never been written.
+        """
+        return db.session.query(Counter.value).filter_by(name=name).scalar()
+
+
+def counter_value(name):
+    """
+    Return a scalar subquery reading a counter, to embed in another query and save a round trip.
+    
+    :param name: The name of the counter.
+    :return: A scalar subquery selecting the counter's value.
+    """
+    return db.session.query(Counter.value).filter_by(name=name).scalar_subquery()
+
+
+def feed_version():
+    """
+    Return a scalar subquery reading the 'feed_version' counter.
+    
+    The counter is bumped by every write that changes what a listing shows, which makes it a
+    cheap validator for conditional GETs; embed it in another query to save a round trip.
+    
+    :return: A scalar subquery selecting the counter's value.
+    """
+    return counter_value('feed_version')
+
+
+def estimate_row_count(model):
+    """
+    Return the planner's estimate of the number of rows in a model's table.
+    
+    On PostgreSQL this reads pg_class.reltuples, which is kept up to date by ANALYZE and
+    autovacuum and costs nothing compared to a COUNT(*). Other databases have no equivalent.
+    
+    :param model: The model class whose table should be estimated.
+    :return: The estimated number of rows, or None if no estimate is available.
+    """
+    if db.session.get_bind().dialect.name != 'postgresql':
+        return None
+    estimate = db.session.execute(
+        db.text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:table)"),
+        {'table': model.__tablename__}).scalar()
+    # reltuples is -1 (or 0) for tables that have never been analyzed
+    return estimate if estimate and estimate > 0 else None
+
+
+def post_total():
+    """
+    Return the total number of posts without counting rows.
+    
+    Falls back to the planner's estimate when the counter has not been created yet.
+    
+    :return: The number of posts, or None if neither the counter nor an estimate is available.
+    """
+    total = Counter.get('post_total')
+    if total is None:
+        total = estimate_row_count(Post)
+    return total
@@ -0,0 +1,190 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from flask import abort
+from sqlalchemy import tuple_
+from flaskblog import db
+
+
+def encode_cursor(values, direction='next'):
+    """
+    Encode a sort key into an opaque, URL-safe cursor string.
+
+    :param values: The sort key values of the boundary row, e.g. (date_posted, id).
+    :param direction: 'next' to page towards older rows, 'prev' to page towards newer rows.
+    :return: The cursor as a URL-safe base64 string.
+    """
+    # Datetimes are not JSON serializable, so store them as ISO 8601 strings
+    key = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    # Keep the payload compact: 'n'/'p' for the direction and 'k' for the key
+    payload = json.dumps({'d': direction[0], 'k': key}, separators=(',', ':'))
+    # Strip the base64 padding so the cursor stays clean in query strings
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def _decode_value(column, value):
+    # Check every value against its column's type, so a forged cursor can't reach the query
+    if isinstance(column.type, db.DateTime):
+        if not isinstance(value, str):
+            raise ValueError('cursor date is not a string')
+        return datetime.fromisoformat(value)
+    python_type = column.type.python_type
+    # bool is an int to Python, but never a valid key
+    if python_type not in (int, str) or type(value) is not python_type:
+        raise ValueError(f'cursor value {value!r} does not match column {column.key}')
+    return value
+
+
+def decode_cursor(cursor, columns):
+    """
+    Decode a cursor produced by encode_cursor back into a direction and sort key.
+
+    :param cursor: The cursor string taken from the query string.
+    :param columns: The columns the key was built from, used to restore value types.
+    :return: A (direction, values) tuple. Aborts with 400 if the cursor is malformed.
+    """
+    try:
+        # Restore the padding that was stripped when the cursor was encoded
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        direction = {'n': 'next', 'p': 'prev'}[payload['d']]
+        key = payload['k']
+        if not isinstance(key, list) or len(key) != len(columns):
+            raise ValueError('cursor key does not match the sort columns')
+        # Turn ISO strings back into datetimes for DateTime columns, and check the other values
+        values = tuple(_decode_value(column, value) for column, value in zip(columns, key))
+    except (binascii.Error, UnicodeError, ValueError, KeyError, TypeError):
+        # A tampered or truncated cursor is a client error, not a server one
+        abort(400)
+    return direction, values
+
+
+class KeysetPage:
+    """
+    A single page of results fetched with keyset (seek) pagination.
+
+    Unlike Flask-SQLAlchemy's Pagination object this never runs COUNT(*) or OFFSET.
+    Navigation happens through opaque cursors instead of page numbers.
+
+    Attributes:
+    - items: The rows on this page, newest first.
+    - per_page: The maximum number of rows per page.
+    - has_next / has_prev: Whether older / newer rows exist.
+    - next_cursor / prev_cursor: Cursors for the neighbouring pages, or None.
+    - total: The total number of rows if the caller knows it, otherwise None.
+    """
+
+    def __init__(self, items, per_page, has_next, has_prev, columns, total=None):
+        self.items = items
+        self.per_page = per_page
+        self.has_next = has_next
+        self.has_prev = has_prev
+        self.total = total
+        self._columns = columns
+
+    def _key(self, item):
+        # Read the sort key values off a row, e.g. (post.date_posted, post.id)
+        return tuple(getattr(item, column.key) for column in self._columns)
+
+    @property
+    def next_cursor(self):
+        """
+        Cursor pointing at the page of rows older than the last item on this page.
+        """
+        if not self.has_next or not self.items:
+            return None
+        return encode_cursor(self._key(self.items[-1]), 'next')
+
+    @property
+    def prev_cursor(self):
+        """
+        Cursor pointing at the page of rows newer than the first item on this page.
+        """
+        if not self.has_prev or not self.items:
+            return None
+        return encode_cursor(self._key(self.items[0]), 'prev')
+
+    @property
+    def pages(self):
+        """
+        The total number of pages, or None when the total row count is unknown.
+        """
+        if self.total is None:
+            return None
+        return max(1, -(-self.total // self.per_page))
+
+
+def offset_paginate(query, page, per_page, total=None):
+    """
+    Paginate a query with LIMIT/OFFSET, reusing a known row count instead of running COUNT(*).
+
+    :param query: The ordered query to paginate.
+    :param page: The 1-based page number.
+    :param per_page: The number of rows per page.
+    :param total: The total row count from a maintained counter, or None to count the rows.
+    :return: A Flask-SQLAlchemy Pagination object.
+    """
+    if total is None:
+        # Nothing cheaper is available, so let Flask-SQLAlchemy count the rows
+        return query.paginate(page=page, per_page=per_page)
+    # Skip the COUNT(*) query and plug in the total we already have
+    pagination = query.paginate(page=page, per_page=per_page, count=False)
+    pagination.total = total
+    return pagination
+
+
+def keyset_query(query, columns, cursor=None, limit=20):
+    """
+    Apply a keyset (seek) predicate, ordering and limit to a query.
+
+    One extra row is fetched beyond the limit, so callers can tell whether more rows follow.
+
+    :param query: The base query, without an ORDER BY clause.
+    :param columns: The sort columns, e.g. (Post.date_posted, Post.id). The last one must be unique.
+    :param cursor: The opaque cursor from the previous page, or None for the first page.
+    :param limit: The number of rows wanted.
+    :return: A (direction, query) tuple. In the 'prev' direction rows come back oldest first.
+    """
+    if cursor is None:
+        # First page: simply the newest rows
+        return 'first', query.order_by(*[column.desc() for column in columns]).limit(limit + 1)
+
+    direction, values = decode_cursor(cursor, columns)
+    key = tuple_(*columns)
+
+    if direction == 'next':
+        # Older rows: seek past the boundary row in descending order
+        query = query.filter(key < tuple_(*values)).order_by(*[column.desc() for column in columns])
+    else:
+        # Newer rows: seek backwards in ascending order, the caller flips them back
+        query = query.filter(key > tuple_(*values)).order_by(*[column.asc() for column in columns])
+    return direction, query.limit(limit + 1)
+
+
+def keyset_paginate(query, columns, cursor=None, per_page=20, total=None):
+    """
+    Paginate a query with a keyset (seek) predicate instead of LIMIT/OFFSET.
+
+    Rows are ordered by the given columns in descending order. The last column must be
+    unique (e.g. the primary key) so that the ordering is total and no rows are skipped.
+
+    :param query: The base query, without an ORDER BY clause.
+    :param columns: The sort columns, e.g. (Post.date_posted, Post.id).
+    :param cursor: The opaque cursor from the previous page, or None for the first page.
+    :param per_page: The number of rows per page.
+    :param total: The total row count if it is already known, otherwise None.
+    :return: A KeysetPage with the requested rows.
+    """
+    direction, query = keyset_query(query, columns, cursor, per_page)
+    rows = query.all()
+    more = len(rows) > per_page
+
+    if direction == 'first':
+        return KeysetPage(rows[:per_page], per_page, more, False, columns, total)
+    if direction == 'next':
+        # We got here from a newer page, so there is always a previous page
+        return KeysetPage(rows[:per_page], per_page, more, True, columns, total)
+    # Rows came back oldest first, flip them back to newest first
+    items = list(reversed(rows[:per_page]))
+    return KeysetPage(items, per_page, True, more, columns, total)
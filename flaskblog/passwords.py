@@ -0,0 +1,137 @@
+import hmac
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import bcrypt
+from werkzeug.exceptions import ServiceUnavailable
+
+
+class HashingBusy(ServiceUnavailable):
+    """
+    Raised when the password hashing queue is full; answered with 503 Service Unavailable.
+    """
+
+    description = 'Too many sign-ins at once. Please try again in a few seconds.'
+
+
+def hash_password(password, rounds):
+    """
+    Hash a password with bcrypt; runs in the hashing executor.
+
+    :param password: The password.
+    :param rounds: The bcrypt work factor (log2 of the number of rounds).
+    :return: The hash, as a string.
+    """
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=rounds)).decode('utf-8')
+
+
+def check_password(pw_hash, password):
+    """
+    Check a password against a bcrypt hash; runs in the hashing executor.
+
+    :param pw_hash: The stored hash.
+    :param password: The password to check.
+    :return: True if the password matches.
+    """
+    pw_hash = pw_hash.encode('utf-8')
+    return hmac.compare_digest(bcrypt.hashpw(password.encode('utf-8'), pw_hash), pw_hash)
+
+
+def hash_rounds(pw_hash):
+    """
+    Read the work factor of a bcrypt hash, e.g. 12 for '$2b$12$...'.
+
+    :param pw_hash: The hash.
+    :return: The work factor, or 0 if the hash isn't a bcrypt hash.
+    """
+    try:
+        return int(pw_hash.split('$')[2])
+    except (IndexError, ValueError):
+        return 0
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt on a dedicated, bounded pool instead of inline in the request.
+
+    The request still waits for its hash, but at most PASSWORD_HASH_WORKERS hashes run at a
+    time per worker process, and at most PASSWORD_HASH_QUEUE more wait for a slot; beyond that
+    requests fail fast with 503 instead of piling up behind each other. bcrypt releases the
+    GIL, so the default thread pool runs hashes on several cores; PASSWORD_HASH_EXECUTOR='process'
+    uses a process pool instead. New hashes use BCRYPT_LOG_ROUNDS, and needs_rehash tells
+    which stored hashes fall short of it.
+    """
+
+    def __init__(self, app=None):
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Read the hashing policy and pool settings from the app config.
+
+        :param app: The Flask application.
+        """
+        self.rounds = app.config.get('BCRYPT_LOG_ROUNDS', 12)
+        self.kind = app.config.get('PASSWORD_HASH_EXECUTOR', 'thread')
+        self.workers = app.config.get('PASSWORD_HASH_WORKERS') or os.cpu_count() or 1
+        self._slots = threading.BoundedSemaphore(self.workers + app.config.get('PASSWORD_HASH_QUEUE', 16))
+        app.extensions['password_hasher'] = self
+
+    def hash(self, password):
+        """
+        Hash a password with the current work factor.
+
+        :param password: The password.
+        :return: The hash, as a string. Raises HashingBusy if the queue is full.
+        """
+        return self._run(hash_password, password, self.rounds)
+
+    def check(self, pw_hash, password):
+        """
+        Check a password against a stored hash.
+
+        :param pw_hash: The stored hash.
+        :param password: The password to check.
+        :return: True if the password matches. Raises HashingBusy if the queue is full.
+        """
+        return self._run(check_password, pw_hash, password)
+
+    def needs_rehash(self, pw_hash):
+        """
+        Tell whether a stored hash is weaker than the current policy.
+
+        :param pw_hash: The stored hash.
+        :return: True if it was made with fewer rounds than BCRYPT_LOG_ROUNDS.
+        """
+        return hash_rounds(pw_hash) < self.rounds
+
+    def _run(self, function, *args):
+        # Take a slot without waiting: a full queue means we're already behind
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy(retry_after=1)
+        try:
+            future = self._ensure_executor().submit(function, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result()
+
+    def _ensure_executor(self):
+        # Pools don't survive a fork, so every worker process starts its own
+        if self._executor is not None and self._pid == os.getpid():
+            return self._executor
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                if self.kind == 'process':
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                elif self.kind == 'thread':
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password-hash')
+                else:
+                    raise ValueError(f"Unknown password hash executor: {self.kind!r}")
+        return self._executor
@@ -0,0 +1,101 @@
+import hashlib
+from datetime import datetime, timezone
+from xml.sax.saxutils import escape
+from flask import Response, current_app, request, url_for
+from flaskblog import db, response_cache
+from flaskblog.models import Counter, Post
+
+
+def _atom_date(value):
+    # Post dates are stored as naive UTC datetimes; Atom wants RFC 3339 with a zone
+    return value.replace(tzinfo=timezone.utc).isoformat()
+
+
+def build_atom_feed(title, feed_url, site_url, posts):
+    """
+    Render a list of posts as an Atom 1.0 document.
+
+    :param title: The title of the feed.
+    :param feed_url: The absolute URL of the feed itself.
+    :param site_url: The absolute URL of the HTML page the feed mirrors.
+    :param posts: The posts to include, newest first, with their authors loaded.
+    :return: The feed as UTF-8 encoded bytes.
+    """
+    updated = posts[0].date_posted if posts else datetime(1970, 1, 1)
+    parts = [
+        '<?xml version="1.0" encoding="utf-8"?>\n',
+        '<feed xmlns="http://www.w3.org/2005/Atom">',
+        f'<title>{escape(title)}</title>',
+        f'<id>{escape(feed_url)}</id>',
+        f'<link rel="self" href="{escape(feed_url)}"/>',
+        f'<link rel="alternate" type="text/html" href="{escape(site_url)}"/>',
+        f'<updated>{_atom_date(updated)}</updated>',
+    ]
+    for post in posts:
+        post_url = url_for('posts.post', post_id=post.id, _external=True)
+        parts += [
+            '<entry>',
+            f'<title>{escape(post.title)}</title>',
+            f'<id>{escape(post_url)}</id>',
+            f'<link rel="alternate" type="text/html" href="{escape(post_url)}"/>',
+            f'<published>{_atom_date(post.date_posted)}</published>',
+            f'<updated>{_atom_date(post.date_posted)}</updated>',
+            f'<author><name>{escape(post.author.username)}</name></author>',
+            f'<content type="text">{escape(post.content)}</content>',
+            '</entry>',
+        ]
+    parts.append('</feed>')
+    return ''.join(parts).encode('utf-8')
+
+
+def atom_feed_response(key, build):
+    """
+    Serve an Atom feed from the cache, rebuilding it only after a post write.
+
+    The cached entry is stamped with the feed_version counter, which every post write bumps
+    in the database, so a write handled by any worker is seen by all of them, whatever the
+    cache backend. The entry also carries the feed's ETag and Last-Modified, so conditional
+    polls are answered with a 304 after reading that one counter.
+
+    :param key: The cache key of the feed, e.g. 'atom:home'.
+    :param build: A function returning the feed's bytes, called on a cache miss.
+    :return: A Flask Response, with status 304 if the client's copy is still current.
+    """
+    cache = response_cache.cache
+    key = 'feed:' + key
+    entry = cache.get(key)
+    # Read the version before the posts, so a write racing with the build leaves the entry
+    # stamped with an outdated version instead of hiding the write
+    version = Counter.get('feed_version')
+
+    if entry is None or entry['version'] != version:
+        body = build()
+        etag = hashlib.sha1(body).hexdigest()
+        if entry is not None and entry['etag'] == etag:
+            # Same content as before (e.g. the write didn't touch this feed), so keep the date
+            last_modified = entry['last_modified']
+        else:
+            last_modified = datetime.now(timezone.utc).replace(microsecond=0)
+        entry = {'body': body, 'etag': etag, 'last_modified': last_modified, 'version': version}
+        cache.set(key, entry, ttl=current_app.config['FEED_CACHE_TTL'])
+
+    response = Response(entry['body'], mimetype='application/atom+xml')
+    response.set_etag(entry['etag'])
+    response.last_modified = entry['last_modified']
+    # Feed readers poll often, let them revalidate instead of refetching
+    response.cache_control.no_cache = True
+    # Turns the response into a 304 if If-None-Match / If-Modified-Since match
+    return response.make_conditional(request)
+
+
+def latest_posts(query):
+    """
+    Load the posts of a feed, newest first, with their authors.
+
+    :param query: The base post query, e.g. filtered to one author.
+    :return: A list of at most FEED_LENGTH posts.
+    """
+    return (query.options(db.joinedload(Post.author))
+            .order_by(Post.date_posted.desc(), Post.id.desc())
+            .limit(current_app.config['FEED_LENGTH'])
+            .all())
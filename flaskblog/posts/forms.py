@@ -1,6 +1,8 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, TextAreaField, SubmitField
-from wtforms.validators import DataRequired
+from wtforms import StringField, TextAreaField, SubmitField, IntegerField
+from wtforms.widgets import HiddenInput
+from wtforms.validators import DataRequired, Optional, ValidationError
+from flaskblog.tags.utils import parse_tags
 
 # Define a form class for creating or editing blog posts
 class PostForm(FlaskForm):
@@ -12,5 +14,25 @@ class PostForm(FlaskForm):
     # 'DataRequired()' validator ensures that the content field cannot be empty
     content = TextAreaField('Content', validators=[DataRequired()])
     
+    # A tags field for the post, e.g. "flask, python"
+    # 'Optional()' allows posts without tags
+    tags = StringField('Tags', validators=[Optional()])
+    
+    # The version of the post the form was filled from, rendered by hidden_tag() when editing
+    # A save fails with 409 Conflict if the post was changed since, instead of overwriting the change
+    version = IntegerField(widget=HiddenInput(), validators=[Optional()])
+    
+    # The draft the form was filled from, deleted once the post is published
+    # The editor's autosave fills it in when it creates a draft
+    draft_id = IntegerField(widget=HiddenInput(), validators=[Optional()])
+    
     # A submit button for submitting the form
     submit = SubmitField('Post')
+    
+    # Custom validation method for the tags field, checking every tag name
+    def validate_tags(self, tags):
+        try:
+            parse_tags(tags.data)
+        except ValueError as error:
+            # If a name is invalid, raise a validation error with the reason
+            raise ValidationError(str(error))
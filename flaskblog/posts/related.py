@@ -0,0 +1,277 @@
+import math
+import os
+from collections import Counter as TermCounter
+from flaskblog import db, response_cache
+from flaskblog.models import Post, RelatedPost
+from flaskblog.search.index import tokenize
+
+# Similarity blocks are computed densely; keep each one around this many matrix cells
+BLOCK_CELLS = 16_000_000
+# Never put more than this many posts in one block, which is also one write transaction
+MAX_BLOCK_ROWS = 1000
+# Refit the vocabulary from scratch once this share of the posts changed since the last build
+REBUILD_RATIO = 0.2
+
+
+def _require_numpy():
+    # Optional dependencies, only needed by the batch jobs, never by the web workers
+    try:
+        import numpy
+        import scipy.sparse
+    except ImportError:
+        raise RuntimeError("Related posts require the 'numpy' and 'scipy' packages "
+                           "(pip install numpy scipy)")
+    return numpy, scipy.sparse
+
+
+def _post_tokens(title, content):
+    return tokenize(title) + tokenize(content)
+
+
+def fit_vocabulary(documents, min_df=2, max_df=0.5):
+    """
+    Choose the terms of the TF-IDF model and compute their inverse document frequencies.
+
+    Terms found in a single post can't relate it to another one, and terms found in most
+    posts relate everything to everything, so both are left out.
+
+    :param documents: The token lists of all posts.
+    :param min_df: The minimum number of posts a term must appear in.
+    :param max_df: The maximum share of the posts a term may appear in.
+    :return: A (vocabulary, idf) tuple: a dict mapping terms to columns, and a NumPy array.
+    """
+    numpy, _ = _require_numpy()
+    frequencies = TermCounter()
+    for tokens in documents:
+        frequencies.update(set(tokens))
+    count = len(documents)
+    ceiling = max(max_df * count, min_df)
+    terms = sorted(term for term, frequency in frequencies.items() if min_df <= frequency <= ceiling)
+    vocabulary = {term: column for column, term in enumerate(terms)}
+    # Smoothed idf, as in scikit-learn
+    idf = numpy.array([math.log((1 + count) / (1 + frequencies[term])) + 1 for term in terms])
+    return vocabulary, idf
+
+
+def vectorize(documents, vocabulary, idf):
+    """
+    Turn token lists into L2-normalized TF-IDF rows, so that dot products are cosine similarities.
+
+    :param documents: The token lists to vectorize.
+    :param vocabulary: The dict mapping terms to columns; other terms are ignored.
+    :param idf: The inverse document frequency of every column.
+    :return: A SciPy CSR matrix with one row per document.
+    """
+    numpy, sparse = _require_numpy()
+    indptr, indices, data = [0], [], []
+    for tokens in documents:
+        for term, frequency in TermCounter(token for token in tokens if token in vocabulary).items():
+            indices.append(vocabulary[term])
+            # Sublinear term frequency: the tenth mention of a word matters less than the first
+            data.append(1 + math.log(frequency))
+        indptr.append(len(indices))
+    matrix = sparse.csr_matrix(
+        (numpy.array(data, dtype=numpy.float32), numpy.array(indices, dtype=numpy.int32),
+         numpy.array(indptr, dtype=numpy.int64)),
+        shape=(len(documents), len(vocabulary)))
+    matrix = (matrix @ sparse.diags(idf.astype(numpy.float32))).tocsr()
+    norms = numpy.sqrt(numpy.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return (sparse.diags(1 / norms) @ matrix).tocsr().astype(numpy.float32)
+
+
+def top_k(matrix, rows, k):
+    """
+    Find the k most similar rows of the given rows, one vectorized block at a time.
+
+    :param matrix: The normalized TF-IDF matrix of all posts.
+    :param rows: The row numbers to find neighbours for.
+    :param k: The number of neighbours wanted.
+    :return: A generator of (rows, neighbours, scores, column_max) tuples, one per block:
+             neighbours and scores are k-wide arrays sorted best first, with -1 marking empty
+             slots, and column_max is every post's highest similarity to a row of the block.
+    """
+    numpy, _ = _require_numpy()
+    count = matrix.shape[0]
+    size = max(1, min(MAX_BLOCK_ROWS, BLOCK_CELLS // max(count, 1)))
+    transposed = matrix.T
+    wanted = min(k, count - 1)
+    for start in range(0, len(rows), size):
+        block = numpy.asarray(rows[start:start + size])
+        similarities = (matrix[block] @ transposed).toarray()
+        # A post is not related to itself
+        similarities[numpy.arange(len(block)), block] = 0
+        neighbours = numpy.full((len(block), k), -1, dtype=numpy.int64)
+        scores = numpy.zeros((len(block), k), dtype=numpy.float32)
+        if wanted > 0:
+            # argpartition finds the top k in linear time, then only those k get sorted
+            best = numpy.argpartition(-similarities, wanted - 1, axis=1)[:, :wanted]
+            best_scores = numpy.take_along_axis(similarities, best, axis=1)
+            order = numpy.argsort(-best_scores, axis=1, kind='stable')
+            neighbours[:, :wanted] = numpy.take_along_axis(best, order, axis=1)
+            scores[:, :wanted] = numpy.take_along_axis(best_scores, order, axis=1)
+            # Posts without a single shared term aren't related at all
+            neighbours[scores <= 0] = -1
+            scores[scores <= 0] = 0
+        yield block, neighbours, scores, similarities.max(axis=0)
+
+
+def _store(post_ids, neighbour_ids, scores):
+    # Replace the related posts of a block of posts in one short transaction
+    post_ids = [int(post_id) for post_id in post_ids]
+    db.session.execute(db.delete(RelatedPost).where(RelatedPost.post_id.in_(post_ids)))
+    rows = [
+        {'post_id': int(post_id), 'rank': rank, 'related_id': int(related_id), 'score': float(score)}
+        for post_id, related, related_scores in zip(post_ids, neighbour_ids, scores)
+        for rank, (related_id, score) in enumerate(zip(related, related_scores))
+        if related_id >= 0
+    ]
+    if rows:
+        db.session.execute(db.insert(RelatedPost), rows)
+    # Only these posts' pages change, so only their validators move
+    db.session.execute(db.update(Post).where(Post.id.in_(post_ids))
+                       .values(related_version=Post.related_version + 1))
+    db.session.commit()
+    response_cache.invalidate(*[f'post:{post_id}' for post_id in post_ids])
+
+
+def _save_model(path, model):
+    numpy, _ = _require_numpy()
+    matrix = model['matrix']
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as f:
+        numpy.savez(f, ids=model['ids'], versions=model['versions'],
+                    vocabulary=numpy.array(sorted(model['vocabulary'], key=model['vocabulary'].get)),
+                    idf=model['idf'], data=matrix.data, indices=matrix.indices, indptr=matrix.indptr,
+                    shape=numpy.array(matrix.shape), neighbours=model['neighbours'], scores=model['scores'])
+    os.replace(temporary, path)
+
+
+def _load_model(path):
+    numpy, sparse = _require_numpy()
+    with numpy.load(path, allow_pickle=False) as f:
+        return {
+            'ids': f['ids'],
+            'versions': f['versions'],
+            'vocabulary': {str(term): column for column, term in enumerate(f['vocabulary'])},
+            'idf': f['idf'],
+            'matrix': sparse.csr_matrix((f['data'], f['indices'], f['indptr']), shape=tuple(f['shape'])),
+            'neighbours': f['neighbours'],
+            'scores': f['scores'],
+        }
+
+
+def build_related(path, k):
+    """
+    Recompute the related posts of every post from scratch.
+
+    The TF-IDF model is written to path as well, so that update_related can later process
+    only the posts that changed.
+
+    :param path: The file to save the model to (.npz).
+    :param k: The number of related posts to keep per post.
+    :return: The number of posts processed.
+    """
+    numpy, _ = _require_numpy()
+    ids, versions, documents = [], [], []
+    rows = db.session.query(Post.id, Post.version, Post.title, Post.content).order_by(Post.id).yield_per(1000)
+    for post_id, version, title, content in rows:
+        ids.append(post_id)
+        versions.append(version)
+        documents.append(_post_tokens(title, content))
+    ids = numpy.array(ids, dtype=numpy.int64)
+    vocabulary, idf = fit_vocabulary(documents)
+    matrix = vectorize(documents, vocabulary, idf)
+    del documents
+
+    neighbours = numpy.full((len(ids), k), -1, dtype=numpy.int64)
+    scores = numpy.zeros((len(ids), k), dtype=numpy.float32)
+    for block, block_neighbours, block_scores, _ in top_k(matrix, numpy.arange(len(ids)), k):
+        # Store post ids rather than row numbers, which shift as posts come and go
+        neighbours[block] = numpy.where(block_neighbours >= 0, ids[block_neighbours], -1)
+        scores[block] = block_scores
+        _store(ids[block], neighbours[block], block_scores)
+
+    # Drop the lists of posts deleted since the previous build
+    db.session.execute(db.delete(RelatedPost).where(RelatedPost.post_id.not_in(db.select(Post.id))))
+    db.session.commit()
+    _save_model(path, {'ids': ids, 'versions': numpy.array(versions, dtype=numpy.int64),
+                       'vocabulary': vocabulary, 'idf': idf, 'matrix': matrix,
+                       'neighbours': neighbours, 'scores': scores})
+    return len(ids)
+
+
+def update_related(path, k):
+    """
+    Bring the related posts up to date with the posts created, edited or deleted since the
+    model at path was saved.
+
+    Changed posts are vectorized with the saved vocabulary and compared with every post. The
+    lists of other posts are recomputed only where they pointed at a changed or deleted post,
+    or where a changed post is now more similar than their k-th related post. Falls back to
+    build_related when there is no model yet or too much has changed.
+
+    :param path: The model file written by build_related.
+    :param k: The number of related posts to keep per post.
+    :return: The number of posts whose related posts were recomputed.
+    """
+    numpy, sparse = _require_numpy()
+    if not os.path.exists(path):
+        return build_related(path, k)
+    model = _load_model(path)
+    if model['neighbours'].shape[1] != k:
+        return build_related(path, k)
+
+    current = dict(db.session.query(Post.id, Post.version).all())
+    saved = dict(zip(model['ids'].tolist(), model['versions'].tolist()))
+    changed = sorted(post_id for post_id, version in current.items() if saved.get(post_id) != version)
+    deleted = sorted(set(saved) - set(current))
+    if not changed and not deleted:
+        return 0
+    if len(changed) > REBUILD_RATIO * len(current):
+        return build_related(path, k)
+
+    # Vectorize the changed posts with the saved vocabulary, loading them a block at a time
+    documents = []
+    for start in range(0, len(changed), MAX_BLOCK_ROWS):
+        block = changed[start:start + MAX_BLOCK_ROWS]
+        texts = dict((post_id, (title, content)) for post_id, title, content in
+                     db.session.query(Post.id, Post.title, Post.content).filter(Post.id.in_(block)))
+        documents += [_post_tokens(*texts[post_id]) for post_id in block]
+    changed_matrix = vectorize(documents, model['vocabulary'], model['idf'])
+
+    # Drop the old rows of changed and deleted posts, and append the new rows of changed posts
+    keep = ~numpy.isin(model['ids'], changed + deleted)
+    kept = int(keep.sum())
+    ids = numpy.concatenate([model['ids'][keep], numpy.array(changed, dtype=numpy.int64)])
+    versions = numpy.concatenate([model['versions'][keep],
+                                  numpy.array([current[post_id] for post_id in changed], dtype=numpy.int64)])
+    matrix = sparse.vstack([model['matrix'][keep], changed_matrix]).tocsr()
+    neighbours = numpy.concatenate([model['neighbours'][keep], numpy.full((len(changed), k), -1, dtype=numpy.int64)])
+    scores = numpy.concatenate([model['scores'][keep], numpy.zeros((len(changed), k), dtype=numpy.float32)])
+
+    def recompute(rows):
+        # Recompute and store the lists of some rows, returning every post's best similarity to them
+        best = numpy.zeros(len(ids), dtype=numpy.float32)
+        for block, block_neighbours, block_scores, column_max in top_k(matrix, rows, k):
+            neighbours[block] = numpy.where(block_neighbours >= 0, ids[block_neighbours], -1)
+            scores[block] = block_scores
+            _store(ids[block], neighbours[block], block_scores)
+            best = numpy.maximum(best, column_max)
+        return best
+
+    changed_rows = numpy.arange(kept, len(ids))
+    best = recompute(changed_rows)
+
+    # Other posts are affected if they listed a changed or deleted post, or if a changed post
+    # beats their weakest related post (whose score is 0 while a list isn't full)
+    stale = numpy.isin(neighbours, changed + deleted).any(axis=1)
+    affected = numpy.flatnonzero((stale | (best > scores[:, -1]))[:kept])
+    recompute(affected)
+
+    if deleted:
+        db.session.execute(db.delete(RelatedPost).where(RelatedPost.post_id.in_(deleted)))
+        db.session.commit()
+    _save_model(path, {'ids': ids, 'versions': versions, 'vocabulary': model['vocabulary'],
+                       'idf': model['idf'], 'matrix': matrix, 'neighbours': neighbours, 'scores': scores})
+    return len(changed) + len(affected)
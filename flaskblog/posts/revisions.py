@@ -0,0 +1,109 @@
+import difflib
+import json
+import zlib
+from flask import current_app
+from flaskblog import db
+from flaskblog.models import PostRevision
+
+
+def _compress(value):
+    return zlib.compress(value.encode('utf-8'), 9)
+
+
+def _decompress(data):
+    return zlib.decompress(data).decode('utf-8')
+
+
+def make_delta(old, new):
+    """
+    Describe how to turn one version of a post's content into the next.
+
+    The delta lists the changed line ranges of the old content together with their new text,
+    so its size grows with the edit rather than with the post.
+
+    :param old: The previous content.
+    :param new: The new content.
+    :return: A list of [start, end, text] operations replacing old lines start:end with text.
+    """
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    return [[i1, i2, ''.join(new_lines[j1:j2])]
+            for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag != 'equal']
+
+
+def apply_delta(old, delta):
+    """
+    Apply a delta produced by make_delta.
+
+    :param old: The content the delta was made against.
+    :param delta: The list of operations.
+    :return: The new content.
+    """
+    lines = old.splitlines(keepends=True)
+    parts, position = [], 0
+    for start, end, text in delta:
+        parts.extend(lines[position:start])
+        parts.append(text)
+        position = end
+    parts.extend(lines[position:])
+    return ''.join(parts)
+
+
+def revision_chain(post_id, version):
+    """
+    Load the revisions needed to rebuild a version of a post: the closest snapshot at or
+    before it, followed by every delta up to it. This is a single primary key range scan.
+
+    :param post_id: The id of the post.
+    :param version: The version to rebuild.
+    :return: The PostRevision rows, oldest first; empty if the version was never recorded.
+    """
+    snapshot = (db.session.query(db.func.max(PostRevision.version))
+                .filter(PostRevision.post_id == post_id, PostRevision.snapshot.is_(True),
+                        PostRevision.version <= version)
+                .scalar_subquery())
+    return (PostRevision.query
+            .filter(PostRevision.post_id == post_id, PostRevision.version >= snapshot,
+                    PostRevision.version <= version)
+            .order_by(PostRevision.version)
+            .all())
+
+
+def rebuild_content(chain):
+    """
+    Rebuild the content of the last revision of a chain returned by revision_chain.
+
+    :param chain: The snapshot followed by its deltas.
+    :return: The content, or None if the chain is empty.
+    """
+    if not chain:
+        return None
+    content = _decompress(chain[0].data)
+    for revision in chain[1:]:
+        content = apply_delta(content, json.loads(_decompress(revision.data)))
+    return content
+
+
+def record_revision(post):
+    """
+    Add the post's current version to its revision history, as part of the current transaction.
+
+    The revision is stored as a compressed delta against the previous version, unless the
+    previous version is unknown (e.g. the post predates revision history), REVISION_SNAPSHOT_INTERVAL
+    versions have passed since the last snapshot, or the delta would be no smaller than a snapshot.
+
+    :param post: The post, with its new title, content and version.
+    """
+    snapshot = _compress(post.content)
+    data, is_snapshot = snapshot, True
+    if post.version > 1:
+        chain = revision_chain(post.id, post.version - 1)
+        interval = current_app.config['REVISION_SNAPSHOT_INTERVAL']
+        # Only chain onto the previous version, and keep chains short enough to rebuild quickly
+        if chain and chain[-1].version == post.version - 1 and post.version - chain[0].version < interval:
+            delta = _compress(json.dumps(make_delta(rebuild_content(chain), post.content), separators=(',', ':')))
+            if len(delta) < len(snapshot):
+                data, is_snapshot = delta, False
+    db.session.add(PostRevision(post_id=post.id, version=post.version, title=post.title,
+                                snapshot=is_snapshot, data=data))
@@ -1,10 +1,24 @@
-from flask import Blueprint, render_template, url_for, flash, redirect, request, abort
+import os
+from concurrent.futures import ProcessPoolExecutor
+import click
+from flask import Blueprint, render_template, url_for, flash, redirect, request, abort, current_app, jsonify
 from flask_login import current_user, login_required
-from flaskblog import db
-from flaskblog.models import Post, User
+from sqlalchemy.exc import IntegrityError
+from flaskblog import db, response_cache, view_counter, draft_buffer
+from flaskblog import signals
+from flaskblog.models import Draft, Post, PostRevision, User, Counter
+from flaskblog.conditional import conditional
 from flaskblog.users.forms import UpdateAccountForm
 from flaskblog.posts.forms import PostForm
 from flaskblog.users.utils import save_picture
+from flaskblog.posts.utils import render_post_cards, posts_api_response, related_posts, owned_post_version
+from flaskblog.posts.related import build_related, update_related
+from flaskblog.posts.revisions import record_revision, rebuild_content, revision_chain
+from flaskblog.posts.feeds import atom_feed_response, build_atom_feed, latest_posts
+from flaskblog.querycount import query_budget
+from flaskblog.tags.utils import parse_tags, set_post_tags, write_tag_changes
+from flaskblog.archive.utils import count_archive_post
+from flaskblog.rendering import CURRENT_RENDERER, render_markdown
 
 # Create a Blueprint instance for the 'posts' blueprint
 # This will handle all routes related to posts
@@ -18,17 +32,33 @@ def account():
     form = UpdateAccountForm()
     # Check if the form has been submitted and is valid
     if form.validate_on_submit():
+        # current_user is a cached snapshot, so load the user itself to change it
+        user = db.session.get(User, current_user.id)
         # If the user has uploaded a new profile picture, save it
         if form.picture.data:
             # Save the picture using the save_picture function and store the filename
             picture_file = save_picture(form.picture.data)
-            # Update the current user's image file in the database
-            current_user.image_file = picture_file
-        # Update the current user's username and email with the new data from the form
-        current_user.username = form.username.data
-        current_user.email = form.email.data
-        # Commit the changes to the database
-        db.session.commit()
+            # Update the user's image file in the database
+            user.image_file = picture_file
+        # Remember the old username so cached pages under it can be dropped
+        old_username = user.username
+        # Update the user's username and email with the new data from the form
+        user.username = form.username.data
+        user.email = form.email.data
+        # Listings show the username and avatar, so their validators must change too
+        Counter.increment('feed_version')
+        try:
+            # Commit the changes to the database
+            db.session.commit()
+        except IntegrityError:
+            # Another user took the new username or email between the check and the update
+            db.session.rollback()
+            if form.check_unique():
+                raise
+            image_file = url_for('static', filename='profile_pics/' + current_user.image_file)
+            return render_template('account.html', title='Account', image_file=image_file, form=form)
+        # Let caches (including the cached current_user) know the user's details may have changed
+        signals.account_updated.send(current_app._get_current_object(), user=user, old_username=old_username)
         # Flash a success message to the user
         flash('Your account has been updated!', 'success')
         # Redirect the user back to the account page
@@ -53,55 +83,208 @@ def new_post():
     # Check if the form has been submitted and is valid
     if form.validate_on_submit():
         # Create a new Post object with the form data and set the current user as the author
-        post = Post(title=form.title.data, content=form.content.data, author=current_user)
+        # current_user is a cached snapshot rather than a User, so the author is set by id
+        post = Post(title=form.title.data, content=form.content.data, user_id=current_user.id)
         # Add the new post to the database session
         db.session.add(post)
+        # Flush to get the post's id, then file it under its tags with a single bulk upsert
+        db.session.flush()
+        set_post_tags(post, parse_tags(form.tags.data))
+        # Start the post's revision history with a snapshot of its first version
+        record_revision(post)
+        # Bump the author's and the global post counts in the same transaction as the insert
+        # The increment is done in SQL so concurrent posts by the same author can't lose an update
+        db.session.execute(db.update(User).where(User.id == current_user.id).values(post_count=User.post_count + 1))
+        Counter.increment('post_total')
+        count_archive_post(post.date_posted)
+        Counter.increment('feed_version')
+        # Publishing a draft removes it
+        if form.draft_id.data is not None:
+            db.session.execute(db.delete(Draft).where(Draft.id == form.draft_id.data, Draft.user_id == current_user.id))
         # Commit the changes to the database
         db.session.commit()
+        # Make sure a buffered autosave can't outlive the draft
+        if form.draft_id.data is not None:
+            draft_buffer.discard(current_user.id, form.draft_id.data)
+        # Notify listeners (e.g. the response cache) that a new post exists
+        signals.post_created.send(current_app._get_current_object(), post=post, author=current_user._get_current_object())
         # Flash a success message to the user
         flash('Your post has been created!', 'success')
         # Redirect the user to the home page
         return redirect(url_for('main.home'))  # Adjust the redirect if necessary
+    # Continue writing a draft, e.g. /post/new?draft=3
+    elif request.method == 'GET' and 'draft' in request.args:
+        draft = Draft.query.filter_by(id=request.args.get('draft', type=int), user_id=current_user.id).first_or_404()
+        # An autosave this worker hasn't written yet is newer than the stored draft
+        state = draft_buffer.pending(current_user.id, draft.id) or {
+            'title': draft.title, 'content': draft.content, 'tags': draft.tags}
+        form.title.data = state['title']
+        form.content.data = state['content']
+        form.tags.data = state['tags']
+        form.draft_id.data = draft.id
 
+    # List the user's latest drafts next to the editor, without loading their content
+    drafts = (Draft.query.options(db.load_only(Draft.id, Draft.title, Draft.date_saved))
+              .filter_by(user_id=current_user.id)
+              .order_by(Draft.date_saved.desc())
+              .limit(10)
+              .all())
     # Render the create_post.html template, passing in the form data and a legend
-    return render_template('create_post.html', title='New Post', form=form, legend='New Post')
+    # The editor autosaves to a draft while the post is being written
+    return render_template('create_post.html', title='New Post', form=form, legend='New Post', drafts=drafts,
+                           autosave_interval=current_app.config['DRAFT_AUTOSAVE_INTERVAL'])
+
+# Define the autosave endpoint of the post editor, which requires the user to be logged in
+@posts.route("/drafts/autosave", methods=['POST'])
+@login_required  # This decorator ensures that the user must be logged in to access this route
+def autosave_draft():
+    # Drafts may be incomplete, so the fields aren't validated, only cut to the column sizes
+    title = request.form.get('title', '')[:Draft.title.type.length]
+    content = request.form.get('content', '')
+    tags = request.form.get('tags', '')[:Draft.tags.type.length]
+    draft_id = request.form.get('draft_id', type=int)
+    if draft_id is None:
+        # The first autosave of a new post creates its draft, so the editor gets an id to save to
+        draft = Draft(user_id=current_user.id, title=title, content=content, tags=tags)
+        db.session.add(draft)
+        db.session.commit()
+        draft_id = draft.id
+    else:
+        # Later autosaves only replace the draft's buffered state, which is written in batches
+        # The flush matches on the user as well, so saving to someone else's draft does nothing
+        draft_buffer.save(current_user.id, draft_id, title, content, tags)
+    return jsonify(draft_id=draft_id)
+
+# Define the route for deleting a draft, which requires the user to be logged in
+@posts.route("/drafts/<int:draft_id>/delete", methods=['POST'])
+@login_required  # This decorator ensures that the user must be logged in to access this route
+def delete_draft(draft_id):
+    # Delete the draft in a single statement that only matches if the current user wrote it
+    deleted = db.session.execute(db.delete(Draft).where(Draft.id == draft_id, Draft.user_id == current_user.id)).rowcount
+    if not deleted:
+        abort(404)
+    db.session.commit()
+    draft_buffer.discard(current_user.id, draft_id)
+    # Flash a success message to the user
+    flash('Your draft has been deleted!', 'success')
+    # Redirect the user back to the editor
+    return redirect(url_for('posts.new_post'))
+
+# Make the cached card renderer available to every template as post_cards(posts)
+@posts.app_template_global('post_cards')
+def post_cards(posts, detail=False):
+    return render_post_cards(posts, detail=detail)
+
+# Cheap validator for the post page: the post's version and view count, its author's username and avatar,
+# and the version of its related posts, bumped when the batch job rewrites them
+def post_state(post_id):
+    row = (db.session.query(Post.version, Post.views, User.username, User.image_file, Post.related_version)
+           .join(Post.author).filter(Post.id == post_id).first())
+    # Unknown posts fall through to the view, which answers with a 404
+    # A new Markdown renderer changes the page without touching the post
+    return None if row is None else (tuple(row) + (CURRENT_RENDERER,), None)
 
 # Define the route for viewing a post by its ID
 @posts.route("/post/<int:post_id>")
+@view_counter.counted  # Counts cached pages and 304s too, without touching the database
+@conditional(post_state)  # Unchanged posts are answered with a 304 before the page is built
+@response_cache.cached('post:{post_id}')  # Anonymous visitors get a cached copy until the post changes
+@query_budget(4)  # The post with its author, its related posts, the logged-in user, and a one-off re-render
 def post(post_id):
+    # Query the database for the post with the given ID, joining in its author
+    post = Post.query.options(db.joinedload(Post.author)).filter_by(id=post_id).first_or_404()
+    # Posts rendered by an older Markdown renderer are re-rendered once, on their first view
+    if post.refresh_html():
+        db.session.commit()
+    # The page also shows the author's username and avatar
+    response_cache.tag(f'user:{post.author.username}')
+    # Add the views this worker counted but hasn't written yet, including this one
+    views = post.views + view_counter.pending(post.id)
+    # Precomputed by `flask posts update-related`, so this is a single indexed lookup
+    related = related_posts(post.id)
+    # Render the post.html template, passing in the post data
+    return render_template('post.html', title=post.title, post=post, views=views, related=related)
+
+# Define the route for a post's revision history, e.g. /post/1/history?version=3
+@posts.route("/post/<int:post_id>/history")
+@response_cache.cached('post:{post_id}')  # Every edit adds a revision and invalidates the post's pages
+@query_budget(4)  # The post, its list of revisions, the chain rebuilding the selected one, and the logged-in user
+def post_history(post_id):
     # Query the database for the post with the given ID
     post = Post.query.get_or_404(post_id)
-    # Render the post.html template, passing in the post data
-    return render_template('post.html', title=post.title, post=post)
+    # List the revisions without loading their data, newest first
+    revisions = (db.session.query(PostRevision.version, PostRevision.title, PostRevision.date_edited,
+                                  PostRevision.snapshot, db.func.length(PostRevision.data).label('size'))
+                 .filter_by(post_id=post_id)
+                 .order_by(PostRevision.version.desc())
+                 .all())
+    # Show the latest recorded version unless another one was asked for
+    selected = revisions[0] if revisions else None
+    version = request.args.get('version', type=int)
+    if version is not None:
+        selected = next((revision for revision in revisions if revision.version == version), None)
+        if selected is None:
+            abort(404)
+    # Rebuild it from one snapshot plus the deltas after it, applied in order
+    content = rebuild_content(revision_chain(post_id, selected.version)) if selected else None
+    # Render the post_history.html template with the revisions and the selected one's content
+    return render_template('post_history.html', title=f'History of {post.title}', post=post,
+                           revisions=revisions, selected=selected, content=content)
 
 # Define the route for updating a post, which requires the user to be logged in
 @posts.route("/post/<int:post_id>/update", methods=['GET', 'POST'])
 @login_required  # This decorator ensures that the user must be logged in to access this route
 def update_post(post_id):
-    # Query the database for the post with the given ID
-    post = Post.query.get_or_404(post_id)
-    # Check if the current user is the author of the post
-    if post.author != current_user:
-        # If not, abort the request with a 403 Forbidden error
-        abort(403)
     # Create an instance of the PostForm form
     form = PostForm()
     # Check if the form has been submitted and is valid
     if form.validate_on_submit():
-        # Update the post's title and content with the new data from the form
-        post.title = form.title.data
-        post.content = form.content.data
+        # Update the post in a single statement that only matches if the current user wrote it and,
+        # when the form carries one, if nobody saved the post since the form was filled
+        # Bulk updates skip the content validator, so the excerpt and HTML are set here too
+        statement = db.update(Post).where(Post.id == post_id, Post.user_id == current_user.id)
+        if form.version.data is not None:
+            statement = statement.where(Post.version == form.version.data)
+        # Bump the version so cached cards of this post are re-rendered
+        statement = statement.values(title=form.title.data, content=form.content.data, version=Post.version + 1,
+                                     **Post.derived_columns(form.content.data))
+        # RETURNING hands back the updated post, so it never has to be loaded
+        post = db.session.execute(statement.returning(Post)).scalar_one_or_none()
+        if post is None:
+            # Aborts with 404 or 403, unless the version check failed
+            version = owned_post_version(post_id, current_user.id)
+            # Keep what the user typed; saving again deliberately overwrites the other change
+            # The field would render the submitted (stale) version rather than .data, so drop it
+            form.version.data, form.version.raw_data = version, None
+            flash('This post was changed since you started editing it. '
+                  'Save again to overwrite those changes with yours.', 'warning')
+            return render_template('create_post.html', title='Update Post', form=form, legend='Update Post'), 409
+        # Write only the tags that were added or removed; the post row is already locked by the update
+        set_post_tags(post, parse_tags(form.tags.data))
+        # Keep the previous version recoverable, stored as a delta against the new one's predecessor
+        record_revision(post)
+        Counter.increment('feed_version')
         # Commit the changes to the database
         db.session.commit()
+        # Notify listeners (e.g. the response cache) that the post changed
+        signals.post_updated.send(current_app._get_current_object(), post=post, author=current_user._get_current_object())
         # Flash a success message to the user
         flash('Your post has been updated!', 'success')
         # Redirect the user to the updated post's page
-        return redirect(url_for('posts.post', post_id=post.id))
+        return redirect(url_for('posts.post', post_id=post_id))
+    # Query the database for the post with the given ID
+    post = Post.query.get_or_404(post_id)
+    # Check if the current user is the author of the post, without loading the author
+    if post.user_id != current_user.id:
+        # If not, abort the request with a 403 Forbidden error
+        abort(403)
     # If the request method is GET, populate the form with the post's current data
-    elif request.method == 'GET':
+    if request.method == 'GET':
         # Set the form's title and content fields to the post's current data
         form.title.data = post.title
         form.content.data = post.content
+        form.tags.data = ', '.join(post.tag_list)
+        form.version.data = post.version
     # Render the create_post.html template, passing in the form data and a legend
     return render_template('create_post.html', title='Update Post', form=form, legend='Update Post')
 
@@ -109,27 +292,93 @@ def update_post(post_id):
 @posts.route("/post/<int:post_id>/delete", methods=['POST'])
 @login_required  # This decorator ensures that the user must be logged in to access this route
 def delete_post(post_id):
-    # Query the database for the post with the given ID
-    post = Post.query.get_or_404(post_id)
-    # Check if the current user is the author of the post
-    if post.author != current_user:
-        # If not, abort the request with a 403 Forbidden error
-        abort(403)
-    # Delete the post from the database
-    db.session.delete(post)
+    # Delete the post in a single statement that only matches if the current user wrote it
+    # RETURNING hands back the deleted row, which the counters and listeners below still need
+    post = db.session.execute(db.delete(Post).where(Post.id == post_id, Post.user_id == current_user.id)
+                              .returning(Post)).scalar_one_or_none()
+    if post is None:
+        # Aborts with 404 if there is no such post, or 403 if it belongs to someone else
+        owned_post_version(post_id, current_user.id)
+    # The row is gone: keep the loaded copy for the listeners rather than letting the commit expire it
+    db.session.expunge(post)
+    # Untag the post, which also decrements the tags' post counts
+    write_tag_changes(post.id, post.tag_list, [])
+    # Decrement the author's and the global post counts in the same transaction as the delete
+    db.session.execute(db.update(User).where(User.id == current_user.id).values(post_count=User.post_count - 1))
+    Counter.increment('post_total', -1)
+    count_archive_post(post.date_posted, -1)
+    Counter.increment('feed_version')
     # Commit the changes to the database
     db.session.commit()
+    # Notify listeners (e.g. the response cache) that the post is gone
+    signals.post_deleted.send(current_app._get_current_object(), post=post, author=current_user._get_current_object())
     # Flash a success message to the user
     flash('Your post has been deleted!', 'success')
     # Redirect the user to the home page
     return redirect(url_for('main.home'))  # Adjust the redirect if necessary
 
-# Define the route for viewing posts by a specific user
-@posts.route("/user/<username>")
-def user_posts(username):
-    # Query the database for the user with the given username
+# Atom feed of a single user's posts, served from the cache until one of them changes
+@posts.route("/user/<username>/feed.atom")
+def user_feed(username):
+    def build():
+        # Only runs after a post write, so polls of a cached feed only read the feed version
+        user = User.query.filter_by(username=username).first_or_404()
+        return build_atom_feed(f'Posts by {user.username}',
+                               url_for('posts.user_feed', username=user.username, _external=True),
+                               url_for('users.user_posts', username=user.username, _external=True),
+                               latest_posts(Post.query.filter_by(user_id=user.id)))
+    return atom_feed_response(f'atom:user:{username}', build)
+
+# JSON feed of a single user's posts, paginated with the same cursors as /api/posts
+@posts.route("/api/users/<username>/posts")
+@query_budget(2)  # User lookup and the page of posts
+def api_user_posts(username):
+    # Resolve the username first so unknown users get a 404 rather than an empty list
     user = User.query.filter_by(username=username).first_or_404()
-    # Query the database for all posts by this user
-    posts = Post.query.filter_by(author=user).all()
-    # Render the user_posts.html template, passing in the posts and user data
-    return render_template('user_posts.html', posts=posts, user=user)
+    return posts_api_response(Post.query.filter_by(user_id=user.id))
+
+# Command line: `flask posts render` renders the Markdown of every post whose stored HTML came
+# from another renderer version, e.g. after upgrading the Markdown library, spread over all CPUs
+@posts.cli.command('render')
+@click.option('--all', 'render_all', is_flag=True, help='Re-render every post, not only outdated ones.')
+@click.option('--workers', type=int, default=None, help='Number of worker processes (default: one per CPU).')
+@click.option('--batch-size', type=int, default=500, help='Number of posts read and written per transaction.')
+def render(render_all, workers, batch_size):
+    workers = workers or os.cpu_count() or 1
+    rendered, last_id = 0, 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            # Walk the table in primary key order, so every batch is a cheap index range scan
+            query = db.session.query(Post.id, Post.content).filter(Post.id > last_id)
+            if not render_all:
+                query = query.filter(db.or_(Post.renderer_version.is_(None),
+                                            Post.renderer_version != CURRENT_RENDERER))
+            rows = query.order_by(Post.id).limit(batch_size).all()
+            if not rows:
+                break
+            # Rendering is CPU bound, so it runs in the worker processes rather than in threads
+            html = pool.map(render_markdown, [row.content for row in rows],
+                            chunksize=max(1, len(rows) // (workers * 4)))
+            # Bulk UPDATE by primary key; post.version is left alone as the content didn't change
+            db.session.execute(db.update(Post), [
+                {'id': row.id, 'content_html': content_html, 'renderer_version': CURRENT_RENDERER}
+                for row, content_html in zip(rows, html)
+            ])
+            db.session.commit()
+            rendered += len(rows)
+            last_id = rows[-1].id
+            click.echo(f'Rendered {rendered} posts...')
+    click.echo(f'Done: {rendered} posts rendered with renderer {CURRENT_RENDERER}')
+
+# Command line: `flask posts build-related` recomputes the related posts of every post from scratch
+@posts.cli.command('build-related')
+def build_related_command():
+    count = build_related(current_app.config['RELATED_POSTS_MODEL_PATH'], current_app.config['RELATED_POSTS_COUNT'])
+    click.echo(f'Computed the related posts of {count} posts')
+
+# Command line: `flask posts update-related` only processes the posts created, edited or deleted
+# since the last run; schedule it (e.g. from cron) every few minutes
+@posts.cli.command('update-related')
+def update_related_command():
+    count = update_related(current_app.config['RELATED_POSTS_MODEL_PATH'], current_app.config['RELATED_POSTS_COUNT'])
+    click.echo(f'Recomputed the related posts of {count} posts')
@@ -0,0 +1,225 @@
+import json
+from flask import Response, abort, current_app, render_template, request, stream_with_context, url_for
+from markupsafe import Markup
+from flaskblog import db, fragment_cache, view_counter
+from flaskblog.models import Post, RelatedPost, User
+from flaskblog.pagination import encode_cursor, keyset_query
+from flaskblog.rendering import CURRENT_RENDERER
+
+# Fields a client can ask for with ?fields=..., and the columns each one needs
+API_FIELDS = {
+    'id': (),
+    'title': ('title',),
+    'content': ('content',),
+    'excerpt': ('excerpt',),
+    'date_posted': (),
+    'url': (),
+    'author': ('user_id',),
+    'views': ('views',),
+    'tags': ('tag_names',),
+}
+# The sort key is always loaded, because the cursors are built from it
+API_KEY_COLUMNS = (Post.date_posted, Post.id)
+
+
+def listing_options():
+    """
+    Loader options for listing pages: only the columns a card shows, with the author joined in.
+
+    The full content is left behind; it's only loaded on the post's own page.
+
+    :return: A tuple of options to pass to Query.options().
+    """
+    return (
+        db.load_only(Post.id, Post.title, Post.date_posted, Post.excerpt, Post.user_id, Post.version,
+                     Post.tag_names),
+        db.joinedload(Post.author).load_only(User.id, User.username, User.image_file),
+    )
+
+
+def owned_post_version(post_id, user_id):
+    """
+    Find out why an ownership-checked UPDATE or DELETE of a post matched no row.
+
+    Only called once a write has failed, so successful writes stay a single statement.
+
+    :param post_id: The id of the post.
+    :param user_id: The id of the user who tried to write it.
+    :return: The post's current version if the user owns it, i.e. if the version check failed.
+             Aborts with 404 if the post doesn't exist, and with 403 if it belongs to someone else.
+    """
+    row = db.session.query(Post.user_id, Post.version).filter_by(id=post_id).first()
+    if row is None:
+        abort(404)
+    if row.user_id != user_id:
+        abort(403)
+    return row.version
+
+
+def related_posts(post_id):
+    """
+    Read the precomputed related posts of a post, most similar first.
+
+    :param post_id: The id of the post.
+    :return: A list of (id, title) rows; posts deleted since the last batch job are skipped.
+    """
+    return (db.session.query(Post.id, Post.title)
+            .join(RelatedPost, RelatedPost.related_id == Post.id)
+            .filter(RelatedPost.post_id == post_id)
+            .order_by(RelatedPost.rank)
+            .all())
+
+
+def post_card_key(post, detail=False):
+    """
+    Build the fragment cache key of a post card.
+
+    The key changes whenever anything shown on the card changes: the post's version is
+    bumped on every edit, the author's username and avatar are part of the key itself, and
+    so is the Markdown renderer that produced the HTML of a detail card.
+
+    :param post: The post the card is rendered for.
+    :param detail: Whether this is the full card of the post page rather than a listing card.
+    :return: The cache key as a string.
+    """
+    variant = f'detail:{CURRENT_RENDERER}' if detail else 'list'
+    author = post.author
+    return f"card:{variant}:{post.id}:{post.version}:{author.id}:{author.username}:{author.image_file}"
+
+
+def render_post_cards(posts, detail=False):
+    """
+    Render the <article> cards of a list of posts, reusing cached fragments where possible.
+
+    All cards of a page are looked up in one cache round trip, and only the misses are rendered.
+
+    :param posts: The posts to render, with their authors already loaded.
+    :param detail: Whether to render the full card of the post page.
+    :return: A list of rendered cards, in the same order as posts.
+    """
+    keys = [post_card_key(post, detail) for post in posts]
+    cards = fragment_cache.cache.get_many(keys)
+
+    # Render only the cards that are missing or whose post or author changed
+    rendered = {}
+    for i, (post, card) in enumerate(zip(posts, cards)):
+        if card is None:
+            card = render_template('_post_card.html', post=post, detail=detail)
+            rendered[keys[i]] = card
+            cards[i] = card
+    if rendered:
+        fragment_cache.cache.set_many(rendered)
+
+    # The fragments were escaped when they were rendered, so they are safe to insert as-is
+    return [Markup(card) for card in cards]
+
+
+def parse_api_fields(value):
+    """
+    Parse the ?fields= query parameter of the JSON API.
+
+    :param value: A comma separated list of field names, or None for all fields.
+    :return: A tuple of field names. Aborts with 400 on unknown fields.
+    """
+    if not value:
+        return tuple(API_FIELDS)
+    fields = tuple(field.strip() for field in value.split(',') if field.strip())
+    if not fields or any(field not in API_FIELDS for field in fields):
+        abort(400)
+    return fields
+
+
+def post_to_dict(post, fields):
+    """
+    Serialize a post for the JSON API.
+
+    :param post: The post to serialize, with its author loaded if 'author' is requested.
+    :param fields: The field names to include.
+    :return: A dict that can be passed to json.dumps.
+    """
+    data = {}
+    for field in fields:
+        if field == 'date_posted':
+            data[field] = post.date_posted.isoformat()
+        elif field == 'url':
+            data[field] = url_for('posts.post', post_id=post.id, _external=True)
+        elif field == 'author':
+            data[field] = {
+                'id': post.author.id,
+                'username': post.author.username,
+                'image_url': url_for('static', filename='profile_pics/' + post.author.image_file, _external=True),
+            }
+        elif field == 'tags':
+            data[field] = post.tag_list
+        elif field == 'views':
+            # Include the views still buffered in this worker
+            data[field] = post.views + view_counter.pending(post.id)
+        else:
+            data[field] = getattr(post, field)
+    return data
+
+
+def posts_api_response(query):
+    """
+    Answer a JSON API request for a list of posts, paginated with keyset cursors.
+
+    Reads cursor, limit and fields from the query string. Only the requested columns are
+    loaded and authors are embedded with a join, so the cost per page is a single query.
+    Pages larger than API_STREAM_THRESHOLD are streamed as they are read from the database.
+
+    :param query: The base post query, e.g. filtered to one author, without an ORDER BY clause.
+    :return: A Flask Response.
+    """
+    fields = parse_api_fields(request.args.get('fields'))
+    limit = request.args.get('limit', 20, type=int)
+    limit = max(1, min(limit, current_app.config['API_MAX_LIMIT']))
+    cursor = request.args.get('cursor')
+
+    # Load just the columns behind the requested fields, plus the sort key
+    columns = {column for field in fields for column in API_FIELDS[field]}
+    query = query.options(db.load_only(*API_KEY_COLUMNS, *[getattr(Post, c) for c in columns]))
+    if 'author' in fields:
+        # Embed every author of the page through one join instead of one query per post
+        query = query.options(db.joinedload(Post.author))
+
+    direction, query = keyset_query(query, API_KEY_COLUMNS, cursor, limit)
+
+    def key(post):
+        return (post.date_posted, post.id)
+
+    if direction == 'prev' or limit <= current_app.config['API_STREAM_THRESHOLD']:
+        rows = query.all()
+        more = len(rows) > limit
+        rows = rows[:limit]
+        if direction == 'prev':
+            # Rows came back oldest first; put them back in feed order
+            rows.reverse()
+        has_next = more if direction != 'prev' else bool(rows)
+        has_prev = more if direction == 'prev' else direction == 'next'
+        body = {
+            'items': [post_to_dict(post, fields) for post in rows],
+            'next_cursor': encode_cursor(key(rows[-1]), 'next') if rows and has_next else None,
+            'prev_cursor': encode_cursor(key(rows[0]), 'prev') if rows and has_prev else None,
+        }
+        return Response(json.dumps(body, separators=(',', ':')), mimetype='application/json')
+
+    def generate():
+        # Emit the JSON document piece by piece so a large page never sits in memory as one list
+        first = last = None
+        count = 0
+        yield '{"items":['
+        for post in query.yield_per(200):
+            if count == limit:
+                # This is the extra look-ahead row: there is a next page
+                break
+            yield (',' if count else '') + json.dumps(post_to_dict(post, fields), separators=(',', ':'))
+            first = first or key(post)
+            last = key(post)
+            count += 1
+        else:
+            last = None  # Ran out of rows before the look-ahead, so this is the last page
+        next_cursor = encode_cursor(last, 'next') if last else None
+        prev_cursor = encode_cursor(first, 'prev') if first and direction == 'next' else None
+        yield '],"next_cursor":' + json.dumps(next_cursor) + ',"prev_cursor":' + json.dumps(prev_cursor) + '}'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
@@ -0,0 +1,90 @@
+from contextlib import contextmanager
+from functools import wraps
+from flask import current_app, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class QueryBudgetExceeded(AssertionError):
+    """
+    Raised when a view issues more SQL statements than its declared budget allows.
+
+    It subclasses AssertionError so that a test hitting an over-budget route fails
+    instead of being reported as an application error.
+    """
+
+
+class QueryCounter:
+    """
+    Collects the SQL statements executed while it is active.
+
+    Attributes:
+    - statements: The SQL text of every statement executed, in order.
+    """
+
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self):
+        """
+        The number of statements executed so far.
+        """
+        return len(self.statements)
+
+
+# Listen on the Engine class so that every engine Flask-SQLAlchemy creates is covered
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    # Outside of an app context nobody can be counting
+    if not has_app_context():
+        return
+    # Feed the statement to every counter that is currently open
+    for counter in g.get('_query_counters', ()):
+        counter.statements.append(statement)
+
+
+@contextmanager
+def count_queries():
+    """
+    Count the SQL statements executed inside the with block.
+
+    :return: A QueryCounter that is updated as statements run.
+    """
+    counter = QueryCounter()
+    # Counters can be nested, so keep a stack of the open ones on g
+    counters = g.setdefault('_query_counters', [])
+    counters.append(counter)
+    try:
+        yield counter
+    finally:
+        counters.remove(counter)
+
+
+def query_budget(max_queries):
+    """
+    Decorate a view with the maximum number of SQL statements it may issue.
+
+    The budget includes lazy loads triggered while rendering the template, so an
+    N+1 regression in a listing shows up as soon as the page has more than one row.
+    Over-budget requests raise QueryBudgetExceeded when the app is testing or
+    QUERY_BUDGET_ENFORCE is set, and are only logged otherwise.
+
+    :param max_queries: The number of statements the view is allowed to run.
+    :return: The decorator.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            with count_queries() as counter:
+                response = view(*args, **kwargs)
+
+            if counter.count > max_queries:
+                message = (f"{request.endpoint} ran {counter.count} queries, "
+                           f"budget is {max_queries}:\n" + "\n".join(counter.statements))
+                if current_app.testing or current_app.config.get('QUERY_BUDGET_ENFORCE'):
+                    raise QueryBudgetExceeded(message)
+                current_app.logger.warning(message)
+            return response
+        return wrapper
+    return decorator
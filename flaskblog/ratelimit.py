@@ -0,0 +1,194 @@
+import math
+import threading
+import time
+from functools import wraps
+from flask import current_app, request
+from werkzeug.exceptions import TooManyRequests
+
+
+def parse_limit(value):
+    """
+    Parse a rate limit written as '<requests>/<seconds>', e.g. '10/300'.
+
+    :param value: The limit.
+    :return: A (limit, window) tuple of ints.
+    """
+    limit, window = value.split('/')
+    return int(limit), int(window)
+
+
+def sliding_window(current, previous, limit, window, offset, counted=True):
+    """
+    Decide on a request from the counts of the current and the previous fixed window.
+
+    The previous window's count is weighted by how much of it still overlaps the sliding
+    window ending now, which approximates a true sliding log with two counters per key.
+
+    :param current: The requests in the current window, including this one.
+    :param previous: The requests in the previous window.
+    :param limit: The number of requests allowed per window.
+    :param window: The window length, in seconds.
+    :param offset: The seconds elapsed since the current window started.
+    :param counted: Whether this request stays counted if it is rejected.
+    :return: 0 if the request is allowed, otherwise the seconds until a retry would be.
+    """
+    weight = 1 - offset / window
+    if previous * weight + current <= limit:
+        return 0
+    # The requests still on the books when the client retries, the retry not included
+    used = current if counted else current - 1
+    if used < limit:
+        # Wait until enough of the previous window has slid out to fit one more request
+        return max(1, math.ceil(window * (1 - (limit - used - 1) / previous) - offset))
+    # Only the next window will let anything through, and this one then weighs on it as its previous
+    return max(1, math.ceil(window - offset + window * (1 - (limit - 1) / max(used, 1))))
+
+
+class MemoryBackend:
+    """
+    Sliding-window counters held in the worker process: (window index, current, previous) per key.
+
+    Keys whose windows have all passed are evicted every evict_interval seconds, so memory
+    is bounded by the number of keys seen in the last two windows.
+    """
+
+    def __init__(self, evict_interval=60):
+        self.evict_interval = evict_interval
+        self._counters = {}  # key -> (window length, window index, current count, previous count)
+        self._lock = threading.Lock()
+        self._next_eviction = time.monotonic() + evict_interval
+
+    def hit(self, key, limit, window, count_rejected=True):
+        now = time.time()
+        index = int(now // window)
+        with self._lock:
+            _, last_index, current, previous = self._counters.get(key, (window, index, 0, 0))
+            if last_index < index:
+                # Roll over: the current window becomes the previous one, unless it is older still
+                current, previous = 0, current if last_index == index - 1 else 0
+            retry_after = sliding_window(current + 1, previous, limit, window, now - index * window,
+                                         counted=count_rejected)
+            if count_rejected or not retry_after:
+                current += 1
+            self._counters[key] = (window, index, current, previous)
+            self._evict()
+        return retry_after
+
+    def _evict(self):
+        # Caller must hold the lock
+        if time.monotonic() < self._next_eviction:
+            return
+        self._next_eviction = time.monotonic() + self.evict_interval
+        now = time.time()
+        self._counters = {key: entry for key, entry in self._counters.items()
+                          if entry[1] >= int(now // entry[0]) - 1}
+
+
+class RedisBackend:
+    """
+    Sliding-window counters shared by all workers and hosts, backed by Redis.
+
+    Each key uses one counter per fixed window, which expires once it can no longer be the
+    previous window. Requires the optional 'redis' package.
+    """
+
+    def __init__(self, url, prefix='flaskblog:ratelimit:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("The 'redis' rate limit backend requires the 'redis' package "
+                               "(pip install redis)")
+        self._client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def hit(self, key, limit, window, count_rejected=True):
+        now = time.time()
+        index = int(now // window)
+        # A single round trip: count this request, and read the previous window's count
+        pipe = self._client.pipeline(transaction=False)
+        pipe.incr(f'{self.prefix}{key}:{index}')
+        pipe.expire(f'{self.prefix}{key}:{index}', window * 2)
+        pipe.get(f'{self.prefix}{key}:{index - 1}')
+        current, _, previous = pipe.execute()
+        retry_after = sliding_window(current, int(previous or 0), limit, window, now - index * window,
+                                     counted=count_rejected)
+        if retry_after and not count_rejected:
+            # Take the rejected request back out; only rejections pay for the extra round trip
+            self._client.decr(f'{self.prefix}{key}:{index}')
+        return retry_after
+
+
+class RateLimiter:
+    """
+    Per-IP and per-account rate limits on sensitive form posts, such as logins.
+
+    The limits of a rule are read from the config as '<requests>/<seconds>', e.g.
+    RATELIMIT_LOGIN_PER_IP and RATELIMIT_LOGIN_PER_ACCOUNT for the 'login' rule. Every POST
+    counts against the client's IP, rejected ones included, so hammering from a blocked
+    address keeps it blocked. Only the requests that get through count against the account,
+    so flooding someone else's account can't keep it locked beyond its limit. Rejections are
+    answered with 429 Too Many Requests before the view runs, i.e. before any database access
+    or password hashing.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Create the counter backend from the app config.
+
+        :param app: The Flask application.
+        """
+        backend = app.config.get('RATELIMIT_BACKEND', 'memory')
+        if backend == 'memory':
+            self.backend = MemoryBackend(app.config.get('RATELIMIT_EVICT_INTERVAL', 60))
+        elif backend == 'redis':
+            if not app.config.get('RATELIMIT_URL'):
+                raise RuntimeError("The 'redis' rate limit backend needs a URL")
+            self.backend = RedisBackend(app.config['RATELIMIT_URL'])
+        elif backend == 'null':
+            self.backend = None
+        else:
+            raise ValueError(f"Unknown rate limit backend: {backend!r}")
+        app.extensions['rate_limiter'] = self
+
+    def limit(self, rule, account_field='email', methods=('POST',)):
+        """
+        Decorate a view so that its POSTs (or other methods) are rate limited per client IP and per account.
+
+        :param rule: The rule's name; its limits are read from RATELIMIT_<RULE>_PER_IP and
+                     RATELIMIT_<RULE>_PER_ACCOUNT.
+        :param account_field: The form field naming the account, compared case-insensitively,
+                              or None to limit per client IP only.
+        :param methods: The request methods that count against the limits.
+        :return: The decorator.
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if request.method in methods and self.backend is not None:
+                    self.check(rule, request.form.get(account_field, '') if account_field else '')
+                return view(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def check(self, rule, account):
+        """
+        Count a request against a rule's limits, aborting with 429 if either is exceeded.
+
+        :param rule: The rule's name.
+        :param account: The account the request is for, e.g. an email address.
+        """
+        checks = [('PER_IP', f'{rule}:ip:{request.remote_addr}', True)]
+        if account:
+            checks.append(('PER_ACCOUNT', f'{rule}:account:{account.strip().lower()}', False))
+        # The IP is checked first, so requests it rejects never reach the account's counter
+        for scope, key, count_rejected in checks:
+            value = current_app.config.get(f'RATELIMIT_{rule.upper()}_{scope}')
+            retry_after = value and self.backend.hit(key, *parse_limit(value), count_rejected=count_rejected)
+            if retry_after:
+                current_app.logger.warning('Rate limit %r exceeded by %s', rule, request.remote_addr)
+                raise TooManyRequests(retry_after=retry_after)
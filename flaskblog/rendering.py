@@ -0,0 +1,150 @@
+import html
+import re
+from html.parser import HTMLParser
+from urllib.parse import urlsplit
+
+try:
+    import markdown
+except ImportError:
+    # Optional dependency: without it, posts are rendered as plain text paragraphs
+    markdown = None
+
+# Bump whenever render_markdown's output changes (new extensions, a different allowlist, ...),
+# so that posts rendered by the old code are re-rendered
+RENDERER_VERSION = 2
+# The version stored with every rendered post; it also changes when the Markdown library does
+CURRENT_RENDERER = (f'{RENDERER_VERSION}+markdown-{markdown.__version__}' if markdown is not None
+                    else f'{RENDERER_VERSION}+plain')
+
+MARKDOWN_EXTENSIONS = ['fenced_code', 'tables', 'sane_lists']
+
+# Tags and attributes that survive sanitizing; everything else is dropped, keeping its text
+ALLOWED_TAGS = {
+    'a', 'abbr', 'b', 'blockquote', 'br', 'code', 'del', 'em', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+    'hr', 'i', 'img', 'li', 'ol', 'p', 'pre', 'strong', 'sub', 'sup', 'table', 'tbody', 'td',
+    'th', 'thead', 'tr', 'ul',
+}
+ALLOWED_ATTRIBUTES = {
+    'a': {'href', 'title'},
+    'abbr': {'title'},
+    'code': {'class'},
+    'img': {'src', 'alt', 'title'},
+    'td': {'align'},
+    'th': {'align'},
+}
+URL_ATTRIBUTES = {'href', 'src'}
+ALLOWED_URL_SCHEMES = {'', 'http', 'https', 'mailto'}
+# Tags whose content must not leak into the page as text either
+DROPPED_CONTENT_TAGS = {'script', 'style', 'iframe', 'object', 'template', 'noscript'}
+VOID_TAGS = {'br', 'hr', 'img'}
+# Void tags that are dropped; they have no content or end tag to wait for
+DROPPED_VOID_TAGS = {'embed', 'param', 'source', 'track'}
+
+
+def _safe_url(url):
+    # Browsers ignore whitespace and control characters in schemes, e.g. "java\nscript:"
+    cleaned = re.sub(r'[\x00-\x20]+', '', url)
+    try:
+        return urlsplit(cleaned).scheme.lower() in ALLOWED_URL_SCHEMES
+    except ValueError:
+        return False
+
+
+class _Sanitizer(HTMLParser):
+    """
+    Rebuild an HTML fragment from its parse, keeping only allowlisted tags and attributes.
+
+    Output is produced from the parsed tokens rather than by editing the input, so anything
+    the parser doesn't recognise as an allowed tag ends up escaped as text.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.open_tags = []
+        # The dropped tags we are inside of; their content is skipped until they end
+        self.dropping = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROPPED_VOID_TAGS:
+            return
+        if tag in DROPPED_CONTENT_TAGS:
+            self.dropping.append(tag)
+            return
+        if self.dropping or tag not in ALLOWED_TAGS:
+            return
+        allowed = ALLOWED_ATTRIBUTES.get(tag, set())
+        rendered = ''
+        for name, value in attrs:
+            if name not in allowed or value is None:
+                continue
+            if name in URL_ATTRIBUTES and not _safe_url(value):
+                continue
+            rendered += f' {name}="{html.escape(value, quote=True)}"'
+        if tag == 'a':
+            # Don't pass on our ranking to links posted by users
+            rendered += ' rel="nofollow noopener"'
+        self.parts.append(f'<{tag}{rendered}>')
+        if tag not in VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def handle_endtag(self, tag):
+        if tag in DROPPED_CONTENT_TAGS:
+            if tag in self.dropping:
+                # Also ends any dropped tags left unclosed inside it
+                del self.dropping[len(self.dropping) - self.dropping[::-1].index(tag) - 1:]
+            return
+        if tag not in self.open_tags:
+            return
+        # Nothing is opened while dropping, so this allowed tag encloses the dropped ones:
+        # an unclosed dropped tag ends with it rather than swallowing the rest of the document
+        self.dropping.clear()
+        # Close any tags left open inside this one, so the output stays well nested
+        while self.open_tags:
+            open_tag = self.open_tags.pop()
+            self.parts.append(f'</{open_tag}>')
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if not self.dropping:
+            self.parts.append(html.escape(data, quote=False))
+
+    def close(self):
+        super().close()
+        while self.open_tags:
+            self.parts.append(f'</{self.open_tags.pop()}>')
+        return ''.join(self.parts)
+
+
+def sanitize_html(fragment):
+    """
+    Strip an HTML fragment down to a safe subset of tags, attributes and URL schemes.
+
+    :param fragment: The untrusted HTML.
+    :return: HTML that is safe to insert into a page as is.
+    """
+    sanitizer = _Sanitizer()
+    sanitizer.feed(fragment)
+    return sanitizer.close()
+
+
+def render_markdown(text):
+    """
+    Render a post's Markdown source to sanitized HTML.
+
+    This is too slow to run on every page view, so the result is stored with the post
+    together with CURRENT_RENDERER.
+
+    :param text: The Markdown source.
+    :return: The sanitized HTML.
+    """
+    text = text or ''
+    if markdown is not None:
+        rendered = markdown.markdown(text, extensions=MARKDOWN_EXTENSIONS, output_format='html')
+    else:
+        # Plain text fallback: blank lines separate paragraphs, single newlines break lines
+        paragraphs = [paragraph.strip() for paragraph in re.split(r'\n\s*\n', text) if paragraph.strip()]
+        rendered = ''.join('<p>%s</p>' % html.escape(paragraph).replace('\n', '<br>\n')
+                           for paragraph in paragraphs)
+    return sanitize_html(rendered)
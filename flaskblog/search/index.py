@@ -0,0 +1,398 @@
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+from array import array
+from collections import Counter as TermCounter
+from flaskblog import db, signals
+from flaskblog.models import Counter, Post
+
+# Snapshot files start with this magic, followed by the length of the JSON header
+SNAPSHOT_MAGIC = b'FBSIDX01'
+SNAPSHOT_PREAMBLE = struct.Struct('<8sQ')
+
+# A title word counts as much as this many content words
+TITLE_WEIGHT = 3
+# BM25 parameters: term frequency saturation and document length normalization
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Term frequencies are stored as unsigned shorts
+MAX_TF = 0xFFFF
+MAX_TOKEN_LENGTH = 64
+
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    """
+    Split text into lowercase word tokens.
+
+    :param text: The text to split, may be None.
+    :return: A list of tokens, in order of appearance.
+    """
+    return [token for token in _TOKEN_RE.findall((text or '').lower()) if len(token) <= MAX_TOKEN_LENGTH]
+
+
+def _term_frequencies(title, content):
+    # Weighted term frequencies and length of a post, title words weighing TITLE_WEIGHT times more
+    frequencies = TermCounter(tokenize(content))
+    title_tokens = tokenize(title)
+    for token in title_tokens:
+        frequencies[token] += TITLE_WEIGHT
+    return frequencies, sum(frequencies.values())
+
+
+class InvertedIndex:
+    """
+    An in-memory inverted index over posts, ranked with BM25.
+
+    Every token maps to a posting list of two parallel compact arrays: the ordinals of the
+    documents containing it (uint32, ascending) and the token's frequency in each (uint16).
+    Ordinals index the post_ids and lengths arrays. Updating or deleting a post only marks its
+    ordinal as deleted and, for an update, appends the post again under a new ordinal, so
+    posting lists are append-only and stay sorted. compact() drops the deleted ordinals.
+
+    A snapshot written by save() can be loaded with load(), which memory-maps the posting
+    arrays instead of reading them, so a large index opens instantly and its pages are shared
+    between the worker processes that load the same file.
+    """
+
+    def __init__(self):
+        self.post_ids = array('I')  # ordinal -> post id
+        self.lengths = array('I')  # ordinal -> weighted document length
+        self.postings = {}  # token -> (ordinals, frequencies)
+        self.live = {}  # post id -> current ordinal
+        self.deleted = set()  # ordinals of removed or superseded documents
+        self.total_length = 0  # sum of the lengths of live documents
+        self._mmap = None
+
+    def __len__(self):
+        return len(self.live)
+
+    def add(self, post_id, title, content):
+        """
+        Index a post, replacing any previously indexed version of it.
+
+        :param post_id: The id of the post.
+        :param title: The post's title.
+        :param content: The post's content.
+        """
+        self.remove(post_id)
+        frequencies, length = _term_frequencies(title, content)
+        ordinal = len(self.post_ids)
+        self.post_ids.append(post_id)
+        self.lengths.append(length)
+        self.live[post_id] = ordinal
+        self.total_length += length
+        for token, frequency in frequencies.items():
+            ordinals, tfs = self._mutable_posting(token)
+            ordinals.append(ordinal)
+            tfs.append(min(frequency, MAX_TF))
+
+    def remove(self, post_id):
+        """
+        Drop a post from the index. Unknown posts are ignored.
+
+        :param post_id: The id of the post.
+        """
+        ordinal = self.live.pop(post_id, None)
+        if ordinal is not None:
+            self.deleted.add(ordinal)
+            self.total_length -= self.lengths[ordinal]
+
+    def search(self, query, limit=10, offset=0):
+        """
+        Rank the posts matching any of the query's tokens with BM25.
+
+        :param query: The user's search terms.
+        :param limit: The maximum number of results.
+        :param offset: The number of results to skip, for pagination.
+        :return: A list of (post_id, score) tuples, best match first.
+        """
+        count = len(self.live)
+        if not count or limit <= 0:
+            return []
+        average_length = self.total_length / count
+        post_ids, lengths, deleted = self.post_ids, self.lengths, self.deleted
+
+        scores = {}
+        for token in set(tokenize(query)):
+            posting = self.postings.get(token)
+            if posting is None:
+                continue
+            ordinals, tfs = posting
+            # Weigh the live documents first: their number is the token's document frequency,
+            # which must not count the deleted ordinals left behind by updates
+            weights = []
+            for ordinal, tf in zip(ordinals, tfs):
+                if ordinal in deleted:
+                    continue
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[ordinal] / average_length)
+                weights.append((ordinal, tf * (BM25_K1 + 1) / (tf + norm)))
+            frequency = len(weights)
+            idf = math.log(1 + (count - frequency + 0.5) / (frequency + 0.5))
+            for ordinal, weight in weights:
+                scores[ordinal] = scores.get(ordinal, 0.0) + idf * weight
+
+        # Same tie-break as the SQL backend: newer post ids first
+        best = heapq.nlargest(offset + limit, scores.items(), key=lambda item: (item[1], post_ids[item[0]]))
+        return [(post_ids[ordinal], score) for ordinal, score in best[offset:]]
+
+    def compact(self):
+        """
+        Renumber the live documents and rewrite the posting lists without deleted ordinals.
+        """
+        if not self.deleted:
+            return
+        # Old ordinal -> new ordinal, in the same order so posting lists stay sorted
+        renumbered = {}
+        post_ids, lengths = array('I'), array('I')
+        for ordinal, post_id in enumerate(self.post_ids):
+            if ordinal not in self.deleted:
+                renumbered[ordinal] = len(post_ids)
+                post_ids.append(post_id)
+                lengths.append(self.lengths[ordinal])
+
+        postings = {}
+        for token, (ordinals, tfs) in self.postings.items():
+            kept = [(renumbered[ordinal], tf) for ordinal, tf in zip(ordinals, tfs) if ordinal in renumbered]
+            if kept:
+                postings[token] = (array('I', [o for o, _ in kept]), array('H', [tf for _, tf in kept]))
+
+        self.post_ids, self.lengths, self.postings = post_ids, lengths, postings
+        self.live = {post_id: ordinal for ordinal, post_id in enumerate(post_ids)}
+        self.deleted = set()
+
+    def save(self, path, metadata=None):
+        """
+        Compact the index and write it to a snapshot file, atomically replacing any existing one.
+
+        :param path: The file to write.
+        :param metadata: Extra JSON-serializable values to store in the header.
+        """
+        self.compact()
+        tokens = sorted(self.postings)
+        terms, start = {}, 0
+        for token in tokens:
+            size = len(self.postings[token][0])
+            terms[token] = [start, size]
+            start += size
+
+        header = json.dumps({
+            'byteorder': sys.byteorder,
+            'documents': len(self.post_ids),
+            'postings': start,
+            'terms': terms,
+            'metadata': metadata or {},
+        }, separators=(',', ':')).encode('utf-8')
+        # Pad the header so the uint32 arrays that follow are aligned
+        header += b' ' * (-(SNAPSHOT_PREAMBLE.size + len(header)) % 4)
+
+        temporary = f'{path}.{os.getpid()}.tmp'
+        with open(temporary, 'wb') as f:
+            f.write(SNAPSHOT_PREAMBLE.pack(SNAPSHOT_MAGIC, len(header)))
+            f.write(header)
+            # Arrays and mapped views both expose their raw bytes, so write them as they are
+            f.write(self.post_ids)
+            f.write(self.lengths)
+            for token in tokens:
+                f.write(self.postings[token][0])
+            for token in tokens:
+                f.write(self.postings[token][1])
+        # Readers either see the old snapshot or the new one, never a partial file
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Open a snapshot written by save(), memory-mapping its posting lists.
+
+        :param path: The snapshot file.
+        :return: A (index, metadata) tuple.
+        """
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_length = SNAPSHOT_PREAMBLE.unpack_from(mapped)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not a search index snapshot")
+        offset = SNAPSHOT_PREAMBLE.size
+        header = json.loads(mapped[offset:offset + header_length])
+        if header['byteorder'] != sys.byteorder:
+            raise ValueError(f"{path} was written on a machine with a different byte order")
+        offset += header_length
+
+        documents, total = header['documents'], header['postings']
+        data = memoryview(mapped)
+        index = cls()
+        # Document arrays are small and grow with new posts, so copy them into real arrays
+        index.post_ids.frombytes(data[offset:offset + 4 * documents])
+        offset += 4 * documents
+        index.lengths.frombytes(data[offset:offset + 4 * documents])
+        offset += 4 * documents
+        # Posting lists stay in the mapped file until a write touches them
+        ordinals = data[offset:offset + 4 * total].cast('I')
+        offset += 4 * total
+        tfs = data[offset:offset + 2 * total].cast('H')
+        for token, (start, size) in header['terms'].items():
+            index.postings[token] = (ordinals[start:start + size], tfs[start:start + size])
+
+        index.live = {post_id: ordinal for ordinal, post_id in enumerate(index.post_ids)}
+        index.total_length = sum(index.lengths)
+        index._mmap = mapped
+        return index, header['metadata']
+
+    def _mutable_posting(self, token):
+        # Posting lists loaded from a snapshot are read-only views, copy one on its first write
+        posting = self.postings.get(token)
+        if posting is None:
+            posting = self.postings[token] = (array('I'), array('H'))
+        elif isinstance(posting[0], memoryview):
+            ordinals, tfs = array('I'), array('H')
+            ordinals.frombytes(posting[0].cast('B'))
+            tfs.frombytes(posting[1].cast('B'))
+            posting = self.postings[token] = (ordinals, tfs)
+        return posting
+
+
+def build_post_index():
+    """
+    Index every post in the database.
+
+    :return: A new InvertedIndex.
+    """
+    index = InvertedIndex()
+    # Stream the rows so that building a large index doesn't hold every post in memory
+    rows = db.session.query(Post.id, Post.title, Post.content).order_by(Post.id).yield_per(1000)
+    for post_id, title, content in rows:
+        index.add(post_id, title, content)
+    return index
+
+
+class MemorySearchBackend:
+    """
+    Ranked full-text search answered from an in-process inverted index, for databases
+    without full-text search support.
+
+    The index is built from the post table, or loaded from the snapshot at SEARCH_INDEX_PATH
+    when that is still current, by a background thread in each worker process, started with
+    the worker's first search, so no request waits for it. Until it is ready, searches fall
+    back to an unranked scan of the post table. The post signals keep the index up to date.
+    Like the 'lru' cache backend, each worker process holds its own index and only sees the
+    writes it handled itself, so this backend suits single-process deployments; restarting
+    the workers picks up every write, as a stale snapshot is rebuilt.
+    """
+
+    def __init__(self, app):
+        self.path = app.config.get('SEARCH_INDEX_PATH')
+        self.index = None
+        self._lock = threading.RLock()
+        # Writes handled while the index is being built, replayed into it once it is ready
+        self._pending = None
+        self._worker_pid = None
+        self._app = app
+
+        # Apply every committed post write to the index
+        signals.post_created.connect(self._on_post_written, sender=app)
+        signals.post_updated.connect(self._on_post_written, sender=app)
+        signals.post_deleted.connect(self._on_post_deleted, sender=app)
+
+    def start(self):
+        """
+        Load or build the index in the background, once per worker process.
+        """
+        # Threads don't survive a fork, so a pre-forking server's workers each start their own
+        with self._lock:
+            if self.index is not None or self._worker_pid == os.getpid():
+                return
+            self._worker_pid = os.getpid()
+            self._pending = []
+        threading.Thread(target=self._run, name='search-index', daemon=True).start()
+
+    def _run(self):
+        with self._app.app_context():
+            try:
+                index = self.build()
+            except Exception:
+                self._app.logger.exception('Could not build the search index')
+                with self._lock:
+                    # Let the next search try again
+                    self._pending = self._worker_pid = None
+                return
+            finally:
+                # Don't keep a connection checked out by a thread that is done
+                db.session.remove()
+            with self._lock:
+                for post_id, title, content in self._pending:
+                    if title is None:
+                        index.remove(post_id)
+                    else:
+                        index.add(post_id, title, content)
+                self._pending = None
+                self.index = index
+        self._app.logger.info('Search index ready with %d posts', len(index))
+
+    def build(self):
+        """
+        Load the snapshot if it is still current, or index every post and write a new snapshot.
+
+        :return: A new InvertedIndex.
+        """
+        version = Counter.get('feed_version')
+        if self.path and os.path.exists(self.path):
+            index, metadata = InvertedIndex.load(self.path)
+            # Every post write bumps feed_version, so an unchanged version means an unchanged table
+            if metadata.get('feed_version') == version:
+                return index
+        index = build_post_index()
+        if self.path:
+            index.save(self.path, {'feed_version': version})
+        return index
+
+    def search(self, query, limit=10, offset=0):
+        """
+        Find the posts matching a free-text query, best match first.
+
+        :param query: The user's search terms.
+        :param limit: The maximum number of results.
+        :param offset: The number of results to skip, for pagination.
+        :return: A list of (post_id, score) tuples, higher scores being better matches.
+        """
+        self.start()
+        with self._lock:
+            if self.index is not None:
+                return self.index.search(query, limit, offset)
+        return self._scan(query, limit, offset)
+
+    @staticmethod
+    def _scan(query, limit, offset):
+        # Until the index is ready: the posts containing every term, newest first, all scoring 0
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        conditions = [db.or_(db.func.lower(Post.title).contains(term, autoescape=True),
+                             db.func.lower(Post.content).contains(term, autoescape=True))
+                      for term in terms]
+        rows = (db.session.query(Post.id).filter(*conditions)
+                .order_by(Post.id.desc()).limit(limit).offset(offset))
+        return [(post_id, 0.0) for post_id, in rows]
+
+    def _on_post_written(self, sender, post, **extra):
+        with self._lock:
+            if self.index is not None:
+                self.index.add(post.id, post.title, post.content)
+            elif self._pending is not None:
+                # The build may have read this post before the write
+                self._pending.append((post.id, post.title, post.content))
+            # Writes before the build starts are picked up by the build itself
+
+    def _on_post_deleted(self, sender, post, **extra):
+        with self._lock:
+            if self.index is not None:
+                self.index.remove(post.id)
+            elif self._pending is not None:
+                self._pending.append((post.id, None, None))
@@ -0,0 +1,58 @@
+import click
+from flask import Blueprint, render_template, request, jsonify, current_app, url_for
+from flaskblog.models import Counter
+from flaskblog.querycount import query_budget
+from flaskblog.search.index import build_post_index
+from flaskblog.search.utils import search_posts
+
+# Create a Blueprint instance for the 'search' blueprint
+# This groups the HTML search page and its JSON counterpart
+search = Blueprint('search', __name__)
+
+# Define the route for the search page, e.g. /search?q=flask&page=2
+@search.route("/search")
+@query_budget(3)  # The ranked hits, the page of posts with their authors, and the logged-in user
+def search_page():
+    # Get the search terms and the page of results from the query string
+    query = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    # Run the search only when there is something to look for
+    results, has_next = search_posts(query, page=page) if query else ([], False)
+    # Render the search template with the posts in rank order
+    return render_template('search.html', title='Search', query=query, page=page,
+                           posts=[post for post, _ in results], has_next=has_next)
+
+# JSON version of the search, e.g. /api/search?q=flask&limit=20&page=1
+@search.route("/api/search")
+@query_budget(2)  # The ranked hits, and the page of posts with their authors
+def api_search():
+    query = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    limit = max(1, min(request.args.get('limit', 10, type=int), current_app.config['API_MAX_LIMIT']))
+    results, has_next = search_posts(query, page=page, per_page=limit) if query else ([], False)
+    return jsonify(
+        items=[{
+            'id': post.id,
+            'title': post.title,
+            'excerpt': post.excerpt,
+            'date_posted': post.date_posted.isoformat(),
+            'url': url_for('posts.post', post_id=post.id, _external=True),
+            'author': {'id': post.author.id, 'username': post.author.username},
+            'score': score,
+        } for post, score in results],
+        next_page=page + 1 if has_next else None,
+    )
+
+# Command line: `flask search build-index [PATH]` writes a snapshot of the in-memory index,
+# so that workers using SEARCH_BACKEND=memory start up without indexing every post
+@search.cli.command('build-index')
+@click.argument('path', required=False)
+def build_index(path):
+    path = path or current_app.config.get('SEARCH_INDEX_PATH')
+    if not path:
+        raise click.UsageError('Pass a PATH or set SEARCH_INDEX_PATH')
+    # Record the version first, so a write racing with the build makes the snapshot stale
+    version = Counter.get('feed_version')
+    index = build_post_index()
+    index.save(path, {'feed_version': version})
+    click.echo(f'Indexed {len(index)} posts into {path}')
@@ -0,0 +1,95 @@
+import re
+import threading
+from flaskblog import db
+
+# Statements that set up the SQLite FTS5 index. It is an external-content table, so it stores
+# only the index and reads the text from post; the triggers keep it in step with every write.
+SQLITE_FTS_SETUP = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS post_fts USING fts5("
+    "title, content, content='post', content_rowid='id', tokenize='porter unicode61')",
+    "CREATE TRIGGER IF NOT EXISTS post_fts_insert AFTER INSERT ON post BEGIN "
+    "INSERT INTO post_fts(rowid, title, content) VALUES (new.id, new.title, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS post_fts_delete AFTER DELETE ON post BEGIN "
+    "INSERT INTO post_fts(post_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content); END",
+    "CREATE TRIGGER IF NOT EXISTS post_fts_update AFTER UPDATE OF title, content ON post BEGIN "
+    "INSERT INTO post_fts(post_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content); "
+    "INSERT INTO post_fts(rowid, title, content) VALUES (new.id, new.title, new.content); END",
+]
+
+
+def ensure_sqlite_fts(conn):
+    """
+    Create the FTS5 index and its triggers if they don't exist yet, and index existing posts.
+
+    Development databases are usually made with db.create_all() rather than migrations,
+    so the SQLite backend sets itself up on first use.
+
+    :param conn: A connection to the SQLite database.
+    """
+    exists = conn.execute(db.text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'post_fts'")).scalar()
+    for statement in SQLITE_FTS_SETUP:
+        conn.execute(db.text(statement))
+    if not exists:
+        # Index the posts written before the triggers existed
+        conn.execute(db.text("INSERT INTO post_fts(post_fts) VALUES ('rebuild')"))
+
+
+class SQLSearchBackend:
+    """
+    Ranked full-text search over post titles and contents, done by the database.
+
+    On PostgreSQL it queries the trigger-maintained post.search_vector column through its GIN
+    index, ranking with ts_rank_cd (titles weigh more than contents). On SQLite it uses an FTS5
+    index ranked with bm25. Both indexes are updated by the database on every write.
+    """
+
+    def __init__(self):
+        self._sqlite_ready = False
+        self._lock = threading.Lock()
+
+    def search(self, query, limit=10, offset=0):
+        """
+        Find the posts matching a free-text query, best match first.
+
+        :param query: The user's search terms.
+        :param limit: The maximum number of results.
+        :param offset: The number of results to skip, for pagination.
+        :return: A list of (post_id, score) tuples, higher scores being better matches.
+        """
+        if not query.strip():
+            return []
+
+        if db.session.get_bind().dialect.name == 'postgresql':
+            rows = db.session.execute(db.text(
+                "SELECT post.id, ts_rank_cd(post.search_vector, q) AS score "
+                "FROM post, websearch_to_tsquery('english', :query) AS q "
+                "WHERE post.search_vector @@ q "
+                "ORDER BY score DESC, post.id DESC LIMIT :limit OFFSET :offset"
+            ), {'query': query, 'limit': limit, 'offset': offset})
+            return [(row.id, float(row.score)) for row in rows]
+
+        # Quote every word so that user input can't be parsed as FTS5 query syntax
+        terms = re.findall(r'\w+', query)
+        if not terms:
+            return []
+        match = ' '.join('"%s"' % term for term in terms)
+        # bm25() scores lower for better matches; weigh the title 10x and negate for a common scale
+        rows = db.session.execute(db.text(
+            "SELECT rowid AS id, -bm25(post_fts, 10.0, 1.0) AS score FROM post_fts "
+            "WHERE post_fts MATCH :match ORDER BY score DESC, rowid DESC LIMIT :limit OFFSET :offset"
+        ), {'match': match, 'limit': limit, 'offset': offset})
+        return [(row.id, float(row.score)) for row in rows]
+
+    def prepare(self):
+        """
+        Make sure the index exists before the first search, outside of any view's query budget.
+        """
+        if self._sqlite_ready or db.engine.dialect.name != 'sqlite':
+            return
+        with self._lock:
+            if not self._sqlite_ready:
+                # Use a separate transaction so the setup is committed independently of the request
+                with db.engine.begin() as conn:
+                    ensure_sqlite_fts(conn)
+                self._sqlite_ready = True
@@ -0,0 +1,48 @@
+from flask import current_app
+from flaskblog.models import Post
+from flaskblog.posts.utils import listing_options
+from flaskblog.search.index import MemorySearchBackend
+from flaskblog.search.sql import SQLSearchBackend
+
+
+def init_search(app):
+    """
+    Create the search backend selected by SEARCH_BACKEND and attach it to the app.
+
+    :param app: The Flask application.
+    """
+    backend = app.config.get('SEARCH_BACKEND', 'sql')
+    if backend == 'sql':
+        app.extensions['search'] = SQLSearchBackend()
+        # Set the backend up lazily on the first request, once the database tables exist
+        app.before_request(app.extensions['search'].prepare)
+    elif backend == 'memory':
+        # Builds its index in the background on the first search
+        app.extensions['search'] = MemorySearchBackend(app)
+    else:
+        raise ValueError(f"Unknown search backend: {backend!r}")
+
+
+def search_posts(query, page=1, per_page=10):
+    """
+    Run a ranked full-text search and load the matching posts for display.
+
+    :param query: The user's search terms.
+    :param page: The 1-based page of results.
+    :param per_page: The number of results per page.
+    :return: A (results, has_next) tuple, results being a list of (post, score) tuples.
+    """
+    backend = current_app.extensions['search']
+    # Ask for one extra hit to find out whether there is a next page
+    hits = backend.search(query, limit=per_page + 1, offset=(page - 1) * per_page)
+    has_next = len(hits) > per_page
+    hits = hits[:per_page]
+    if not hits:
+        return [], False
+
+    # Load the whole page of posts in one query, then put them back in rank order
+    posts = Post.query.options(*listing_options()).filter(Post.id.in_([post_id for post_id, _ in hits])).all()
+    by_id = {post.id: post for post in posts}
+    # A post deleted since it was indexed simply drops out of the results
+    results = [(by_id[post_id], score) for post_id, score in hits if post_id in by_id]
+    return results, has_next
@@ -0,0 +1,16 @@
+from blinker import Namespace
+
+# Application signals, sent by the routes after a write has been committed
+# Receivers are connected with the app as sender, e.g. signals.post_created.connect(fn, sender=app)
+_signals = Namespace()
+
+# Sent with post=<Post> and author=<UserSnapshot> (the current user) once a post has been created, updated or deleted
+post_created = _signals.signal('post-created')
+post_updated = _signals.signal('post-updated')
+post_deleted = _signals.signal('post-deleted')
+
+# Sent with user=<User> once a new user has registered
+user_registered = _signals.signal('user-registered')
+
+# Sent with user=<User> and old_username=<str> once a user has changed their account details
+account_updated = _signals.signal('account-updated')
@@ -0,0 +1,48 @@
+from flask import Blueprint, render_template, request, current_app
+from flaskblog import response_cache
+from flaskblog.conditional import conditional
+from flaskblog.models import Counter, Post, Tag, post_tag
+from flaskblog.pagination import keyset_paginate
+from flaskblog.posts.utils import listing_options
+from flaskblog.querycount import query_budget
+from flaskblog.tags.utils import tag_cloud
+
+# Create a Blueprint instance for the 'tags' blueprint
+# This groups the tag cloud and the per-tag post listings
+tags = Blueprint('tags', __name__)
+
+# Cheap validator for the tag pages: every post write and account change bumps feed_version
+def tags_state(**kwargs):
+    return (Counter.get('feed_version'),), None
+
+# Define the route for the tag cloud, e.g. /tags
+@tags.route("/tags")
+@conditional(tags_state)
+@response_cache.cached('feed')  # Any post write may change the counts
+@query_budget(2)  # The most used tags, and the logged-in user
+def all_tags():
+    # Read the maintained per-tag counts instead of grouping post_tag on every request
+    top = (Tag.query.filter(Tag.post_count > 0)
+           .order_by(Tag.post_count.desc(), Tag.name)
+           .limit(current_app.config['TAG_CLOUD_SIZE'])
+           .all())
+    # Render the tags.html template with every tag and its font size
+    return render_template('tags.html', title='Tags', cloud=tag_cloud(top))
+
+# Define the route for the posts carrying a tag, e.g. /tag/flask?cursor=...
+@tags.route("/tag/<name>")
+@conditional(tags_state)
+@response_cache.cached('feed')  # Any post write may add a post to, or remove one from, this tag
+@query_budget(3)  # The tag, the page of posts with their authors, and the logged-in user
+def tag_posts(name):
+    # Look up the tag; tag names are always stored lowercase
+    tag = Tag.query.filter_by(name=name.lower()).first_or_404()
+    # Go through the (tag_id, post_id) index, loading only the card columns and the authors in one query
+    query = (Post.query.options(*listing_options())
+             .join(post_tag, post_tag.c.post_id == Post.id)
+             .filter(post_tag.c.tag_id == tag.id))
+    # Same keyset pagination as the home feed, with the maintained count as the total
+    posts = keyset_paginate(query, (Post.date_posted, Post.id),
+                            cursor=request.args.get('cursor'), per_page=5, total=tag.post_count)
+    # Render the tag_posts.html template with the tag and its page of posts
+    return render_template('tag_posts.html', title=f'#{tag.name}', tag=tag, posts=posts)
@@ -0,0 +1,114 @@
+import math
+import re
+from sqlalchemy.dialects import postgresql, sqlite
+from flaskblog import db
+from flaskblog.models import MAX_TAGS, MAX_TAG_LENGTH, Tag, post_tag
+
+_TAG_RE = re.compile(r'^[\w-]+$')
+
+
+def parse_tags(value):
+    """
+    Parse the tag input of the post form.
+
+    Tags are separated by commas or whitespace, a leading '#' is ignored, and names are
+    lowercased so that 'Flask' and 'flask' are the same tag.
+
+    :param value: The raw input, e.g. 'flask, #python sql'.
+    :return: The list of unique tag names, in input order.
+    :raises ValueError: If a name is invalid or there are more than MAX_TAGS tags.
+    """
+    names = []
+    for raw in re.split(r'[,\s]+', value or ''):
+        name = raw.lstrip('#').lower()
+        if not name:
+            continue
+        if len(name) > MAX_TAG_LENGTH or not _TAG_RE.match(name):
+            raise ValueError(f"'{raw}' is not a valid tag: use up to {MAX_TAG_LENGTH} letters, digits, '-' or '_'")
+        if name not in names:
+            names.append(name)
+    if len(names) > MAX_TAGS:
+        raise ValueError(f"A post can have at most {MAX_TAGS} tags")
+    return names
+
+
+def _upsert_tags(names):
+    """
+    Build a single INSERT ... ON CONFLICT statement that creates the missing tags, counts one
+    more post on every tag, and returns the ids of all of them.
+
+    :param names: The tag names, sorted so concurrent writers lock the rows in the same order.
+    :return: The statement.
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        insert = postgresql.insert
+    elif dialect == 'sqlite':
+        insert = sqlite.insert
+    else:
+        raise RuntimeError(f"Tag upserts are not supported on {dialect}")
+    table = Tag.__table__
+    statement = insert(table).values([{'name': name, 'post_count': 1} for name in names])
+    statement = statement.on_conflict_do_update(index_elements=[table.c.name],
+                                                set_={'post_count': table.c.post_count + 1})
+    return statement.returning(table.c.id)
+
+
+def write_tag_changes(post_id, current, names):
+    """
+    Move a post from its current tags to new ones as part of the current transaction.
+
+    Only the difference is written: one upsert for the added tags (which also bumps their post
+    counts) plus one bulk insert into post_tag, and one delete plus one count decrement for the
+    removed tags, however many tags are involved. The post's tag_names column is left alone.
+
+    :param post_id: The id of the post.
+    :param current: The post's current tag names.
+    :param names: The new tag names, as returned by parse_tags.
+    """
+    added = sorted(set(names) - set(current))
+    removed = sorted(set(current) - set(names))
+
+    if added:
+        tag_ids = db.session.execute(_upsert_tags(added)).scalars().all()
+        db.session.execute(post_tag.insert(), [{'post_id': post_id, 'tag_id': tag_id} for tag_id in tag_ids])
+    if removed:
+        removed_ids = db.select(Tag.id).where(Tag.name.in_(removed)).scalar_subquery()
+        db.session.execute(post_tag.delete().where(post_tag.c.post_id == post_id,
+                                                   post_tag.c.tag_id.in_(removed_ids)))
+        db.session.execute(db.update(Tag).where(Tag.name.in_(removed))
+                           .values(post_count=Tag.post_count - 1)
+                           .execution_options(synchronize_session=False))
+
+
+def set_post_tags(post, names):
+    """
+    Replace the tags of a post as part of the current transaction, see write_tag_changes.
+
+    :param post: The post, flushed so that it has an id.
+    :param names: The new tag names, as returned by parse_tags.
+    """
+    # The current tags are read from the denormalized column, which saves a query
+    write_tag_changes(post.id, post.tag_list, names)
+    post.tag_names = ','.join(names)
+
+
+def tag_cloud(tags, smallest=0.8, largest=2.0):
+    """
+    Size the tags of a tag cloud by how many posts they have.
+
+    Sizes grow with the logarithm of the post count, so a handful of very popular tags
+    doesn't shrink all the others to the minimum.
+
+    :param tags: The tags to show.
+    :param smallest: The font size of the least used tag, in rem.
+    :param largest: The font size of the most used tag, in rem.
+    :return: A list of (tag, font size) tuples, sorted by tag name.
+    """
+    if not tags:
+        return []
+    low = math.log(min(tag.post_count for tag in tags))
+    high = math.log(max(tag.post_count for tag in tags))
+    spread = (high - low) or 1
+    return [(tag, round(smallest + (largest - smallest) * (math.log(tag.post_count) - low) / spread, 2))
+            for tag in sorted(tags, key=lambda tag: tag.name)]
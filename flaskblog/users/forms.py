@@ -4,12 +4,50 @@ from wtforms.validators import DataRequired, Length, Email, EqualTo, ValidationE
 from flask_wtf.file import FileAllowed
 from flask_login import current_user
 from flaskblog.models import User  # Ensure this is your User model from your models.py
+from flaskblog.users.utils import taken_fields
+
+# Error messages for the fields that must be unique across users
+TAKEN_MESSAGES = {
+    'username': 'That username is taken. Please choose a different one.',
+    'email': 'That email is taken. Please choose a different one.',
+}
+
+# Base class for the forms that set a username and an email
+class UniqueUserForm(FlaskForm):
+    """
+    A form whose username and email must not belong to another user.
+    Both are checked with a single query once the field validators have passed.
+    """
+    
+    def unique_fields(self):
+        """
+        The values to check, see taken_fields.
+        
+        :return: A (username, email, exclude_id) tuple; None skips a check.
+        """
+        return self.username.data, self.email.data, None
+    
+    def check_unique(self):
+        """
+        Check that the username and email are free, adding an error to each taken field.
+        Also used after a unique-constraint violation on commit, to tell the user which field lost the race.
+        
+        :return: True if neither is taken.
+        """
+        taken = taken_fields(*self.unique_fields())
+        for name in taken:
+            getattr(self, name).errors.append(TAKEN_MESSAGES[name])
+        return not taken
+    
+    def validate(self, extra_validators=None):
+        # Only ask the database once the input itself is valid
+        return super().validate(extra_validators) and self.check_unique()
 
 # Define the RegistrationForm class, inheriting from FlaskForm
-class RegistrationForm(FlaskForm):
+class RegistrationForm(UniqueUserForm):
     """
     A form for user registration with fields for username, email, password, and password confirmation.
-    Includes custom validation to check if the username or email already exists in the database.
+    Checks that neither the username nor the email already exists in the database, in one query.
     """
     
     # Username field with validation for required input and length constraints
@@ -29,20 +67,6 @@ class RegistrationForm(FlaskForm):
     
     # Submit button for the registration form
     submit = SubmitField('Sign Up')
-    
-    # Custom validator to check if the username already exists in the database
-    def validate_username(self, username):
-        user = User.query.filter_by(username=username.data).first()
-        if user:
-            # If the username is taken, raise a validation error
-            raise ValidationError('That username is taken. Please choose a different one.')
-    
-    # Custom validator to check if the email already exists in the database
-    def validate_email(self, email):
-        user = User.query.filter_by(email=email.data).first()
-        if user:
-            # If the email is taken, raise a validation error
-            raise ValidationError('That email is taken. Please choose a different one.')
 
 # Define the LoginForm class, inheriting from FlaskForm
 class LoginForm(FlaskForm):
@@ -64,10 +88,10 @@ class LoginForm(FlaskForm):
     submit = SubmitField('Login')
 
 # Define the UpdateAccountForm class, inheriting from FlaskForm
-class UpdateAccountForm(FlaskForm):
+class UpdateAccountForm(UniqueUserForm):
     """
     A form for updating user account information with fields for username, email, and profile picture.
-    Includes custom validation to check if the username or email already exists in the database.
+    Checks that a changed username or email doesn't belong to another user, in one query.
     """
     
     # Username field with validation for required input and length constraints
@@ -84,21 +108,11 @@ class UpdateAccountForm(FlaskForm):
     # Submit button for the account update form
     submit = SubmitField('Update')
     
-    # Custom validator to check if the username already exists in the database, excluding the current user's username
-    def validate_username(self, username):
-        if username.data != current_user.username:
-            user = User.query.filter_by(username=username.data).first()
-            if user:
-                # If the username is taken, raise a validation error
-                raise ValidationError('That username is taken. Please choose a different one.')
-    
-    # Custom validator to check if the email already exists in the database, excluding the current user's email
-    def validate_email(self, email):
-        if email.data != current_user.email:
-            user = User.query.filter_by(email=email.data).first()
-            if user:
-                # If the email is taken, raise a validation error
-                raise ValidationError('That email is taken. Please choose a different one.')
+    # Only the fields the user actually changed are checked; an unchanged form costs no query
+    def unique_fields(self):
+        username = self.username.data if self.username.data != current_user.username else None
+        email = self.email.data if self.email.data.lower() != current_user.email.lower() else None
+        return username, email, current_user.id
 
 # Define the RequestResetForm class, inheriting from FlaskForm
 class RequestResetForm(FlaskForm):
@@ -113,10 +127,11 @@ class RequestResetForm(FlaskForm):
     # Submit button for the password reset request form
     submit = SubmitField('Request Password Reset')
     
-    # Custom validator to check if the email exists in the database
+    # Custom validator to check if the email exists in the database, ignoring case
+    # The user is kept on the form so the view doesn't have to look it up again
     def validate_email(self, email):
-        user = User.query.filter_by(email=email.data).first()
-        if user is None:
+        self.user = User.find_by_email(email.data)
+        if self.user is None:
             # If the email is not found, raise a validation error
             raise ValidationError('There is no account with that email. You must register first.')
 
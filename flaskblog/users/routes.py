@@ -1,11 +1,19 @@
-from flask import Blueprint, render_template, url_for, flash, redirect, request
+import click
+from flask import Blueprint, render_template, url_for, flash, redirect, request, current_app, jsonify
 from flask_login import login_user, current_user, logout_user, login_required
-from flaskblog import db, bcrypt
-from flaskblog.models import User, Post
+from flaskblog import db, password_hasher, rate_limiter, identity_cache, availability
+from flaskblog import signals
+from flaskblog.models import User, Post, Counter
+from flaskblog.passwords import HashingBusy
 from flaskblog.users.forms import (RegistrationForm, LoginForm, 
                                    RequestResetForm, ResetPasswordForm, UpdateAccountForm)
-from flaskblog.users.utils import send_reset_email
+from flaskblog.users.utils import send_reset_email, user_posts_state, taken_fields
+from flaskblog.pagination import offset_paginate
+from flaskblog.posts.utils import listing_options
+from flaskblog.conditional import conditional
+from flaskblog.querycount import query_budget
 from flask import abort
+from sqlalchemy.exc import IntegrityError
 
 # Create a Blueprint for user-related routes
 users = Blueprint('users', __name__)
@@ -19,19 +27,31 @@ def register():
     if current_user.is_authenticated:
         return redirect(url_for('main.home'))
     
+    # Build the availability filter in the background while the user fills in the form
+    availability.start()
+    
     # Instantiate the registration form
     form = RegistrationForm()
     
     # Check if the form is submitted and valid
     if form.validate_on_submit():
-        # Hash the password from the form data
-        hashed_password = bcrypt.generate_password_hash(form.password.data).decode('utf-8')
+        # Hash the password from the form data, on the hashing pool
+        hashed_password = password_hasher.hash(form.password.data)
         # Create a new User object with the form data
         user = User(username=form.username.data, email=form.email.data, image_file='default.jpg', password=hashed_password)
         # Add the new user to the database session
         db.session.add(user)
-        # Commit the session to save the user to the database
-        db.session.commit()
+        try:
+            # Commit the session to save the user to the database
+            db.session.commit()
+        except IntegrityError:
+            # Someone registered the same username or email between the check and the insert
+            db.session.rollback()
+            if form.check_unique():
+                raise
+            return render_template('register.html', title='Register', form=form)
+        # Let the availability filter know the username and email are taken
+        signals.user_registered.send(current_app._get_current_object(), user=user)
         # Flash a success message and redirect to the login page
         flash('Account created! You are now able to log in', 'success')
         return redirect(url_for('users.login'))
@@ -39,7 +59,24 @@ def register():
     # Render the registration template with the form
     return render_template('register.html', title='Register', form=form)
 
+# Live availability check for the registration form, e.g. /api/availability?username=alice or ?email=...
+@users.route("/api/availability")
+@rate_limiter.limit('availability', account_field=None, methods=('GET',))  # Every check reveals whether an account exists
+@query_budget(2)  # The database check when the filter can't rule the value out, and the logged-in user
+def check_availability():
+    # Check the username if one was given, otherwise the email
+    field = 'username' if 'username' in request.args else 'email'
+    value = request.args.get(field, '').strip()
+    # Longer values than the columns hold can't be taken, nor registered
+    max_length = User.__table__.c[field].type.length
+    if not value or len(value) > max_length:
+        abort(400)
+    # Most values are ruled out by the in-memory filter; possible hits are confirmed with one query
+    available = availability.is_available(field, value, lambda field, value: field in taken_fields(**{field: value}))
+    return jsonify(field=field, value=value, available=available)
+
 @users.route("/login", methods=['GET', 'POST'])
+@rate_limiter.limit('login')  # Throttles credential stuffing before any lookup or password check
 def login():
     # Redirect to home if the user is already logged in
     if current_user.is_authenticated:
@@ -50,10 +87,19 @@ def login():
     
     # Check if the form is submitted and valid
     if form.validate_on_submit():
-        # Query the user by the email from the form
-        user = User.query.filter_by(email=form.email.data).first()
-        # Verify the user's password
-        if user and bcrypt.check_password_hash(user.password, form.password.data):
+        # Query the user by the email from the form, ignoring case
+        user = User.find_by_email(form.email.data)
+        # Verify the user's password, on the hashing pool
+        if user and password_hasher.check(user.password, form.password.data):
+            # Upgrade hashes made under an older, weaker work factor while we have the password
+            if password_hasher.needs_rehash(user.password):
+                try:
+                    user.password = password_hasher.hash(form.password.data)
+                    db.session.commit()
+                except HashingBusy:
+                    # The password is already verified, so don't fail the login over this;
+                    # the hash will be upgraded on a later login
+                    current_app.logger.info('Hashing pool busy, postponing the rehash of user %d', user.id)
             # Log in the user and remember them if the 'remember' checkbox is checked
             login_user(user, remember=form.remember.data)
             # Redirect to the next page if specified, otherwise go to the home page
@@ -75,13 +121,20 @@ def logout():
 
 @users.route("/user/<string:username>")
 @login_required
+@conditional(user_posts_state)  # 304 while the user's profile and posts are unchanged
+@query_budget(2)  # User lookup and the page of posts with their author
 def user_posts(username):
     # Get the page number from the request, default to 1
     page = request.args.get('page', 1, type=int)
     # Query the user by username, return 404 if not found
     user = User.query.filter_by(username=username).first_or_404()
     # Query posts by the user, ordered by date, and paginate the results
-    posts = Post.query.filter_by(author=user).order_by(Post.date_posted.desc()).paginate(page=page, per_page=5)
+    # The author is joined in up front so the cards don't lazy-load it one post at a time
+    # The user's maintained post_count stands in for a per-author COUNT(*)
+    posts = offset_paginate(Post.query.options(*listing_options())
+                            .filter_by(author=user)
+                            .order_by(Post.date_posted.desc(), Post.id.desc()),
+                            page=page, per_page=5, total=user.post_count)
     # Render the user_posts template with the user's posts and user object
     return render_template('user_posts.html', posts=posts, user=user)
 
@@ -93,11 +146,26 @@ def account():
     
     # Check if the form is submitted and valid
     if form.validate_on_submit():
-        # Update the current user's username and email with the form data
-        current_user.username = form.username.data
-        current_user.email = form.email.data
-        # Commit the changes to the database
-        db.session.commit()
+        # current_user is a cached snapshot, so load the user itself to change it
+        user = db.session.get(User, current_user.id)
+        # Remember the old username so cached pages under it can be dropped
+        old_username = user.username
+        # Update the user's username and email with the form data
+        user.username = form.username.data
+        user.email = form.email.data
+        # Listings show the username, so their validators must change too
+        Counter.increment('feed_version')
+        try:
+            # Commit the changes to the database
+            db.session.commit()
+        except IntegrityError:
+            # Another user took the new username or email between the check and the update
+            db.session.rollback()
+            if form.check_unique():
+                raise
+            return render_template('account.html', title='Account', form=form)
+        # Let caches (including the cached current_user) know the user's details may have changed
+        signals.account_updated.send(current_app._get_current_object(), user=user, old_username=old_username)
         # Flash a success message and redirect to the account page
         flash('Your account has been updated!', 'success')
         return redirect(url_for('users.account'))
@@ -110,6 +178,7 @@ def account():
     return render_template('account.html', title='Account', form=form)
 
 @users.route("/reset_password", methods=['GET', 'POST'])
+@rate_limiter.limit('reset')  # Caps the reset emails sent per client and per address
 def reset_request():
     # Redirect to home if the user is already logged in
     if current_user.is_authenticated:
@@ -120,10 +189,8 @@ def reset_request():
     
     # Check if the form is submitted and valid
     if form.validate_on_submit():
-        # Query the user by email from the form
-        user = User.query.filter_by(email=form.email.data).first()
-        # Send the password reset email to the user
-        send_reset_email(user)
+        # Send the password reset email to the user the form's validator found
+        send_reset_email(form.user)
         # Flash an info message and redirect to the login page
         flash('An email has been sent with instructions to reset your password.', 'info')
         return redirect(url_for('users.login'))
@@ -149,11 +216,13 @@ def reset_token(token):
     
     # Check if the form is submitted and valid
     if form.validate_on_submit():
-        # Hash the new password from the form data
-        hashed_password = bcrypt.generate_password_hash(form.password.data).decode('utf-8')
+        # Hash the new password from the form data, on the hashing pool
+        hashed_password = password_hasher.hash(form.password.data)
         # Update the user's password in the database
         user.password = hashed_password
         db.session.commit()
+        # Don't let a cached identity outlive the credentials it was loaded with
+        identity_cache.invalidate(user.id)
         # Flash a success message and redirect to the login page
         flash('Your password has been updated! You are now able to log in', 'success')
         return redirect(url_for('users.login'))
@@ -161,6 +230,16 @@ def reset_token(token):
     # Render the reset token template with the form
     return render_template('reset_token.html', title='Reset Password', form=form)
 
+# Command line: `flask users availability-stats` builds the availability filter from the user table
+# and shows its size and estimated false-positive rate; the lookup counts are logged by each worker
+@users.cli.command('availability-stats')
+def availability_stats_command():
+    availability.build()
+    stats = availability.stats()
+    click.echo(f"{stats['keys']} keys in {stats['memory_bytes'] / 1024:.0f} KiB "
+               f"({stats['bits']} bits, {stats['hashes']} hashes), "
+               f"estimated false-positive rate {stats['estimated_fp_rate']:.4%}")
+
 # Error testing routes to trigger specific HTTP error codes
 @errors_test.route('/trigger_401')
 def trigger_401():
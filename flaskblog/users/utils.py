@@ -3,7 +3,8 @@ import secrets
 from PIL import Image
 from flask import url_for, current_app
 from flask_mail import Message
-from flaskblog import mail
+from flaskblog import db, mail
+from flaskblog.models import User, feed_version
 
 def save_picture(form_picture):
     """
@@ -65,3 +66,46 @@ If you did not make this request, please ignore this email and no changes will b
         # Handle and log any exceptions that occur during the email sending process
         print(f"Error sending email: {e}")
         raise  # Re-raise the exception after logging it
+
+def user_posts_state(username):
+    """
+    Cheap validator for a user's posts page, for use with @conditional.
+
+    Combines the user's avatar and post count with the feed version, which every post write
+    bumps, in a single query.
+
+    :param username: The username from the URL.
+    :return: A (state, last_modified) tuple, or None if there is no such user.
+    """
+    row = (db.session.query(User.id, User.image_file, User.post_count, feed_version())
+           .filter(User.username == username).first())
+    # Unknown users fall through to the view, which answers with a 404
+    return None if row is None else (tuple(row), None)
+
+def taken_fields(username=None, email=None, exclude_id=None):
+    """
+    Check whether a username and an email are already in use, in a single query.
+
+    Both checks are EXISTS probes on the username and lower(email) indexes, selected together
+    so a form submit costs one round trip however many fields it checks. Emails are compared
+    case-insensitively.
+
+    :param username: The username to check, or None to skip it.
+    :param email: The email to check, or None to skip it.
+    :param exclude_id: The id of a user whose own username and email don't count, e.g. the one updating their account.
+    :return: The set of field names ('username', 'email') that are taken.
+    """
+    checks = {}
+    if username is not None:
+        checks['username'] = User.username == username
+    if email is not None:
+        checks['email'] = db.func.lower(User.email) == email.lower()
+    # Nothing changed, nothing to ask the database
+    if not checks:
+        return set()
+    flags = []
+    for name, condition in checks.items():
+        conditions = [condition] if exclude_id is None else [condition, User.id != exclude_id]
+        flags.append(db.exists().where(*conditions).label(name))
+    row = db.session.query(*flags).one()
+    return {name for name, taken in zip(checks, row) if taken}
@@ -0,0 +1,37 @@
+"""Add archive months
+
+Revision ID: 0e5a7c2f9d13
+Revises: b61e0c4d8f27
+Create Date: 2024-09-30 16:41:27.905113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0e5a7c2f9d13'
+down_revision = 'b61e0c4d8f27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    archive_month = op.create_table('archive_month',
+    sa.Column('year', sa.SmallInteger(), autoincrement=False, nullable=False),
+    sa.Column('month', sa.SmallInteger(), autoincrement=False, nullable=False),
+    sa.Column('post_count', sa.Integer(), server_default='0', nullable=False),
+    sa.PrimaryKeyConstraint('year', 'month')
+    )
+
+    # Count the existing posts once; from here on the application keeps the counts current
+    post = sa.table('post', sa.column('date_posted', sa.DateTime()))
+    year = sa.extract('year', post.c.date_posted)
+    month = sa.extract('month', post.c.date_posted)
+    op.execute(archive_month.insert().from_select(
+        ['year', 'month', 'post_count'],
+        sa.select(year, month, sa.func.count()).group_by(year, month)))
+
+
+def downgrade():
+    op.drop_table('archive_month')
@@ -0,0 +1,27 @@
+"""Add related_version to post
+
+Revision ID: 2b8e6f1d4c73
+Revises: 4d7e2b9c0a16
+Create Date: 2024-10-09 15:26:03.918204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2b8e6f1d4c73'
+down_revision = '4d7e2b9c0a16'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # A constant server default lets PostgreSQL add the column without rewriting the table
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('related_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.drop_column('related_version')
@@ -0,0 +1,43 @@
+"""Add post counters
+
+Revision ID: 3f1c9a7e2b64
+Revises: 89a937636d5f
+Create Date: 2024-09-08 11:20:13.402117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c9a7e2b64'
+down_revision = '89a937636d5f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('counter',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('value', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('post_count', sa.Integer(), server_default='0', nullable=False))
+
+    # Backfill the counters once, so the application never has to COUNT(*) again
+    op.execute(
+        'UPDATE "user" SET post_count = '
+        '(SELECT count(*) FROM post WHERE post.user_id = "user".id)'
+    )
+    op.execute(
+        "INSERT INTO counter (name, value) SELECT 'post_total', count(*) FROM post"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('post_count')
+
+    op.drop_table('counter')
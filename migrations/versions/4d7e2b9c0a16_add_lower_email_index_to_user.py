@@ -0,0 +1,26 @@
+"""Add lower(email) index to user
+
+Revision ID: 4d7e2b9c0a16
+Revises: 9a4f1b7e3c58
+Create Date: 2024-10-07 10:42:18.274519
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4d7e2b9c0a16'
+down_revision = '9a4f1b7e3c58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.create_index('ix_user_email_lower', [sa.text('lower(email)')], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index('ix_user_email_lower')
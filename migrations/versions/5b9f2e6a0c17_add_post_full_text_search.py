@@ -0,0 +1,99 @@
+"""Add post full-text search
+
+Revision ID: 5b9f2e6a0c17
+Revises: e18b5c3d7f42
+Create Date: 2024-09-18 16:05:22.904417
+
+"""
+from alembic import context, op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '5b9f2e6a0c17'
+down_revision = 'e18b5c3d7f42'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 5000
+
+# Titles are weighted 'A' and contents 'B', so ts_rank_cd ranks title matches higher
+SEARCH_VECTOR = ("setweight(to_tsvector('english', coalesce({row}.title, '')), 'A') || "
+                 "setweight(to_tsvector('english', coalesce({row}.content, '')), 'B')")
+
+# Kept in sync with flaskblog.search.sql.SQLITE_FTS_SETUP
+SQLITE_FTS_SETUP = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS post_fts USING fts5("
+    "title, content, content='post', content_rowid='id', tokenize='porter unicode61')",
+    "CREATE TRIGGER IF NOT EXISTS post_fts_insert AFTER INSERT ON post BEGIN "
+    "INSERT INTO post_fts(rowid, title, content) VALUES (new.id, new.title, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS post_fts_delete AFTER DELETE ON post BEGIN "
+    "INSERT INTO post_fts(post_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content); END",
+    "CREATE TRIGGER IF NOT EXISTS post_fts_update AFTER UPDATE OF title, content ON post BEGIN "
+    "INSERT INTO post_fts(post_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content); "
+    "INSERT INTO post_fts(rowid, title, content) VALUES (new.id, new.title, new.content); END",
+]
+
+
+def upgrade():
+    conn = op.get_bind()
+
+    if conn.dialect.name == 'sqlite':
+        for statement in SQLITE_FTS_SETUP:
+            op.execute(statement)
+        op.execute("INSERT INTO post_fts(post_fts) VALUES ('rebuild')")
+        return
+
+    # A plain nullable column is a catalog-only change, unlike a generated column,
+    # which would rewrite the whole table under an exclusive lock
+    op.add_column('post', sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True))
+
+    # Keep the vector current on every insert and on updates of the searchable columns
+    op.execute(f"""
+        CREATE OR REPLACE FUNCTION post_search_vector_update() RETURNS trigger AS $$
+        BEGIN
+            NEW.search_vector := {SEARCH_VECTOR.format(row='NEW')};
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER post_search_vector_trigger
+        BEFORE INSERT OR UPDATE OF title, content ON post
+        FOR EACH ROW EXECUTE FUNCTION post_search_vector_update()
+    """)
+
+    with op.get_context().autocommit_block():
+        if context.is_offline_mode():
+            # Generated SQL can't look at the data, so backfill in a single statement
+            op.execute(f"UPDATE post SET search_vector = {SEARCH_VECTOR.format(row='post')} "
+                       "WHERE search_vector IS NULL")
+            max_id = 0
+        else:
+            # Fill in existing rows in short, separately committed batches
+            max_id = conn.execute(sa.text("SELECT coalesce(max(id), 0) FROM post")).scalar()
+        for start in range(0, max_id, BATCH_SIZE):
+            conn.execute(sa.text(
+                f"UPDATE post SET search_vector = {SEARCH_VECTOR.format(row='post')} "
+                "WHERE id > :start AND id <= :end AND search_vector IS NULL"
+            ), {'start': start, 'end': start + BATCH_SIZE})
+
+        op.create_index('ix_post_search_vector', 'post', ['search_vector'], unique=False,
+                        postgresql_using='gin', postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade():
+    conn = op.get_bind()
+
+    if conn.dialect.name == 'sqlite':
+        for name in ('post_fts_insert', 'post_fts_delete', 'post_fts_update'):
+            op.execute(f"DROP TRIGGER IF EXISTS {name}")
+        op.execute("DROP TABLE IF EXISTS post_fts")
+        return
+
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_post_search_vector', table_name='post', postgresql_concurrently=True, if_exists=True)
+    op.execute("DROP TRIGGER IF EXISTS post_search_vector_trigger ON post")
+    op.execute("DROP FUNCTION IF EXISTS post_search_vector_update()")
+    op.drop_column('post', 'search_vector')
@@ -0,0 +1,26 @@
+"""Add version to post
+
+Revision ID: 7d2e4b9c1a85
+Revises: 3f1c9a7e2b64
+Create Date: 2024-09-10 09:02:47.118305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d2e4b9c1a85'
+down_revision = '3f1c9a7e2b64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.drop_column('version')
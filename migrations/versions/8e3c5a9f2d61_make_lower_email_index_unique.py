@@ -0,0 +1,57 @@
+"""Make the lower(email) index unique
+
+Revision ID: 8e3c5a9f2d61
+Revises: 2b8e6f1d4c73
+Create Date: 2024-10-10 09:37:44.605172
+
+"""
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e3c5a9f2d61'
+down_revision = '2b8e6f1d4c73'
+branch_labels = None
+depends_on = None
+
+INDEX = 'ix_user_email_lower'
+
+
+def report_duplicate_emails(conn):
+    # Accounts whose emails differ only in case can't be merged automatically: someone has to
+    # decide which one keeps the address, so list them and stop before touching the index
+    rows = conn.execute(sa.text(
+        'SELECT lower(email) AS address, id, username, email FROM "user" '
+        'WHERE lower(email) IN (SELECT lower(email) FROM "user" GROUP BY lower(email) HAVING count(*) > 1) '
+        'ORDER BY address, id'
+    )).fetchall()
+    if rows:
+        accounts = '\n'.join(f'  {row.address}: user {row.id} ({row.username}, {row.email})' for row in rows)
+        raise RuntimeError('These accounts share an email address ignoring case; change or remove all but '
+                           f'one of each before running this migration again:\n{accounts}')
+
+
+def upgrade():
+    if not context.is_offline_mode():
+        report_duplicate_emails(op.get_bind())
+
+    if op.get_bind().dialect.name == 'postgresql':
+        # Build the unique index next to the old one without blocking sign-ups, then swap them
+        with op.get_context().autocommit_block():
+            # A failed concurrent build leaves an invalid index behind, so never reuse one
+            op.drop_index(f'{INDEX}_unique', table_name='user', postgresql_concurrently=True, if_exists=True)
+            op.create_index(f'{INDEX}_unique', 'user', [sa.text('lower(email)')], unique=True,
+                            postgresql_concurrently=True)
+            op.drop_index(INDEX, table_name='user', postgresql_concurrently=True, if_exists=True)
+        op.execute(f'ALTER INDEX {INDEX}_unique RENAME TO {INDEX}')
+    else:
+        with op.batch_alter_table('user', schema=None) as batch_op:
+            batch_op.drop_index(INDEX)
+            batch_op.create_index(INDEX, [sa.text('lower(email)')], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index(INDEX)
+        batch_op.create_index(INDEX, [sa.text('lower(email)')], unique=False)
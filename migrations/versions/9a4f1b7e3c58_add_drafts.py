@@ -0,0 +1,38 @@
+"""Add drafts
+
+Revision ID: 9a4f1b7e3c58
+Revises: 6c2d9a8e1f40
+Create Date: 2024-10-04 13:20:45.631902
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a4f1b7e3c58'
+down_revision = '6c2d9a8e1f40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('draft',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('title', sa.String(length=100), server_default='', nullable=False),
+    sa.Column('content', sa.Text(), server_default='', nullable=False),
+    sa.Column('tags', sa.String(length=310), server_default='', nullable=False),
+    sa.Column('date_saved', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('draft', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_draft_user_id'), ['user_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('draft', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_draft_user_id'))
+
+    op.drop_table('draft')
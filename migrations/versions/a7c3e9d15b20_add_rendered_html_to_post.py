@@ -0,0 +1,30 @@
+"""Add rendered HTML to post
+
+Revision ID: a7c3e9d15b20
+Revises: 5b9f2e6a0c17
+Create Date: 2024-09-20 11:32:07.518364
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c3e9d15b20'
+down_revision = '5b9f2e6a0c17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Both columns start out empty: existing posts are rendered on their first view,
+    # or all at once with `flask posts render`
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('content_html', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('renderer_version', sa.String(length=32), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.drop_column('renderer_version')
+        batch_op.drop_column('content_html')
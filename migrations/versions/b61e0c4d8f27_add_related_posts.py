@@ -0,0 +1,37 @@
+"""Add related posts
+
+Revision ID: b61e0c4d8f27
+Revises: f3b8d2a61c94
+Create Date: 2024-09-27 10:12:03.418527
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b61e0c4d8f27'
+down_revision = 'f3b8d2a61c94'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('related_post',
+    sa.Column('post_id', sa.Integer(), nullable=False),
+    sa.Column('rank', sa.SmallInteger(), autoincrement=False, nullable=False),
+    sa.Column('related_id', sa.Integer(), nullable=False),
+    sa.Column('score', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['post_id'], ['post.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['related_id'], ['post.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('post_id', 'rank')
+    )
+    with op.batch_alter_table('related_post', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_related_post_related_id'), ['related_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('related_post', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_related_post_related_id'))
+
+    op.drop_table('related_post')
@@ -0,0 +1,53 @@
+"""Add composite feed indexes
+
+Revision ID: c4a81f0d6e23
+Revises: 7d2e4b9c1a85
+Create Date: 2024-09-12 14:36:05.774192
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4a81f0d6e23'
+down_revision = '7d2e4b9c1a85'
+branch_labels = None
+depends_on = None
+
+# The home feed seeks on (date_posted, id); per-author listings filter on user_id first.
+# A B-tree can be scanned backwards, so these also serve the DESC orderings.
+INDEXES = [
+    ('ix_post_date_posted_id', ['date_posted', 'id']),
+    ('ix_post_user_id_date_posted', ['user_id', 'date_posted', 'id']),
+]
+# The single-column user_id index is a prefix of the per-author index, which now serves the
+# foreign key lookups as well, so it is dropped to save its upkeep on every post write
+REDUNDANT_INDEX = ('ix_post_user_id', ['user_id'])
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        # CREATE INDEX CONCURRENTLY doesn't block writes to post, but can't run inside a transaction
+        with op.get_context().autocommit_block():
+            for name, columns in INDEXES:
+                op.create_index(name, 'post', columns, unique=False,
+                                postgresql_concurrently=True, if_not_exists=True)
+            op.drop_index(REDUNDANT_INDEX[0], table_name='post', postgresql_concurrently=True, if_exists=True)
+    else:
+        for name, columns in INDEXES:
+            op.create_index(name, 'post', columns, unique=False)
+        op.drop_index(REDUNDANT_INDEX[0], table_name='post')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            # Put the single-column index back before its replacement goes
+            op.create_index(REDUNDANT_INDEX[0], 'post', REDUNDANT_INDEX[1], unique=False,
+                            postgresql_concurrently=True, if_not_exists=True)
+            for name, _ in INDEXES:
+                op.drop_index(name, table_name='post', postgresql_concurrently=True, if_exists=True)
+    else:
+        op.create_index(REDUNDANT_INDEX[0], 'post', REDUNDANT_INDEX[1], unique=False)
+        for name, _ in INDEXES:
+            op.drop_index(name, table_name='post')
@@ -0,0 +1,27 @@
+"""Add views to post
+
+Revision ID: d92f6b0e4a31
+Revises: a7c3e9d15b20
+Create Date: 2024-09-23 09:14:52.301886
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd92f6b0e4a31'
+down_revision = 'a7c3e9d15b20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # A constant server default lets PostgreSQL add the column without rewriting the table
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('views', sa.BigInteger(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.drop_column('views')
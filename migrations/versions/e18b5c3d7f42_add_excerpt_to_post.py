@@ -0,0 +1,60 @@
+"""Add excerpt to post
+
+Revision ID: e18b5c3d7f42
+Revises: c4a81f0d6e23
+Create Date: 2024-09-15 10:48:31.260953
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e18b5c3d7f42'
+down_revision = 'c4a81f0d6e23'
+branch_labels = None
+depends_on = None
+
+# Kept in sync with flaskblog.models.make_excerpt; migrations must not import the app
+EXCERPT_LENGTH = 280
+BATCH_SIZE = 1000
+
+
+def make_excerpt(content, length=EXCERPT_LENGTH):
+    content = (content or '').strip()
+    if len(content) <= length:
+        return content
+    cut = content[:length].rsplit(None, 1)[0]
+    return cut.rstrip() + '…'
+
+
+def upgrade():
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('excerpt', sa.String(length=EXCERPT_LENGTH + 1), server_default='', nullable=False))
+
+    # Backfill in primary key order, one separately committed batch at a time, so row
+    # locks are only held for a batch and no statement has to materialize the whole table
+    conn = op.get_bind()
+    post = sa.table('post', sa.column('id', sa.Integer), sa.column('content', sa.Text),
+                    sa.column('excerpt', sa.String))
+    last_id = 0
+    with op.get_context().autocommit_block():
+        while True:
+            rows = conn.execute(
+                sa.select(post.c.id, post.c.content)
+                .where(post.c.id > last_id)
+                .order_by(post.c.id)
+                .limit(BATCH_SIZE)
+            ).fetchall()
+            if not rows:
+                break
+            conn.execute(
+                post.update().where(post.c.id == sa.bindparam('post_id')).values(excerpt=sa.bindparam('new_excerpt')),
+                [{'post_id': row.id, 'new_excerpt': make_excerpt(row.content)} for row in rows]
+            )
+            last_id = rows[-1].id
+
+
+def downgrade():
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.drop_column('excerpt')
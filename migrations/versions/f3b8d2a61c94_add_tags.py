@@ -0,0 +1,55 @@
+"""Add tags
+
+Revision ID: f3b8d2a61c94
+Revises: d92f6b0e4a31
+Create Date: 2024-09-25 14:27:40.662119
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3b8d2a61c94'
+down_revision = 'd92f6b0e4a31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('tag',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=30), nullable=False),
+    sa.Column('post_count', sa.Integer(), server_default='0', nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    with op.batch_alter_table('tag', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_tag_post_count'), ['post_count'], unique=False)
+
+    op.create_table('post_tag',
+    sa.Column('post_id', sa.Integer(), nullable=False),
+    sa.Column('tag_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['post_id'], ['post.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['tag_id'], ['tag.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('post_id', 'tag_id')
+    )
+    with op.batch_alter_table('post_tag', schema=None) as batch_op:
+        batch_op.create_index('ix_post_tag_tag_id_post_id', ['tag_id', 'post_id'], unique=False)
+
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('tag_names', sa.String(length=310), server_default='', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.drop_column('tag_names')
+
+    with op.batch_alter_table('post_tag', schema=None) as batch_op:
+        batch_op.drop_index('ix_post_tag_tag_id_post_id')
+
+    op.drop_table('post_tag')
+    with op.batch_alter_table('tag', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_tag_post_count'))
+
+    op.drop_table('tag')
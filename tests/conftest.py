@@ -0,0 +1,20 @@
+import os
+
+# Point the app at a throwaway in-memory database before the config is read
+os.environ['DATABASE_URL'] = 'sqlite://'
+
+import pytest
+from flaskblog import create_app, db, view_counter
+
+
+@pytest.fixture
+def app():
+    app = create_app()
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    with app.app_context():
+        db.create_all()
+        yield app
+        # Write counted views while their posts still exist, rather than at exit
+        view_counter.flush()
+        db.session.remove()
+        db.drop_all()
@@ -0,0 +1,62 @@
+from flaskblog import db, response_cache
+from flaskblog.models import Counter, Post, User
+
+
+def test_page_is_served_from_the_cache_until_the_feed_changes(app):
+    client = app.test_client()
+    assert client.get('/').headers['X-Cache'] == 'MISS'
+    assert client.get('/').headers['X-Cache'] == 'HIT'
+
+    # A write handled by another worker bumps the counter without reaching this worker's tags
+    Counter.increment('feed_version')
+    db.session.commit()
+    assert client.get('/').headers['X-Cache'] == 'MISS'
+    assert client.get('/').headers['X-Cache'] == 'HIT'
+
+
+def test_write_during_render_makes_the_page_stale(app):
+    def view():
+        # Stands in for a write committed while the page renders
+        response_cache.invalidate('static')
+        return 'page'
+
+    app.add_url_rule('/static-tag', 'static_tag', response_cache.cached('static')(view))
+    client = app.test_client()
+    assert client.get('/static-tag').headers['X-Cache'] == 'MISS'
+    assert client.get('/static-tag').headers['X-Cache'] == 'MISS'
+
+
+def test_dynamic_tags_are_versioned_when_added(app):
+    writes = []
+
+    def view():
+        response_cache.tag('dynamic')
+        if not writes:
+            writes.append(True)
+            response_cache.invalidate('dynamic')
+        return 'page'
+
+    app.add_url_rule('/dynamic-tag', 'dynamic_tag', response_cache.cached()(view))
+    client = app.test_client()
+    assert client.get('/dynamic-tag').headers['X-Cache'] == 'MISS'
+    # Stamped before the write, so the first copy is never served
+    assert client.get('/dynamic-tag').headers['X-Cache'] == 'MISS'
+    assert client.get('/dynamic-tag').headers['X-Cache'] == 'HIT'
+
+
+def test_post_page_is_not_served_under_a_newer_etag(app):
+    author = User(username='author', email='author@example.com', password='x')
+    post = Post(title='Title', content='Body', author=author)
+    db.session.add(post)
+    db.session.commit()
+    client = app.test_client()
+    first = client.get(f'/post/{post.id}')
+    assert first.headers['X-Cache'] == 'MISS'
+    assert client.get(f'/post/{post.id}').headers['X-Cache'] == 'HIT'
+
+    # A write from another process that this worker's cache tags never hear about
+    post.related_version += 1
+    db.session.commit()
+    second = client.get(f'/post/{post.id}')
+    assert second.headers['X-Cache'] == 'MISS'
+    assert second.headers['ETag'] != first.headers['ETag']
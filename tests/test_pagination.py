@@ -0,0 +1,36 @@
+import base64
+import json
+from datetime import datetime
+import pytest
+from werkzeug.exceptions import BadRequest
+from flaskblog.models import Post
+from flaskblog.pagination import decode_cursor, encode_cursor
+
+COLUMNS = (Post.date_posted, Post.id)
+
+
+def forge(payload):
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+
+
+def test_cursor_round_trip():
+    key = (datetime(2024, 1, 1, 12, 30), 7)
+    assert decode_cursor(encode_cursor(key, 'prev'), COLUMNS) == ('prev', key)
+
+
+@pytest.mark.parametrize('key', [
+    ['2024-01-01T00:00:00', [1, 2]],
+    ['2024-01-01T00:00:00', '1'],
+    ['2024-01-01T00:00:00', True],
+    ['2024-01-01T00:00:00', 1.5],
+    [20240101, 1],
+    {'a': 1, 'b': 2},
+])
+def test_forged_cursor_is_a_bad_request(key):
+    with pytest.raises(BadRequest):
+        decode_cursor(forge({'d': 'n', 'k': key}), COLUMNS)
+
+
+def test_forged_cursor_on_the_home_feed(app):
+    client = app.test_client()
+    assert client.get('/', query_string={'cursor': forge({'d': 'n', 'k': ['2024-01-01T00:00:00', [1, 2]]})}).status_code == 400
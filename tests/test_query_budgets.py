@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta
+import pytest
+from flaskblog import db
+from flaskblog.archive.utils import count_archive_post
+from flaskblog.models import Counter, Post, User
+from flaskblog.tags.utils import set_post_tags
+
+POSTS = 12
+
+
+@pytest.fixture
+def site(app):
+    """
+    Several authors with more than a page of tagged posts spread over two months, written
+    the way new_post writes them, so the maintained counts match the posts.
+    """
+    authors = [User(username=f'author{i}', email=f'author{i}@example.com', password='x') for i in range(3)]
+    db.session.add_all(authors)
+    db.session.flush()
+    start = datetime(2024, 1, 20)
+    for i in range(POSTS):
+        author = authors[i % len(authors)]
+        post = Post(title=f'Post {i}', content=f'Body of post {i}', author=author,
+                    date_posted=start + timedelta(days=3 * i))
+        db.session.add(post)
+        db.session.flush()
+        set_post_tags(post, ['flask', f'topic{i % 4}'])
+        author.post_count += 1
+        Counter.increment('post_total')
+        count_archive_post(post.date_posted)
+    Counter.increment('feed_version')
+    db.session.commit()
+    return authors
+
+
+def log_in(client, user):
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user.id)
+        session['_fresh'] = True
+
+
+# Every listing route, with enough rows that an N+1 query would blow its budget
+LISTINGS = ['/', '/home', '/tag/flask', '/tag/topic1', '/archive/2024/1', '/archive/2024/2', '/api/posts']
+
+
+@pytest.mark.parametrize('url', LISTINGS)
+def test_listing_stays_within_its_query_budget(app, site, url):
+    # TESTING makes an over-budget view raise QueryBudgetExceeded instead of logging
+    assert app.testing
+    response = app.test_client().get(url)
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize('url', LISTINGS)
+def test_listing_stays_within_its_query_budget_when_logged_in(app, site, url):
+    client = app.test_client()
+    log_in(client, site[0])
+    assert client.get(url).status_code == 200
+
+
+@pytest.mark.parametrize('url', ['/', '/tag/flask', '/archive/2024/2', '/api/posts'])
+def test_second_page_stays_within_its_query_budget(app, site, url):
+    client = app.test_client()
+    first = client.get(url, query_string={'limit': 5} if url.startswith('/api') else None)
+    assert first.status_code == 200
+    if url.startswith('/api'):
+        cursor = first.get_json()['next_cursor']
+    else:
+        cursor = first.get_data(as_text=True).split('cursor=')[1].split('"')[0]
+    assert client.get(url, query_string={'cursor': cursor}).status_code == 200
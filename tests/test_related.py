@@ -0,0 +1,46 @@
+import pytest
+from flaskblog import db
+from flaskblog.models import Post, User
+
+pytest.importorskip('numpy')
+pytest.importorskip('scipy')
+
+from flaskblog.posts.related import build_related, update_related  # noqa: E402
+
+POSTS = {
+    1: 'flask blueprint routing',
+    2: 'flask blueprint templates',
+    3: 'python generators iterators',
+    4: 'python generators yield',
+    5: 'sqlite indexes planner',
+    6: 'sqlite indexes vacuum',
+    7: 'redis caching eviction',
+    8: 'redis caching pipelines',
+}
+
+
+def test_only_rewritten_lists_change_their_post_pages(app, tmp_path):
+    author = User(username='author', email='author@example.com', password='x')
+    db.session.add_all(Post(id=post_id, title='', content=content, author=author) for post_id, content in POSTS.items())
+    db.session.commit()
+    path = str(tmp_path / 'related.npz')
+    build_related(path, 1)
+
+    client = app.test_client()
+    etags = {post_id: client.get(f'/post/{post_id}').headers['ETag'] for post_id in POSTS}
+    assert client.get('/post/1').headers['X-Cache'] == 'HIT'
+
+    post = db.session.get(Post, 4)
+    post.content = 'python generators iterators yield'
+    post.version += 1
+    db.session.commit()
+    # Few enough changes for an incremental update rather than a rebuild
+    assert update_related(path, 1) > 0
+
+    # Post 1 neither listed post 4 nor gained it, so its page is still cached and still valid
+    response = client.get('/post/1')
+    assert response.headers['X-Cache'] == 'HIT'
+    assert response.headers['ETag'] == etags[1]
+    response = client.get('/post/4')
+    assert response.headers['X-Cache'] == 'MISS'
+    assert response.headers['ETag'] != etags[4]
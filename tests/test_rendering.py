@@ -0,0 +1,17 @@
+from flaskblog.rendering import sanitize_html
+
+
+def test_embed_is_dropped_without_its_following_content():
+    assert sanitize_html('<p>intro</p><embed src=x><p>the whole rest</p>') == '<p>intro</p><p>the whole rest</p>'
+
+
+def test_unclosed_dropped_tag_ends_with_its_enclosing_tag():
+    assert sanitize_html('<p>a<iframe src=x>secret</p><p>rest</p>') == '<p>a</p><p>rest</p>'
+
+
+def test_dropped_tag_content_is_removed():
+    assert sanitize_html('<p>a<script>alert(1)</script>b<iframe>x</iframe>c</p>') == '<p>abc</p>'
+
+
+def test_nested_dropped_tags_end_with_the_outer_one():
+    assert sanitize_html('<p><object><noscript>x</object>after</p>') == '<p>after</p>'
@@ -0,0 +1,70 @@
+import time
+import pytest
+from flaskblog import db
+from flaskblog.models import Post, User
+from flaskblog.search.index import InvertedIndex, MemorySearchBackend
+
+POSTS = {
+    1: ('Flask tips', 'Blueprints and the application factory'),
+    2: ('Databases', 'Indexes make flask listings fast'),
+    3: ('Python', 'Generators and iterators'),
+}
+
+
+def fresh_index():
+    index = InvertedIndex()
+    for post_id, (title, content) in POSTS.items():
+        index.add(post_id, title, content)
+    return index
+
+
+def test_updates_do_not_change_the_scores():
+    index = fresh_index()
+    # Every update leaves a deleted ordinal behind in the posting lists of the post's tokens
+    for _ in range(10):
+        for post_id, (title, content) in POSTS.items():
+            index.add(post_id, title, content)
+
+    expected = fresh_index().search('flask')
+    assert [post_id for post_id, _ in expected] == [1, 2]
+    results = index.search('flask')
+    assert [post_id for post_id, _ in results] == [post_id for post_id, _ in expected]
+    for (_, score), (_, expected_score) in zip(results, expected):
+        assert score > 0
+        assert score == pytest.approx(expected_score)
+
+
+def test_removed_posts_do_not_count_towards_the_document_frequency():
+    index = fresh_index()
+    index.remove(2)
+    index.add(4, 'Unrelated', 'Nothing to see')
+
+    expected = InvertedIndex()
+    for post_id in (1, 3):
+        expected.add(post_id, *POSTS[post_id])
+    expected.add(4, 'Unrelated', 'Nothing to see')
+    results, expected_results = index.search('flask'), expected.search('flask')
+    assert [post_id for post_id, _ in results] == [post_id for post_id, _ in expected_results] == [1]
+    assert results[0][1] == pytest.approx(expected_results[0][1])
+
+
+def test_memory_backend_searches_the_database_until_its_index_is_built(app):
+    author = User(username='author', email='author@example.com', password='x')
+    db.session.add_all(Post(id=post_id, title=title, content=content, author=author)
+                       for post_id, (title, content) in POSTS.items())
+    db.session.commit()
+    backend = MemorySearchBackend(app)
+
+    # Unranked, newest first, and only posts with every term
+    assert backend._scan('flask', 10, 0) == [(2, 0.0), (1, 0.0)]
+    assert backend._scan('flask blueprints', 10, 0) == [(1, 0.0)]
+
+    # Answered from the database or the index, depending on how far the build got
+    assert sorted(post_id for post_id, _ in backend.search('flask')) == [1, 2]
+    deadline = time.monotonic() + 10
+    while backend.index is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert backend.index is not None
+    results = backend.search('flask')
+    assert [post_id for post_id, _ in results] == [1, 2]
+    assert all(score > 0 for _, score in results)
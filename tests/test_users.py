@@ -0,0 +1,24 @@
+import pytest
+from sqlalchemy.exc import IntegrityError
+from flaskblog import db
+from flaskblog.models import User
+
+
+def add_user(username, email):
+    user = User(username=username, email=email, password='x')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def test_find_by_email_ignores_case(app):
+    user = add_user('alice', 'alice@example.com')
+    assert User.find_by_email('ALICE@Example.com') == user
+    assert User.find_by_email('bob@example.com') is None
+
+
+def test_case_variants_of_an_email_cannot_both_be_committed(app):
+    add_user('alice', 'alice@example.com')
+    # What a sign-up that raced past the form's uniqueness check would commit
+    with pytest.raises(IntegrityError):
+        add_user('Alice2', 'Alice@Example.com')